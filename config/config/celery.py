@@ -16,6 +16,10 @@ app.conf.beat_schedule = {
             day_of_month="1", hour=0, minute=0
         ),  # Первое число каждого месяца
     },
+    "reconcile-stripe-payments": {
+        "task": "users.tasks.reconcile_stripe_payments_task",
+        "schedule": crontab(minute="*/15"),  # Каждые 15 минут
+    },
     #    'block-inactive-users-daily': {
     #        'task': 'users.tasks.block_inactive_users',
     #        'schedule': crontab(hour=0, minute=0),  # Для тестирования, запускаем каждый день.
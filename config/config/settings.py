@@ -21,6 +21,26 @@ ALLOWED_HOSTS = os.getenv("ALLOWED_HOSTS", "localhost,127.0.0.1").split(",")
 
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
 STRIPE_PUBLISHABLE_KEY = os.getenv("STRIPE_PUBLISHABLE_KEY")
+# Секрет подписи вебхука Stripe (whsec_...) для /api/users/stripe/webhook/
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
+# Шлюз Stripe (users.stripe_gateway): адрес API (пусто - api.stripe.com;
+# stripe-mock или заглушка), таймауты подключения и чтения, секунд, число
+# повторов и базовая задержка между ними, размер пула соединений.
+# После STRIPE_BREAKER_THRESHOLD неудачных вызовов подряд вызовы
+# отклоняются сразу STRIPE_BREAKER_RESET_TIMEOUT секунд
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE") or None
+STRIPE_CONNECT_TIMEOUT = float(os.getenv("STRIPE_CONNECT_TIMEOUT", 3))
+STRIPE_READ_TIMEOUT = float(os.getenv("STRIPE_READ_TIMEOUT", 10))
+STRIPE_MAX_RETRIES = int(os.getenv("STRIPE_MAX_RETRIES", 2))
+STRIPE_RETRY_BACKOFF = float(os.getenv("STRIPE_RETRY_BACKOFF", 0.5))
+STRIPE_POOL_SIZE = int(os.getenv("STRIPE_POOL_SIZE", 10))
+STRIPE_BREAKER_THRESHOLD = int(os.getenv("STRIPE_BREAKER_THRESHOLD", 5))
+STRIPE_BREAKER_RESET_TIMEOUT = float(os.getenv("STRIPE_BREAKER_RESET_TIMEOUT", 30))
+# Фоновая сверка платежей со Stripe (users.tasks.reconcile_stripe_payments_task):
+# платежей в пачке и минимальный возраст платежа, секунд - свежие платежи
+# обновит вебхук
+STRIPE_RECONCILE_BATCH_SIZE = int(os.getenv("STRIPE_RECONCILE_BATCH_SIZE", 100))
+STRIPE_RECONCILE_MIN_AGE = int(os.getenv("STRIPE_RECONCILE_MIN_AGE", 600))
 DOMAIN = os.getenv("DOMAIN", "http://localhost:8000")
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +65,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     # DRF
     "django_filters",
     "rest_framework",
@@ -57,6 +78,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым, чтобы общее время включало остальные middleware
+    "materials.timing.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -137,6 +160,18 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+MEDIA_URL = "media/"
+MEDIA_ROOT = BASE_DIR / "media"
+
+# Уменьшенные варианты загруженных изображений (см. materials.thumbnails):
+# размер, обрезка под размер (crop) или вписывание, форматы файлов
+IMAGE_VARIANTS = {
+    "thumb": {"size": (160, 160), "crop": True},
+    "card": {"size": (480, 270), "crop": True},
+    "large": {"size": (1280, 1280), "crop": False},
+}
+IMAGE_VARIANT_FORMATS = ("webp", "jpeg")
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -159,6 +194,33 @@ REST_FRAMEWORK = {
 
 AUTH_USER_MODEL = "users.User"
 
+# Кеш: Redis, если задан CACHE_URL (или REDIS_URL), иначе память процесса
+CACHE_URL = os.getenv("CACHE_URL", os.getenv("REDIS_URL"))
+if CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+            "KEY_PREFIX": "lms",
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Время жизни кешированных ответов курсов и уроков, секунд (0 - без кеша)
+RESPONSE_CACHE_TIMEOUT = int(os.getenv("RESPONSE_CACHE_TIMEOUT", 300))
+
+# Время жизни кеша ролей пользователя между запросами, секунд (0 - без кеша).
+# Сброс при смене групп должен дойти до всех процессов, поэтому нужен общий
+# кеш (CACHE_URL); с кешем в памяти процесса по умолчанию кеш ролей выключен
+PRINCIPAL_ROLES_CACHE_TIMEOUT = int(
+    os.getenv("PRINCIPAL_ROLES_CACHE_TIMEOUT", 300 if CACHE_URL else 0)
+)
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(days=1),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),
@@ -184,3 +246,36 @@ EMAIL_USE_SSL = os.getenv("EMAIL_USE_SSL", "True").lower() == "true"
 EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER", "")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD", "")
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+
+# Рассылка уведомлений об обновлении курса: получателей в одной подзадаче
+# (одно SMTP-соединение) и число повторов подзадачи при ошибках отправки
+NOTIFICATION_CHUNK_SIZE = int(os.getenv("NOTIFICATION_CHUNK_SIZE", 200))
+NOTIFICATION_MAX_RETRIES = int(os.getenv("NOTIFICATION_MAX_RETRIES", 3))
+
+# Уведомление об обновлении курса отправляется через COURSE_NOTIFICATION_DELAY
+# секунд после первой правки и не чаще раза в COURSE_NOTIFICATION_INTERVAL
+COURSE_NOTIFICATION_DELAY = int(os.getenv("COURSE_NOTIFICATION_DELAY", 600))
+COURSE_NOTIFICATION_INTERVAL = int(
+    os.getenv("COURSE_NOTIFICATION_INTERVAL", 4 * 60 * 60)
+)
+
+# Потоковые выгрузки: строк за одно чтение серверного курсора
+# и размер блока ответа в байтах
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 2000))
+EXPORT_BUFFER_SIZE = int(os.getenv("EXPORT_BUFFER_SIZE", 64 * 1024))
+
+# Замер фаз обработки запросов (materials.timing): доля замеряемых запросов
+# от 0 до 1 (0 - выключено) и отдача замеров клиенту в заголовке
+# Server-Timing; замеры всегда пишутся в лог lms.timing
+SERVER_TIMING_SAMPLE_RATE = float(os.getenv("SERVER_TIMING_SAMPLE_RATE", 0))
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "True").lower() == "true"
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "lms.timing": {"handlers": ["console"], "level": "INFO", "propagate": False},
+        "lms.stripe": {"handlers": ["console"], "level": "INFO", "propagate": False},
+    },
+}
@@ -0,0 +1,84 @@
+from decimal import Decimal
+
+from django.db.models import (
+    Count,
+    DecimalField,
+    F,
+    IntegerField,
+    Max,
+    OuterRef,
+    Subquery,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from materials.models import Course, Lesson
+from users.models import Payment, Subscription
+
+# Статус платежа, который считается покупкой курса
+PURCHASE_STATUS = "succeeded"
+
+
+def adjust_course(course_id, touch=False, **deltas):
+    """
+    Инкрементальное изменение агрегатов курса одним UPDATE через F():
+    параллельные изменения не теряются. touch - материалы курса изменились
+    """
+    if course_id is None:
+        return
+    values = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if touch:
+        values["content_updated_at"] = timezone.now()
+    if values:
+        Course.objects.filter(pk=course_id).update(**values)
+
+
+def subquery_aggregate(queryset, aggregate, output_field, default):
+    """Значение агрегата по связанным строкам курса или default"""
+    queryset = queryset.order_by().values("course").annotate(value=aggregate)
+    return Coalesce(
+        Subquery(queryset.values("value"), output_field=output_field),
+        Value(default, output_field=output_field),
+    )
+
+
+def rebuild_course_aggregates(course_ids=None):
+    """
+    Полный пересчет агрегатов курсов одним UPDATE с подзапросами.
+    Без course_ids пересчитываются все курсы. Возвращает число курсов
+    """
+    courses = Course.objects.all()
+    if course_ids is not None:
+        courses = courses.filter(pk__in=course_ids)
+
+    lessons = Lesson.objects.filter(course=OuterRef("pk"))
+    subscriptions = Subscription.objects.filter(course=OuterRef("pk"))
+    purchases = Payment.objects.filter(
+        paid_course=OuterRef("pk"), status=PURCHASE_STATUS
+    ).annotate(course=F("paid_course"))
+    price_field = DecimalField(max_digits=12, decimal_places=2)
+
+    return courses.update(
+        lessons_count=subquery_aggregate(lessons, Count("pk"), IntegerField(), 0),
+        lessons_total_price=subquery_aggregate(
+            lessons, Sum("price"), price_field, Decimal("0")
+        ),
+        content_updated_at=Greatest(
+            F("created_at"),
+            Coalesce(
+                Subquery(
+                    lessons.order_by()
+                    .values("course")
+                    .annotate(value=Max("updated_at"))
+                    .values("value")
+                ),
+                F("created_at"),
+            ),
+        ),
+        subscribers_count=subquery_aggregate(
+            subscriptions, Count("pk"), IntegerField(), 0
+        ),
+        purchases_count=subquery_aggregate(purchases, Count("pk"), IntegerField(), 0),
+    )
@@ -0,0 +1,127 @@
+from abc import ABC, abstractmethod
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from materials.timing import timed_phase
+from users.principal import get_principal
+
+
+class AsyncAPIView(ABC, View):
+    """
+    Базовое асинхронное представление для чтения под ASGI.
+
+    Аутентификация (JWT), роли пользователя и ответ те же, что у DRF:
+    запрос оборачивается в rest_framework.request.Request, а ответ
+    рендерится JSONRenderer. Синхронные части (аутентификация, ORM без
+    async-API, сериализация) выполняются короткими участками через
+    sync_to_async, а запросы к БД - асинхронным ORM, поэтому ожидание
+    медленных клиентов не занимает поток: один ASGI-воркер обслуживает
+    много таких запросов. Подклассы реализуют handle.
+    """
+
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    renderer_class = JSONRenderer
+
+    async def get(self, request, *args, **kwargs):
+        drf_request = Request(
+            request,
+            authenticators=[auth() for auth in self.authentication_classes],
+        )
+        try:
+            await self.authenticate(drf_request)
+            data = await self.handle(drf_request, *args, **kwargs)
+        except Http404:
+            return self.error_response(NotFound(), drf_request)
+        except APIException as exc:
+            return self.error_response(exc, drf_request)
+        if isinstance(data, HttpResponse):
+            return data
+        return self.render(data)
+
+    async def authenticate(self, request):
+        """Пользователь и Principal запроса; аноним получает 401"""
+        with timed_phase("auth"):
+            user = await sync_to_async(lambda: request.user)()
+        if not user.is_authenticated:
+            raise NotAuthenticated()
+        await sync_to_async(get_principal)(request)
+
+    @abstractmethod
+    async def handle(self, request, *args, **kwargs):
+        """
+        Данные ответа или готовый HttpResponse;
+        исключения APIException превращаются в ответы с ошибкой
+        """
+
+    def render(self, data, status_code=status.HTTP_200_OK):
+        with timed_phase("render"):
+            content = self.renderer_class().render(data)
+        return HttpResponse(
+            content, content_type=self.renderer_class.media_type, status=status_code
+        )
+
+    def error_response(self, exc, request):
+        response = self.render({"detail": exc.detail}, exc.status_code)
+        if exc.status_code == status.HTTP_401_UNAUTHORIZED and request.authenticators:
+            response["WWW-Authenticate"] = request.authenticators[
+                0
+            ].authenticate_header(request)
+        return response
+
+
+class AsyncViewSetReadView(AsyncAPIView):
+    """
+    Асинхронные list и retrieve синхронного ViewSet viewset_class.
+
+    Права, область видимости (get_queryset), фильтры, сортировка,
+    пагинация и выбор полей берутся из ViewSet без изменений, поэтому
+    ответ совпадает с синхронным эндпоинтом. Страница списка
+    (apaginate_queryset пагинатора) и объект деталей (afirst) загружаются
+    асинхронным ORM. Кеш ответов и условные GET остаются на синхронных
+    эндпоинтах.
+    """
+
+    viewset_class = None
+
+    def get_viewset(self, request, action, kwargs):
+        return self.viewset_class(
+            request=request,
+            args=(),
+            kwargs=kwargs,
+            format_kwarg=None,
+            action=action,
+        )
+
+    async def handle(self, request, pk=None):
+        if pk is None:
+            return await self.list(request)
+        return await self.retrieve(request, pk)
+
+    async def list(self, request):
+        view = self.get_viewset(request, "list", {})
+        await sync_to_async(view.check_permissions)(request)
+        queryset = await sync_to_async(
+            lambda: view.filter_queryset(view.get_queryset())
+        )()
+        page = await view.paginator.apaginate_queryset(queryset, request, view=view)
+        data = await sync_to_async(lambda: view.get_serializer(page, many=True).data)()
+        return view.get_paginated_response(data).data
+
+    async def retrieve(self, request, pk):
+        view = self.get_viewset(request, "retrieve", {"pk": pk})
+        await sync_to_async(view.check_permissions)(request)
+        queryset = await sync_to_async(
+            lambda: view.filter_queryset(view.get_queryset())
+        )()
+        instance = await queryset.filter(pk=pk).afirst()
+        if instance is None:
+            raise NotFound()
+        await sync_to_async(view.check_object_permissions)(request, instance)
+        return await sync_to_async(lambda: view.get_serializer(instance).data)()
@@ -0,0 +1,218 @@
+import copy
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+from rest_framework.response import Response
+
+
+class BulkModelMixin:
+    """
+    Массовые операции для ModelViewSet на {prefix}/bulk/:
+    POST - список объектов для создания,
+    PATCH - список частичных обновлений, у каждого обязателен id,
+    DELETE - список id.
+
+    Элементы проверяются за один проход тем же сериализатором и теми же
+    проверками прав на объект, что и одиночные запросы. Если ошибка есть
+    хотя бы в одном элементе, ничего не записывается, а в ответе 400
+    перечислены ошибки каждого элемента с его индексом (и id). Запись идет
+    через bulk_create/bulk_update/delete в одной транзакции. bulk_create
+    и bulk_update не отправляют сигналы, поэтому после записи вызывается
+    after_bulk_write.
+    """
+
+    bulk_max_items = 500
+    # Внешние ключи, объекты которых загружаются одним запросом на весь
+    # пакет (поле сериализатора - PrefetchedPrimaryKeyRelatedField)
+    bulk_related_fields = ()
+    bulk_duplicate_message = "Повторяющийся id."
+    bulk_id_required_message = "Обязательное поле."
+
+    @action(detail=False, methods=["post", "patch", "delete"], url_path="bulk")
+    def bulk(self, request, *args, **kwargs):
+        """Массовое создание, обновление или удаление объектов"""
+        handlers = {
+            "POST": self.bulk_create,
+            "PATCH": self.bulk_update,
+            "DELETE": self.bulk_destroy,
+        }
+        return handlers[request.method](request)
+
+    def get_bulk_items(self, request):
+        items = request.data
+        if not isinstance(items, list) or not items:
+            raise ValidationError({"non_field_errors": ["Ожидается непустой список."]})
+        if len(items) > self.bulk_max_items:
+            raise ValidationError(
+                {
+                    "non_field_errors": [
+                        f"Не более {self.bulk_max_items} элементов за запрос."
+                    ]
+                }
+            )
+        return items
+
+    def get_bulk_serializer_context(self, items):
+        """Контекст сериализатора с заранее загруженными связанными объектами"""
+        context = self.get_serializer_context()
+        fields = self.get_serializer_class()(context=context).fields
+        related_objects = {}
+        for name in self.bulk_related_fields:
+            pks = {
+                item[name]
+                for item in items
+                if isinstance(item, dict) and isinstance(item.get(name), (int, str))
+            }
+            queryset = fields[name].get_queryset().filter(pk__in=pks)
+            related_objects[name] = {str(obj.pk): obj for obj in queryset}
+        context["related_objects"] = related_objects
+        return context
+
+    def has_bulk_object_permission(self, obj):
+        return all(
+            permission.has_object_permission(self.request, self, obj)
+            for permission in self.get_permissions()
+        )
+
+    def load_bulk_instances(self, ids):
+        """
+        Объекты для обновления и удаления одним запросом. Ищем в
+        get_queryset(), поэтому чужие объекты для пользователя не существуют
+        """
+        errors = {}
+        seen = set()
+        for index, pk in enumerate(ids):
+            if pk is None:
+                errors[index] = {"id": [self.bulk_id_required_message]}
+            elif not isinstance(pk, int) or isinstance(pk, bool):
+                errors[index] = {"id": ["Ожидается целое число."]}
+            elif pk in seen:
+                errors[index] = {"id": [self.bulk_duplicate_message]}
+            seen.add(pk)
+
+        instances = self.get_queryset().in_bulk(
+            [pk for index, pk in enumerate(ids) if index not in errors]
+        )
+        for index, pk in enumerate(ids):
+            if index in errors:
+                continue
+            instance = instances.get(pk)
+            if instance is None:
+                errors[index] = {"detail": NotFound.default_detail}
+            elif not self.has_bulk_object_permission(instance):
+                errors[index] = {"detail": PermissionDenied.default_detail}
+        return instances, errors
+
+    def bulk_error_response(self, errors, ids=None):
+        return Response(
+            {
+                "errors": [
+                    {
+                        "index": index,
+                        **({"id": ids[index]} if ids is not None else {}),
+                        "errors": error,
+                    }
+                    for index, error in sorted(errors.items())
+                ]
+            },
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    def get_bulk_create_kwargs(self):
+        """Поля, которые назначаются каждому создаваемому объекту"""
+        return {}
+
+    def after_bulk_write(self, instances, previous=()):
+        """
+        Вызывается внутри транзакции после bulk_create/bulk_update.
+        previous - копии обновленных объектов до изменения
+        """
+
+    def bulk_create(self, request):
+        items = self.get_bulk_items(request)
+        context = self.get_bulk_serializer_context(items)
+        serializer_class = self.get_serializer_class()
+
+        serializers, errors = [], {}
+        for index, item in enumerate(items):
+            serializer = serializer_class(data=item, context=context)
+            if not serializer.is_valid():
+                errors[index] = serializer.errors
+            serializers.append(serializer)
+        if errors:
+            return self.bulk_error_response(errors)
+
+        model = serializer_class.Meta.model
+        extra = self.get_bulk_create_kwargs()
+        instances = [
+            model(**serializer.validated_data, **extra) for serializer in serializers
+        ]
+        with transaction.atomic():
+            instances = model.objects.bulk_create(instances)
+            self.after_bulk_write(instances)
+
+        data = serializer_class(instances, many=True, context=context).data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    def bulk_update(self, request):
+        items = self.get_bulk_items(request)
+        ids = [item.get("id") if isinstance(item, dict) else None for item in items]
+        instances, errors = self.load_bulk_instances(ids)
+        context = self.get_bulk_serializer_context(items)
+        serializer_class = self.get_serializer_class()
+
+        changes = []
+        for index, item in enumerate(items):
+            if index in errors:
+                continue
+            instance = instances[ids[index]]
+            data = {key: value for key, value in item.items() if key != "id"}
+            serializer = serializer_class(
+                instance, data=data, partial=True, context=context
+            )
+            if serializer.is_valid():
+                changes.append((instance, serializer.validated_data))
+            else:
+                errors[index] = serializer.errors
+        if errors:
+            return self.bulk_error_response(errors, ids)
+
+        model = serializer_class.Meta.model
+        # bulk_update не вызывает pre_save полей, auto_now заполняем сами
+        now = timezone.now()
+        auto_now_fields = [
+            field.name
+            for field in model._meta.concrete_fields
+            if getattr(field, "auto_now", False)
+        ]
+        fields = set(auto_now_fields)
+        previous, updated = [], []
+        for instance, validated_data in changes:
+            previous.append(copy.copy(instance))
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            for name in auto_now_fields:
+                setattr(instance, name, now)
+            fields.update(validated_data)
+            updated.append(instance)
+
+        with transaction.atomic():
+            model.objects.bulk_update(updated, sorted(fields))
+            self.after_bulk_write(updated, previous)
+
+        data = serializer_class(updated, many=True, context=context).data
+        return Response(data)
+
+    def bulk_destroy(self, request):
+        ids = self.get_bulk_items(request)
+        instances, errors = self.load_bulk_instances(ids)
+        if errors:
+            return self.bulk_error_response(errors, ids)
+
+        # Удаление через QuerySet отправляет post_delete для каждого объекта
+        with transaction.atomic():
+            self.get_queryset().filter(pk__in=list(instances)).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
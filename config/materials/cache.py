@@ -0,0 +1,198 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date
+from rest_framework.response import Response
+
+from users.principal import get_principal
+
+RESPONSE_CACHE_PREFIX = "materials:response"
+MODERATOR_SCOPE = "moderator"
+STATS_KEYS = {
+    "hits": f"{RESPONSE_CACHE_PREFIX}:stats:hits",
+    "misses": f"{RESPONSE_CACHE_PREFIX}:stats:misses",
+}
+
+
+def owner_scope(user_id):
+    return f"owner:{user_id}"
+
+
+def user_scope(user_id):
+    return f"user:{user_id}"
+
+
+def get_version_key(resource, scope):
+    return f"{RESPONSE_CACHE_PREFIX}:version:{resource}:{scope}"
+
+
+def get_versions(pairs):
+    """
+    Текущие версии пространств (ресурс, область видимости).
+    Версия - случайный токен, поэтому вытесненный из кеша ключ
+    не может вернуть старое значение и оживить устаревшие ответы.
+    """
+    keys = [get_version_key(resource, scope) for resource, scope in pairs]
+    versions = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+    if missing:
+        for key, token in missing.items():
+            cache.add(key, token, timeout=None)
+        versions.update(cache.get_many(list(missing)))
+    return [versions.get(key, "") for key in keys]
+
+
+def bump_versions(pairs):
+    """Инвалидация: новые версии для пространств (ресурс, область видимости)"""
+    keys = {
+        get_version_key(resource, scope): uuid.uuid4().hex for resource, scope in pairs
+    }
+    if keys:
+        cache.set_many(keys, timeout=None)
+
+
+def invalidate(pairs):
+    """
+    Инвалидация сразу и повторно после фиксации транзакции: между ними
+    параллельный запрос мог закешировать еще не зафиксированное состояние
+    """
+    pairs = set(pairs)
+    bump_versions(pairs)
+    transaction.on_commit(lambda: bump_versions(pairs))
+
+
+def invalidate_course(owner_id):
+    """
+    Изменился курс или его уроки (они вложены в ответ курса):
+    списки и детали курсов владельца и модераторов
+    """
+    invalidate(
+        [("course", MODERATOR_SCOPE), ("course", owner_scope(owner_id))],
+    )
+
+
+def invalidate_lesson(owner_id):
+    """Изменился урок: списки и детали уроков владельца и модераторов"""
+    invalidate(
+        [("lesson", MODERATOR_SCOPE), ("lesson", owner_scope(owner_id))],
+    )
+
+
+def invalidate_subscriptions(user_id):
+    """Изменились подписки пользователя: поле is_subscribed в деталях курса"""
+    invalidate([("subscription", user_scope(user_id))])
+
+
+def record(stat):
+    try:
+        cache.incr(STATS_KEYS[stat])
+    except ValueError:
+        cache.add(STATS_KEYS[stat], 0, timeout=None)
+        cache.incr(STATS_KEYS[stat])
+
+
+def get_response_cache_stats():
+    """Счетчики попаданий и промахов кеша ответов"""
+    values = cache.get_many(list(STATS_KEYS.values()))
+    stats = {name: values.get(key, 0) for name, key in STATS_KEYS.items()}
+    total = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = round(stats["hits"] / total, 4) if total else 0.0
+    return stats
+
+
+class ResponseCacheMixin:
+    """
+    Кеширование ответов list/retrieve для ViewSet.
+
+    Ключ ответа состоит из ресурса, действия, области видимости вызывающего
+    (модератор или владелец), пути с параметрами запроса и версий
+    пространств, которые сбрасываются сигналами при изменении
+    Course, Lesson и Subscription (см. materials.signals).
+    Кешируются только успешные ответы, поэтому проверки прав внутри
+    обработчика повторяются для каждой области видимости отдельно.
+    """
+
+    cache_resource = None
+    # Действия, ответ которых зависит от конкретного пользователя
+    # (например, is_subscribed в деталях курса)
+    cache_per_user_actions = ()
+    # Заголовки, которые сохраняются вместе с ответом
+    cached_headers = ("ETag", "Last-Modified", "Cache-Control", "Vary")
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cache_namespaces(self, principal):
+        """Пространства версий, от которых зависит ответ"""
+        scope = (
+            MODERATOR_SCOPE
+            if principal.is_moderator
+            else owner_scope(principal.user_id)
+        )
+        namespaces = [(self.cache_resource, scope)]
+        if self.action in self.cache_per_user_actions:
+            namespaces.append(("subscription", user_scope(principal.user_id)))
+        return scope, namespaces
+
+    def get_response_cache_key(self, request):
+        principal = get_principal(request)
+        scope, namespaces = self.get_cache_namespaces(principal)
+        if self.action in self.cache_per_user_actions:
+            scope = f"{scope}:{user_scope(principal.user_id)}"
+        versions = ":".join(get_versions(namespaces))
+        query = "&".join(sorted(request.query_params.urlencode().split("&")))
+        digest = hashlib.md5(
+            f"{request.path}?{query}:{versions}".encode(), usedforsecurity=False
+        ).hexdigest()
+        return f"{RESPONSE_CACHE_PREFIX}:{self.cache_resource}:{self.action}:{scope}:{digest}"
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        timeout = settings.RESPONSE_CACHE_TIMEOUT
+        if not timeout or not request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+
+        key = self.get_response_cache_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            record("hits")
+            return self.build_cached_response(request, cached)
+
+        record("misses")
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            headers = {
+                header: response[header]
+                for header in self.cached_headers
+                if response.has_header(header)
+            }
+            cache.set(key, {"data": response.data, "headers": headers}, timeout)
+        response["X-Cache"] = "MISS"
+        return response
+
+    def build_cached_response(self, request, cached):
+        """
+        Ответ из кеша. Если закешированный ETag совпал с If-None-Match,
+        отдаем 304 без обращения к БД.
+        """
+        headers = cached["headers"]
+        response = None
+        if "ETag" in headers:
+            last_modified = headers.get("Last-Modified")
+            response = get_conditional_response(
+                request._request,
+                etag=headers["ETag"],
+                last_modified=last_modified and parse_http_date(last_modified),
+            )
+        if response is None:
+            response = Response(cached["data"])
+        for header, value in headers.items():
+            response[header] = value
+        response["X-Cache"] = "HIT"
+        return response
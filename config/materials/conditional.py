@@ -0,0 +1,112 @@
+import hashlib
+import json
+
+from django.db.models import Count, Max
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date
+
+from materials.paginators import KeysetPagination
+from users.principal import get_principal
+
+
+class ConditionalGetMixin:
+    """
+    Условные GET-запросы (ETag / Last-Modified) для list и retrieve.
+
+    Валидаторы считаются одним агрегирующим запросом по отфильтрованному
+    queryset (максимальный updated_at и число строк), поэтому при
+    совпадении If-None-Match или If-Modified-Since ответ 304 отдается
+    до загрузки объектов и работы сериализатора. Вместе с ResponseCacheMixin
+    подключается после него: при попадании в кеш ETag берется из кеша.
+    """
+
+    # Действия, для которых отдается Last-Modified. Список или вложенные
+    # коллекции могут измениться удалением строки без изменения updated_at,
+    # поэтому для них надежен только ETag, учитывающий число строк.
+    last_modified_actions = ("retrieve",)
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def get_conditional_queryset(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.action == "retrieve":
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            queryset = queryset.filter(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            )
+        return queryset
+
+    def get_conditional_aggregates(self):
+        """Агрегаты, от которых зависит ответ; updated_at и count обязательны"""
+        return {"updated_at": Max("updated_at"), "count": Count("pk")}
+
+    def get_validators(self, request):
+        """ETag и Last-Modified ответа или (None, None), если объекта нет"""
+        state = self.get_conditional_queryset().aggregate(
+            **self.get_conditional_aggregates()
+        )
+        if self.action == "retrieve" and not state["count"]:
+            return None, None
+
+        timestamps = [
+            value
+            for key, value in state.items()
+            if key.endswith("updated_at") and value
+        ]
+        last_modified = max(timestamps).timestamp() if timestamps else None
+
+        principal = get_principal(request)
+        scope = "moderator" if principal.is_moderator else principal.user_id
+        payload = json.dumps(
+            [
+                request.path,
+                sorted(request.query_params.lists()),
+                scope,
+                sorted(state.items()),
+            ],
+            default=str,
+        )
+        etag = (
+            '"%s"' % hashlib.sha1(payload.encode(), usedforsecurity=False).hexdigest()
+        )
+        if self.action not in self.last_modified_actions:
+            last_modified = None
+        return etag, last_modified
+
+    def set_validator_headers(self, response, etag, last_modified):
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+        # Ответ зависит от пользователя: только приватный кеш с ревалидацией
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ["Authorization"])
+
+    def get_conditional_response(self, handler, request, *args, **kwargs):
+        # Курсорный режим нужен для больших таблиц, где MAX/COUNT по всему
+        # queryset стоит дороже самой страницы
+        if not request.user.is_authenticated or KeysetPagination.is_requested(request):
+            return handler(request, *args, **kwargs)
+
+        etag, last_modified = self.get_validators(request)
+        if etag is None:
+            return handler(request, *args, **kwargs)
+
+        not_modified = get_conditional_response(
+            request._request, etag=etag, last_modified=last_modified
+        )
+        if not_modified is not None:
+            self.set_validator_headers(not_modified, etag, last_modified)
+            return not_modified
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            self.set_validator_headers(response, etag, last_modified)
+        return response
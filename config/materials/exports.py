@@ -0,0 +1,282 @@
+import csv
+import json
+import time
+from datetime import date, datetime
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.handlers.asgi import ASGIRequest
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpRequest, QueryDict, StreamingHttpResponse
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.request import Request
+
+
+class Echo:
+    """Буфер для csv.writer: writerow возвращает готовую строку"""
+
+    def write(self, value):
+        return value
+
+
+class CSVFormat:
+    extension = "csv"
+    content_type = "text/csv; charset=utf-8"
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.writer = csv.writer(Echo())
+
+    def header(self):
+        return self.writer.writerow(self.columns)
+
+    def row(self, values):
+        return self.writer.writerow(
+            [
+                value.isoformat() if isinstance(value, (datetime, date)) else value
+                for value in values
+            ]
+        )
+
+
+class NDJSONFormat:
+    extension = "ndjson"
+    content_type = "application/x-ndjson; charset=utf-8"
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def header(self):
+        return ""
+
+    def row(self, values):
+        data = dict(zip(self.columns, values))
+        return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
+
+
+EXPORT_FORMATS = {"csv": CSVFormat, "ndjson": NDJSONFormat}
+
+
+def get_export_rows(queryset, fields):
+    """
+    Значения полей fields без создания объектов моделей. .iterator()
+    на PostgreSQL читает строки серверным курсором пачками по
+    EXPORT_CHUNK_SIZE, поэтому память не зависит от числа строк.
+    Предзагрузка связанных объектов списка (вложенные уроки курса)
+    для кортежей не нужна и отключается
+    """
+    return queryset.prefetch_related(None).values_list(*fields)
+
+
+def iter_export(queryset, fields, export_format):
+    """
+    Байты выгрузки queryset: строки склеиваются в блоки примерно по
+    EXPORT_BUFFER_SIZE байт, чтобы не писать в сокет каждую строку отдельно
+    """
+    output = EXPORT_FORMATS[export_format](list(fields))
+    rows = get_export_rows(queryset, fields.values()).iterator(
+        chunk_size=settings.EXPORT_CHUNK_SIZE
+    )
+    buffer = [output.header()]
+    length = len(buffer[0])
+    for row in rows:
+        line = output.row(row)
+        buffer.append(line)
+        length += len(line)
+        if length >= settings.EXPORT_BUFFER_SIZE:
+            yield "".join(buffer).encode()
+            buffer, length = [], 0
+    if length:
+        yield "".join(buffer).encode()
+
+
+async def aiter_export(queryset, fields, export_format):
+    """
+    Асинхронный вариант iter_export для ASGI: синхронный итератор
+    StreamingHttpResponse под ASGI был бы целиком прочитан в память.
+    QuerySet.aiterator() для values_list выполняет запрос прямо в event
+    loop, поэтому курсор открывается и читается пачками через sync_to_async
+    """
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    rows = await sync_to_async(
+        lambda: iter(
+            get_export_rows(queryset, fields.values()).iterator(chunk_size=chunk_size)
+        )
+    )()
+    output = EXPORT_FORMATS[export_format](list(fields))
+    buffer = [output.header()]
+    length = len(buffer[0])
+    while True:
+        chunk = await sync_to_async(lambda: list(islice(rows, chunk_size)))()
+        for row in chunk:
+            line = output.row(row)
+            buffer.append(line)
+            length += len(line)
+            if length >= settings.EXPORT_BUFFER_SIZE:
+                yield "".join(buffer).encode()
+                buffer, length = [], 0
+        if len(chunk) < chunk_size:
+            break
+    if length:
+        yield "".join(buffer).encode()
+
+
+class ExportRenderer(BaseRenderer):
+    """
+    Согласование Accept для выгрузок. Сами данные отдает
+    StreamingHttpResponse, через рендерер проходят только ошибки
+    """
+
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return JSONRenderer().render(data)
+
+
+class CSVRenderer(ExportRenderer):
+    media_type = "text/csv"
+    format = "csv"
+
+
+class NDJSONRenderer(ExportRenderer):
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+
+
+class ExportMixin:
+    """
+    Потоковая выгрузка списка ViewSet на {prefix}/export/csv/ и
+    {prefix}/export/ndjson/.
+
+    В выгрузку попадают те же записи, что и в список: get_queryset()
+    (область видимости пользователя) и filter_queryset() (фильтры и
+    сортировка из параметров запроса), но без пагинации. Колонки задает
+    export_fields: {имя колонки: путь поля для values_list}. Ответ
+    формируется по мере чтения строк из БД.
+    """
+
+    export_fields = {}
+    export_filename = None
+
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path=r"export/(?P<export_format>csv|ndjson)",
+        renderer_classes=[JSONRenderer, CSVRenderer, NDJSONRenderer],
+    )
+    def export(self, request, export_format, *args, **kwargs):
+        """Выгрузка отфильтрованного списка в CSV или NDJSON"""
+        queryset = self.filter_queryset(self.get_queryset())
+        if isinstance(request._request, ASGIRequest):
+            content = aiter_export(queryset, self.export_fields, export_format)
+        else:
+            content = iter_export(queryset, self.export_fields, export_format)
+
+        output_format = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(
+            content, content_type=output_format.content_type
+        )
+        filename = self.export_filename or self.basename
+        response["Content-Disposition"] = (
+            f'attachment; filename="{filename}.{output_format.extension}"'
+        )
+        return response
+
+
+class ExportCommand(BaseCommand):
+    """
+    Основа команд выгрузки: те же колонки, фильтры и область видимости,
+    что у эндпоинта export/ ViewSet из get_view_class()
+    """
+
+    view_class = None
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format", choices=sorted(EXPORT_FORMATS), default="csv", dest="format"
+        )
+        parser.add_argument(
+            "--output", help="Файл для записи (по умолчанию - стандартный вывод)"
+        )
+        parser.add_argument(
+            "--user",
+            help="Email пользователя: выгрузить то, что видит он "
+            "(по умолчанию - все записи)",
+        )
+        parser.add_argument(
+            "--filter",
+            action="append",
+            default=[],
+            metavar="ПАРАМЕТР=ЗНАЧЕНИЕ",
+            help="Параметр фильтра или сортировки, как в запросе API "
+            "(например, created_at__gte=2025-01-01 или ordering=name)",
+        )
+
+    def get_view_class(self, options):
+        return self.view_class
+
+    def handle(self, *args, **options):
+        params = QueryDict(mutable=True)
+        for item in options["filter"]:
+            key, separator, value = item.partition("=")
+            if not separator:
+                raise CommandError(f"Ожидается ПАРАМЕТР=ЗНАЧЕНИЕ: {item}")
+            params.appendlist(key, value)
+
+        view = self.get_view(self.get_view_class(options), options["user"], params)
+        # Без пользователя выгружаются все записи, но с фильтрами API
+        if options["user"]:
+            queryset = view.get_queryset()
+        else:
+            queryset = view.get_serializer_class().Meta.model.objects.all()
+        try:
+            queryset = view.filter_queryset(queryset)
+        except ValidationError as e:
+            raise CommandError(f"Неверные параметры фильтра: {e.detail}")
+
+        started = time.perf_counter()
+        written = 0
+        chunks = iter_export(queryset, view.export_fields, options["format"])
+        if options["output"]:
+            with open(options["output"], "wb") as output:
+                for chunk in chunks:
+                    output.write(chunk)
+                    written += len(chunk)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending="")
+                written += len(chunk)
+
+        self.stderr.write(
+            f"Выгружено {written} байт за {time.perf_counter() - started:.2f} с"
+        )
+
+    def get_view(self, view_class, email, params):
+        """
+        ViewSet с запросом от имени пользователя: get_queryset и
+        filter_queryset работают так же, как в эндпоинте выгрузки
+        """
+        user = AnonymousUser()
+        if email:
+            user = get_user_model().objects.filter(email=email).first()
+            if user is None:
+                raise CommandError(f"Пользователь {email} не найден")
+
+        http_request = HttpRequest()
+        http_request.method = "GET"
+        http_request.GET = params
+        request = Request(http_request)
+        request.user = user
+        return view_class(
+            request=request,
+            args=(),
+            kwargs={},
+            format_kwarg=None,
+            action="export",
+        )
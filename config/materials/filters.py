@@ -0,0 +1,51 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from django.db.models import F
+from rest_framework.filters import SearchFilter
+
+# Должна совпадать с конфигурацией в триггерах миграции materials.0007
+FULL_TEXT_SEARCH_CONFIG = "russian"
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    Полнотекстовый поиск по ?search= через поле search_vector (GIN-индекс)
+    с сортировкой по релевантности.
+
+    На других СУБД (SQLite в тестах) и для моделей без search_vector
+    работает как обычный SearchFilter по search_fields.
+    """
+
+    search_vector_field = "search_vector"
+    search_type = "websearch"
+
+    def supports_full_text(self, queryset):
+        if connections[queryset.db].vendor != "postgresql":
+            return False
+        try:
+            queryset.model._meta.get_field(self.search_vector_field)
+        except FieldDoesNotExist:
+            return False
+        return True
+
+    def filter_queryset(self, request, queryset, view):
+        if not self.supports_full_text(queryset):
+            return super().filter_queryset(request, queryset, view)
+
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+
+        query = SearchQuery(
+            " ".join(search_terms),
+            config=FULL_TEXT_SEARCH_CONFIG,
+            search_type=self.search_type,
+        )
+        # Явная сортировка ?ordering= (OrderingFilter) применяется после
+        # и заменяет сортировку по релевантности
+        return (
+            queryset.filter(**{self.search_vector_field: query})
+            .annotate(search_rank=SearchRank(F(self.search_vector_field), query))
+            .order_by("-search_rank", "-pk")
+        )
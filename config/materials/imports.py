@@ -0,0 +1,284 @@
+import csv
+import json
+from datetime import date, datetime
+from io import StringIO
+
+from django.contrib.postgres.search import SearchVectorField
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import JSONField
+from rest_framework.exceptions import ValidationError
+
+from materials.aggregates import rebuild_course_aggregates
+from materials.cache import MODERATOR_SCOPE, bump_versions, owner_scope
+from materials.models import Course, Lesson
+from materials.serializers import CourseSerializer, LessonSerializer
+from users.models import User
+
+COPY_NULL = r"\N"
+
+
+def read_rows(stream, input_format):
+    """
+    Записи входного потока по одной: (номер записи, словарь или None).
+    В CSV пустые ячейки считаются отсутствующими полями
+    """
+    if input_format == "csv":
+        for number, row in enumerate(csv.DictReader(stream), start=1):
+            yield number, {key: value for key, value in row.items() if value != ""}
+        return
+
+    number = 0
+    for line in stream:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+
+def format_copy_value(field, value):
+    """Значение поля в формате CSV для COPY: NULL - \\N, остальное в кавычках"""
+    if value is None:
+        return COPY_NULL
+    if isinstance(field, JSONField):
+        value = json.dumps(value, cls=field.encoder)
+    elif isinstance(value, bool):
+        value = "t" if value else "f"
+    elif isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    else:
+        value = str(value)
+    return '"' + value.replace('"', '""') + '"'
+
+
+def get_table_fields(model):
+    """
+    Записываемые столбцы таблицы модели: все, кроме первичного ключа и
+    поискового вектора (его заполняет триггер PostgreSQL)
+    """
+    return [
+        field
+        for field in model._meta.concrete_fields
+        if not field.primary_key and not isinstance(field, SearchVectorField)
+    ]
+
+
+def copy_rows(model, fields, rows):
+    """
+    Запись строк (значений полей fields) командой COPY (PostgreSQL):
+    один поток данных вместо INSERT на пакет; триггеры таблицы срабатывают
+    """
+    buffer = StringIO()
+    for row in rows:
+        buffer.write(
+            ",".join(
+                format_copy_value(field, value) for field, value in zip(fields, row)
+            )
+        )
+        buffer.write("\n")
+    buffer.seek(0)
+
+    quote_name = connection.ops.quote_name
+    columns = ", ".join(quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {quote_name(model._meta.db_table)} ({columns}) "
+            f"FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+            buffer,
+        )
+
+
+def insert_rows(model, fields, rows):
+    """Запись строк одним executemany для БД без COPY"""
+    # Само соединение, а не прокси django.db.connection: get_db_prep_save
+    # вызывается для каждого значения
+    db = connections[DEFAULT_DB_ALIAS]
+    quote_name = db.ops.quote_name
+    columns = ", ".join(quote_name(field.column) for field in fields)
+    placeholders = ", ".join(["%s"] * len(fields))
+    prepare = [field.get_db_prep_save for field in fields]
+    with db.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {quote_name(model._meta.db_table)} ({columns}) "
+            f"VALUES ({placeholders})",
+            [
+                [
+                    value if value is None else prep(value, db)
+                    for prep, value in zip(prepare, row)
+                ]
+                for row in rows
+            ],
+        )
+
+
+def write_rows(model, fields, rows):
+    """
+    Быстрая запись строк без создания объектов моделей и без сигналов:
+    COPY на PostgreSQL, иначе executemany
+    """
+    if connection.vendor == "postgresql":
+        copy_rows(model, fields, rows)
+    else:
+        insert_rows(model, fields, rows)
+
+
+def copy_objects(model, objects):
+    """
+    Запись объектов командой COPY. Значения по умолчанию и auto_now
+    заполняются так же, как при save()
+    """
+    fields = get_table_fields(model)
+    copy_rows(
+        model,
+        fields,
+        (
+            [field.get_prep_value(field.pre_save(obj, True)) for field in fields]
+            for obj in objects
+        ),
+    )
+
+
+class CourseImportSerializer(CourseSerializer):
+    """Курс из файла импорта: поля API и цена"""
+
+    class Meta(CourseSerializer.Meta):
+        fields = CourseSerializer.Meta.fields + ["price"]
+
+
+class MaterialImporter:
+    """
+    Проверка и запись пакета записей импорта.
+
+    Записи проверяются одним экземпляром сериализатора API (поля
+    строятся один раз), связанные курсы и владельцы (по email) загружаются
+    одним запросом на пакет. Запись - COPY на PostgreSQL, иначе
+    bulk_create. Сигналы при этом не отправляются, поэтому агрегаты
+    курсов и кеш ответов обновляются здесь.
+    """
+
+    model = None
+    serializer_class = None
+    related_fields = ()
+    # Ресурс кеша ответов (materials.cache), который сбрасывается после импорта
+    cache_resource = None
+    owner_not_found_message = "Пользователь не найден."
+    not_object_message = "Ожидается объект."
+
+    def __init__(self, default_owner_id=None, use_copy=None):
+        self.context = {"related_objects": {}}
+        self.serializer = self.serializer_class(context=self.context)
+        self.default_owner_id = default_owner_id
+        if use_copy is None:
+            use_copy = connection.vendor == "postgresql"
+        self.use_copy = use_copy
+        self.owner_ids = set()
+
+    def load_related(self, rows):
+        """Связанные объекты пакета для PrefetchedPrimaryKeyRelatedField"""
+        fields = self.serializer.fields
+        for name in self.related_fields:
+            pks = {row[name] for row in rows if isinstance(row.get(name), (int, str))}
+            queryset = fields[name].get_queryset().filter(pk__in=pks)
+            self.context["related_objects"][name] = {
+                str(obj.pk): obj for obj in queryset
+            }
+
+    @staticmethod
+    def load_owners(rows):
+        emails = {row["owner"] for row in rows if isinstance(row.get("owner"), str)}
+        return dict(User.objects.filter(email__in=emails).values_list("email", "pk"))
+
+    def get_default_owner_id(self, validated_data):
+        return self.default_owner_id
+
+    def validate(self, batch):
+        """
+        Объекты для записи и ошибки записей пакета {номер записи: ошибки}.
+        batch - список (номер записи, данные)
+        """
+        rows = [data for _, data in batch if isinstance(data, dict)]
+        self.load_related(rows)
+        owners = self.load_owners(rows)
+
+        objects, errors = [], {}
+        for number, data in batch:
+            if not isinstance(data, dict):
+                errors[number] = {"non_field_errors": [self.not_object_message]}
+                continue
+            try:
+                validated_data = self.serializer.run_validation(data)
+            except ValidationError as e:
+                errors[number] = e.detail
+                continue
+
+            owner = data.get("owner")
+            if owner:
+                if owner not in owners:
+                    errors[number] = {"owner": [self.owner_not_found_message]}
+                    continue
+                owner_id = owners[owner]
+            else:
+                owner_id = self.get_default_owner_id(validated_data)
+            objects.append(self.model(**validated_data, owner_id=owner_id))
+        return objects, errors
+
+    def write(self, objects):
+        """Запись пакета; вызывается внутри транзакции"""
+        if not objects:
+            return
+        if self.use_copy:
+            copy_objects(self.model, objects)
+        else:
+            self.model.objects.bulk_create(objects)
+        self.owner_ids.update(obj.owner_id for obj in objects)
+
+    def get_cache_pairs(self):
+        return [(self.cache_resource, MODERATOR_SCOPE)] + [
+            (self.cache_resource, owner_scope(owner_id)) for owner_id in self.owner_ids
+        ]
+
+    def finish(self):
+        """Сброс кеша ответов владельцев импортированных объектов"""
+        bump_versions(self.get_cache_pairs())
+
+
+class CourseImporter(MaterialImporter):
+    model = Course
+    serializer_class = CourseImportSerializer
+    cache_resource = "course"
+
+
+class LessonImporter(MaterialImporter):
+    model = Lesson
+    serializer_class = LessonSerializer
+    related_fields = ("course",)
+    cache_resource = "lesson"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.course_owner_ids = set()
+
+    def get_default_owner_id(self, validated_data):
+        # Без явного владельца урок принадлежит владельцу курса
+        return self.default_owner_id or validated_data["course"].owner_id
+
+    def write(self, objects):
+        if not objects:
+            return
+        super().write(objects)
+        courses = {obj.course_id: obj.course.owner_id for obj in objects}
+        rebuild_course_aggregates(list(courses))
+        self.course_owner_ids.update(courses.values())
+
+    def get_cache_pairs(self):
+        # Уроки вложены в ответы курсов, агрегаты курсов пересчитаны
+        return super().get_cache_pairs() + [
+            ("course", scope)
+            for scope in [MODERATOR_SCOPE]
+            + [owner_scope(owner_id) for owner_id in self.course_owner_ids]
+        ]
+
+
+IMPORTERS = {"courses": CourseImporter, "lessons": LessonImporter}
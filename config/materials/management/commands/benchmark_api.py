@@ -0,0 +1,334 @@
+import http.client
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from django.utils import timezone
+
+from materials.models import Course, Lesson
+from users.models import Payment, Subscription, User
+
+MODERATOR_EMAIL = "moderator@example.com"
+MODERATOR_PASSWORD = "moderator123"
+GENERATED_EMAIL_DOMAIN = "lms.test"
+
+
+class ClientTransport:
+    """Запросы через тестовый клиент Django в том же процессе, с подсчетом SQL"""
+
+    def __init__(self):
+        self.client = Client()
+        self.queries = 0
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def request(self, method, path, token=None, data=None):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self.queries = 0
+        with connection.execute_wrapper(self.count_query):
+            response = self.client.generic(
+                method,
+                path,
+                json.dumps(data) if data is not None else "",
+                content_type="application/json",
+                headers=headers,
+            )
+        return response.status_code, response.content, self.queries
+
+
+class HTTPTransport:
+    """Запросы к запущенному серверу по одному keep-alive соединению"""
+
+    def __init__(self, base_url):
+        url = urlsplit(base_url)
+        connection_class = (
+            http.client.HTTPSConnection
+            if url.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self.connection = connection_class(url.hostname, url.port, timeout=60)
+        self.prefix = url.path.rstrip("/")
+
+    def request(self, method, path, token=None, data=None):
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        body = json.dumps(data) if data is not None else None
+        self.connection.request(method, self.prefix + path, body, headers)
+        response = self.connection.getresponse()
+        return response.status, response.read(), None
+
+
+def percentile(quantiles, percent):
+    return quantiles[percent - 1]
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный прогон основных эндпоинтов API с JWT: p50/p95/p99 "
+        "задержки, число SQL-запросов и размер ответа, результаты в JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iterations", type=int, default=50, help="Запросов на эндпоинт"
+        )
+        parser.add_argument(
+            "--warmup", type=int, default=5, help="Прогревочных запросов на эндпоинт"
+        )
+        parser.add_argument(
+            "--output", help="Файл для результатов в JSON (для сравнения коммитов)"
+        )
+        parser.add_argument(
+            "--compare", help="JSON предыдущего прогона: вывести изменения"
+        )
+        parser.add_argument(
+            "--base-url",
+            help="Адрес запущенного сервера (например, http://localhost:8000). "
+            "Без него запросы идут через тестовый клиент в отдельной тестовой БД",
+        )
+        parser.add_argument(
+            "--keepdb",
+            action="store_true",
+            help="Не удалять тестовую БД: следующий прогон не генерирует данные",
+        )
+        parser.add_argument(
+            "--response-cache",
+            action="store_true",
+            help="Включить кеш ответов (по умолчанию измеряется путь без кеша)",
+        )
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--users", type=int, default=2000)
+        parser.add_argument("--lessons-per-course", type=float, default=10)
+        parser.add_argument("--subscriptions", type=int, default=10000)
+        parser.add_argument("--payments", type=int, default=20000)
+        parser.add_argument(
+            "--password",
+            default="password123",
+            help="Пароль сгенерированных пользователей (fill_test_data)",
+        )
+
+    def handle(self, *args, **options):
+        if options["iterations"] < 2:
+            raise CommandError("--iterations должен быть не меньше 2")
+        if options["base_url"]:
+            results = self.run(HTTPTransport(options["base_url"]), options)
+        else:
+            results = self.run_in_test_database(options)
+
+        self.report(results, options["compare"])
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as output:
+                json.dump(results, output, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Результаты записаны в {options['output']}")
+
+    def run_in_test_database(self, options):
+        """
+        Прогон через тестовый клиент в отдельной тестовой БД с данными
+        fill_test_data и собственным кешем в памяти процесса
+        """
+        setup_test_environment()
+        old_config = setup_databases(
+            verbosity=0, interactive=False, keepdb=options["keepdb"]
+        )
+        try:
+            with override_settings(
+                CACHES={
+                    "default": {
+                        "BACKEND": "django.core.cache.backends.locmem.LocMemCache"
+                    }
+                },
+                RESPONSE_CACHE_TIMEOUT=(
+                    settings.RESPONSE_CACHE_TIMEOUT or 300
+                    if options["response_cache"]
+                    else 0
+                ),
+            ):
+                self.seed(options)
+                return self.run(ClientTransport(), options)
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+
+    def seed(self, options):
+        if User.objects.filter(email__endswith=f"@{GENERATED_EMAIL_DOMAIN}").exists():
+            self.stdout.write("Используются данные сохраненной тестовой БД")
+            return
+        self.stdout.write("Генерация данных...")
+        call_command(
+            "fill_test_data",
+            seed=options["seed"],
+            users=options["users"],
+            lessons_per_course=options["lessons_per_course"],
+            subscriptions=options["subscriptions"],
+            payments=options["payments"],
+            password=options["password"],
+            stdout=self.stdout,
+        )
+
+    def get_endpoints(self, transport, options):
+        """Эндпоинты прогона: (имя, метод, путь, токен, тело запроса, запросов)"""
+        course = Course.objects.order_by("-subscribers_count", "pk").first()
+        lesson = Lesson.objects.filter(course=course).order_by("pk").first()
+        author = (
+            User.objects.filter(email__endswith=f"@{GENERATED_EMAIL_DOMAIN}")
+            .annotate(courses_count=Count("courses"))
+            .order_by("-courses_count", "pk")
+            .first()
+        )
+        if course is None or lesson is None or author is None:
+            raise CommandError("Нет данных: заполните БД командой fill_test_data")
+
+        moderator = self.obtain_token(transport, MODERATOR_EMAIL, MODERATOR_PASSWORD)
+        user = self.obtain_token(transport, author.email, options["password"])
+        since = (timezone.now() - timedelta(days=90)).date().isoformat()
+        iterations = options["iterations"]
+        credentials = {"email": author.email, "password": options["password"]}
+        return [
+            # Хеширование пароля намеренно медленное: меньше запросов
+            ("token_obtain", "POST", "/api/users/token/", None, credentials,
+             max(2, iterations // 10)),
+            ("course_list", "GET", "/api/materials/courses/", moderator, None,
+             iterations),
+            ("course_list_own", "GET", "/api/materials/courses/?page_size=50", user,
+             None, iterations),
+            ("course_retrieve", "GET", f"/api/materials/courses/{course.pk}/",
+             moderator, None, iterations),
+            ("lesson_list", "GET", "/api/materials/lessons/?page_size=50", moderator,
+             None, iterations),
+            ("lesson_retrieve", "GET", f"/api/materials/lessons/{lesson.pk}/",
+             moderator, None, iterations),
+            ("payment_list_filtered", "GET",
+             f"/api/users/payments/?payment_method=stripe&payment_date__gte={since}"
+             f"&ordering=-amount", moderator, None, iterations),
+            ("payment_list_own", "GET", "/api/users/payments/", user, None,
+             iterations),
+            ("subscription_toggle", "POST", "/api/users/subscriptions/", user,
+             {"course_id": course.pk}, iterations),
+        ]  # fmt: skip
+
+    def obtain_token(self, transport, email, password):
+        status, content, _ = transport.request(
+            "POST", "/api/users/token/", data={"email": email, "password": password}
+        )
+        if status != 200:
+            raise CommandError(f"Не удалось получить токен {email}: {status}")
+        return json.loads(content)["access"]
+
+    def run(self, transport, options):
+        endpoints = {}
+        for name, method, path, token, data, iterations in self.get_endpoints(
+            transport, options
+        ):
+            for _ in range(options["warmup"]):
+                transport.request(method, path, token, data)
+
+            latencies, queries, sizes, statuses = [], [], [], set()
+            for _ in range(iterations):
+                started = time.perf_counter()
+                status, content, query_count = transport.request(
+                    method, path, token, data
+                )
+                latencies.append(time.perf_counter() - started)
+                queries.append(query_count)
+                sizes.append(len(content))
+                statuses.add(status)
+
+            quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+            endpoints[name] = {
+                "method": method,
+                "path": path,
+                "requests": iterations,
+                "statuses": sorted(statuses),
+                "p50_ms": round(percentile(quantiles, 50) * 1000, 3),
+                "p95_ms": round(percentile(quantiles, 95) * 1000, 3),
+                "p99_ms": round(percentile(quantiles, 99) * 1000, 3),
+                "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+                # Медиана: первый запрос может заполнять кеш ролей и схем
+                "queries": (
+                    round(statistics.median(queries))
+                    if queries[0] is not None
+                    else None
+                ),
+                "response_bytes": round(statistics.fmean(sizes)),
+            }
+
+        return {
+            "meta": {
+                "commit": get_git_commit(),
+                "timestamp": timezone.now().isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "transport": options["base_url"] or "django.test.Client",
+                "response_cache": options["response_cache"],
+                "seed": options["seed"],
+                "rows": {
+                    model.__name__: model.objects.count()
+                    for model in (User, Course, Lesson, Subscription, Payment)
+                },
+            },
+            "endpoints": endpoints,
+        }
+
+    def report(self, results, compare_path):
+        baseline = {}
+        if compare_path:
+            with open(compare_path, encoding="utf-8") as file:
+                baseline = json.load(file)["endpoints"]
+
+        meta = results["meta"]
+        self.stdout.write(
+            f"Коммит {meta['commit']}, БД {meta['database']}, строк: "
+            + ", ".join(f"{name} {count}" for name, count in meta["rows"].items())
+        )
+        self.stdout.write(
+            f"{'эндпоинт':<24}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}"
+            f"{'SQL':>6}{'байт':>10}  статусы"
+        )
+        for name, result in results["endpoints"].items():
+            queries = result["queries"] if result["queries"] is not None else "-"
+            line = (
+                f"{name:<24}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+                f"{result['p99_ms']:>10.2f}{queries:>6}{result['response_bytes']:>10}"
+                f"  {','.join(map(str, result['statuses']))}"
+            )
+            previous = baseline.get(name)
+            if previous:
+                change = (result["p50_ms"] / previous["p50_ms"] - 1) * 100
+                line += f"  p50 {change:+.0f}%"
+                if previous["queries"] != result["queries"]:
+                    line += f", SQL {previous['queries']} -> {result['queries']}"
+            self.stdout.write(line)
@@ -0,0 +1,71 @@
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from urlextract import URLExtract
+
+from materials.validators import DEFAULT_ALLOWED_DOMAINS, validate_no_external_links
+
+
+def legacy_validate_no_external_links(value, allowed_domains=DEFAULT_ALLOWED_DOMAINS):
+    """Прежняя реализация валидатора: новый URLExtract и подстроки на каждый вызов"""
+    if not value:
+        return value
+    url_extractor = URLExtract()
+    urls = url_extractor.find_urls(value)
+
+    for url in urls:
+        url_lower = url.lower()
+        is_allowed = any(domain in url_lower for domain in allowed_domains)
+        if not is_allowed:
+            raise ValidationError("Запрещены ссылки на сторонние ресурсы.")
+
+    return value
+
+
+SAMPLES = {
+    "plain": "Основы синтаксиса Python, переменные, типы данных и первые программы",
+    "allowed_link": "Смотрите видео: https://www.youtube.com/watch?v=python_intro",
+    "forbidden_link": "Подробнее на https://vimeo.com/external и https://example.org",
+    "lesson_description": (
+        "Создание и использование функций, параметры и области видимости. "
+        "Запись занятия: https://youtu.be/functions. " * 20
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = "Сравнивает скорость валидатора ссылок с прежней реализацией"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=200,
+            help="Количество вызовов валидатора на каждый образец текста",
+        )
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        # Прогрев: загрузка списка TLD общим экземпляром URLExtract
+        validate_no_external_links(SAMPLES["allowed_link"])
+
+        for name, text in SAMPLES.items():
+            legacy = self.measure(legacy_validate_no_external_links, text, iterations)
+            current = self.measure(validate_no_external_links, text, iterations)
+            self.stdout.write(
+                f"{name:<20} прежний: {legacy * 1e6:10.1f} мкс/вызов   "
+                f"текущий: {current * 1e6:10.1f} мкс/вызов   "
+                f"ускорение: x{legacy / current:.1f}"
+            )
+
+    @staticmethod
+    def measure(validator, text, iterations):
+        """Среднее время одного вызова в секундах"""
+        started = time.perf_counter()
+        for _ in range(iterations):
+            try:
+                validator(text)
+            except ValidationError:
+                pass
+        return (time.perf_counter() - started) / iterations
@@ -0,0 +1,18 @@
+from materials.exports import ExportCommand
+from materials.views import CourseViewSet, LessonViewSet
+
+
+class Command(ExportCommand):
+    help = (
+        "Потоковая выгрузка курсов или уроков в CSV или NDJSON с теми же "
+        "фильтрами и областью видимости, что у /api/materials/courses/export/ "
+        "и /api/materials/lessons/export/"
+    )
+    view_classes = {"courses": CourseViewSet, "lessons": LessonViewSet}
+
+    def add_arguments(self, parser):
+        parser.add_argument("resource", choices=sorted(self.view_classes))
+        super().add_arguments(parser)
+
+    def get_view_class(self, options):
+        return self.view_classes[options["resource"]]
@@ -0,0 +1,151 @@
+import json
+import os
+import sys
+import time
+from contextlib import ExitStack
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError, OutputWrapper
+from django.db import transaction
+from django.db.models import F
+
+from materials.imports import IMPORTERS, read_rows
+from materials.models import ImportCheckpoint
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Массовый импорт курсов или уроков из CSV/NDJSON с проверкой "
+        "правилами API, записью пакетами (COPY на PostgreSQL) и "
+        "возобновлением с последнего зафиксированного пакета"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(IMPORTERS))
+        parser.add_argument("path", help="Файл CSV/NDJSON или - для stdin")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "ndjson"],
+            dest="format",
+            help="Формат входных данных (по умолчанию - по расширению файла)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Количество записей в одном пакете (одной транзакции)",
+        )
+        parser.add_argument(
+            "--owner",
+            help="Email владельца записей без колонки owner "
+            "(уроки по умолчанию принадлежат владельцу курса)",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Продолжить с позиции последнего зафиксированного пакета",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="Ключ позиции импорта (по умолчанию - вид и путь к файлу)",
+        )
+        parser.add_argument(
+            "--errors",
+            help="Файл для ошибок записей в NDJSON (по умолчанию - stderr)",
+        )
+        parser.add_argument(
+            "--no-copy",
+            action="store_true",
+            help="Писать через bulk_create даже на PostgreSQL",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        input_format = options["format"] or (
+            "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+        )
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size должен быть положительным")
+
+        default_owner_id = None
+        if options["owner"]:
+            default_owner_id = (
+                User.objects.filter(email=options["owner"])
+                .values_list("pk", flat=True)
+                .first()
+            )
+            if default_owner_id is None:
+                raise CommandError(f"Пользователь {options['owner']} не найден")
+
+        key = options["checkpoint"] or f"{options['kind']}:{os.path.abspath(path)}"
+        checkpoint, _ = ImportCheckpoint.objects.get_or_create(key=key)
+        if not options["resume"]:
+            checkpoint.position = checkpoint.imported = checkpoint.failed = 0
+            checkpoint.save()
+        elif checkpoint.position:
+            self.stdout.write(f"Продолжение с записи {checkpoint.position + 1}")
+
+        importer = IMPORTERS[options["kind"]](
+            default_owner_id=default_owner_id,
+            use_copy=False if options["no_copy"] else None,
+        )
+        with ExitStack() as stack:
+            if path == "-":
+                stream = sys.stdin
+            else:
+                stream = stack.enter_context(open(path, encoding="utf-8", newline=""))
+            errors_output = self.stderr
+            if options["errors"]:
+                errors_output = OutputWrapper(
+                    stack.enter_context(open(options["errors"], "a", encoding="utf-8"))
+                )
+            # Кеш сбрасывается и после прерванного импорта: зафиксированные
+            # пакеты уже в БД
+            stack.callback(importer.finish)
+            self.run(
+                importer,
+                read_rows(stream, input_format),
+                checkpoint,
+                options["batch_size"],
+                errors_output,
+            )
+
+    def run(self, importer, rows, checkpoint, batch_size, errors_output):
+        # Записи из уже зафиксированных пакетов пропускаются без проверки
+        rows = islice(rows, checkpoint.position, None)
+        started = time.perf_counter()
+        processed = imported = failed = 0
+
+        while batch := list(islice(rows, batch_size)):
+            objects, errors = importer.validate(batch)
+            with transaction.atomic():
+                importer.write(objects)
+                ImportCheckpoint.objects.filter(pk=checkpoint.pk).update(
+                    position=F("position") + len(batch),
+                    imported=F("imported") + len(objects),
+                    failed=F("failed") + len(errors),
+                )
+
+            for number, error in errors.items():
+                errors_output.write(
+                    json.dumps({"record": number, "errors": error}, ensure_ascii=False)
+                )
+            processed += len(batch)
+            imported += len(objects)
+            failed += len(errors)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"Записей: {checkpoint.position + processed}, "
+                f"импортировано: {imported}, с ошибками: {failed}, "
+                f"{processed / elapsed:.0f} записей/с"
+            )
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Импортировано {imported} из {processed} записей за {elapsed:.2f} с "
+                f"({imported / elapsed if elapsed else 0:.0f} записей/с), "
+                f"с ошибками: {failed}"
+            )
+        )
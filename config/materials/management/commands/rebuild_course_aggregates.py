@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from materials.aggregates import rebuild_course_aggregates
+from materials.cache import MODERATOR_SCOPE, bump_versions, owner_scope
+from materials.models import Course
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает денормализованные агрегаты курсов (уроки, цена, "
+        "подписчики, покупки) пакетами по id"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Количество курсов в одном UPDATE",
+        )
+        parser.add_argument(
+            "--course",
+            type=int,
+            action="append",
+            dest="course_ids",
+            help="Пересчитать только указанный курс (можно повторять)",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        ids = Course.objects.order_by("pk").values_list("pk", flat=True)
+        if options["course_ids"]:
+            ids = ids.filter(pk__in=options["course_ids"])
+
+        started = time.perf_counter()
+        updated, last_id = 0, 0
+        while True:
+            batch = list(ids.filter(pk__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            # Короткая транзакция на пакет, чтобы не держать блокировки
+            # всей таблицы курсов
+            with transaction.atomic():
+                updated += rebuild_course_aggregates(batch)
+            last_id = batch[-1]
+
+        # Агрегаты входят в ответы курсов: сбрасываем кеш всех владельцев
+        owner_ids = Course.objects.values_list("owner_id", flat=True).distinct()
+        bump_versions(
+            [("course", MODERATOR_SCOPE)]
+            + [("course", owner_scope(owner_id)) for owner_id in owner_ids]
+        )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Пересчитано курсов: {updated} за "
+                f"{time.perf_counter() - started:.2f} с"
+            )
+        )
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:41
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_CONFIG = "russian"
+TABLES = ("materials_course", "materials_lesson")
+
+
+def create_search_triggers(apps, schema_editor):
+    """
+    Триггер поддерживает search_vector при любых INSERT/UPDATE (включая
+    bulk_create и bulk_update), затем заполняем существующие строки
+    и строим GIN-индекс. Только для PostgreSQL.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table in TABLES:
+        schema_editor.execute(f"""
+            CREATE OR REPLACE FUNCTION {table}_search_vector_update()
+            RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector :=
+                    setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.name, '')), 'A')
+                    || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.description, '')), 'B');
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql;
+            """)
+        schema_editor.execute(f"""
+            CREATE TRIGGER {table}_search_vector_trigger
+            BEFORE INSERT OR UPDATE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION {table}_search_vector_update();
+            """)
+        schema_editor.execute(f"UPDATE {table} SET name = name;")
+        schema_editor.execute(
+            f"CREATE INDEX {table}_search_vector_gin ON {table} USING gin (search_vector);"
+        )
+
+
+def drop_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table in TABLES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {table}_search_vector_gin;")
+        schema_editor.execute(
+            f"DROP TRIGGER IF EXISTS {table}_search_vector_trigger ON {table};"
+        )
+        schema_editor.execute(
+            f"DROP FUNCTION IF EXISTS {table}_search_vector_update();"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("materials", "0006_course_materials_c_created_137722_idx_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True, verbose_name="Поисковый вектор"
+            ),
+        ),
+        migrations.AddField(
+            model_name="lesson",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True, verbose_name="Поисковый вектор"
+            ),
+        ),
+        migrations.RunPython(create_search_triggers, drop_search_triggers),
+    ]
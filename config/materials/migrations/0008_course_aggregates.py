@@ -0,0 +1,135 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:07
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, IntegerField, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest
+
+
+def backfill_course_aggregates(apps, schema_editor):
+    """Первичное заполнение агрегатов (то же, что rebuild_course_aggregates)"""
+    Course = apps.get_model("materials", "Course")
+    Lesson = apps.get_model("materials", "Lesson")
+    Subscription = apps.get_model("users", "Subscription")
+    Payment = apps.get_model("users", "Payment")
+
+    def aggregate(queryset, course_field, value):
+        return Subquery(
+            queryset.order_by()
+            .values(course_field)
+            .annotate(value=value)
+            .values("value")
+        )
+
+    lessons = Lesson.objects.filter(course=OuterRef("pk"))
+    Course.objects.update(
+        lessons_count=Coalesce(aggregate(lessons, "course", Count("pk")), 0),
+        lessons_total_price=Coalesce(
+            aggregate(lessons, "course", Sum("price")),
+            0,
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        ),
+        content_updated_at=Greatest(
+            F("created_at"),
+            Coalesce(aggregate(lessons, "course", Max("updated_at")), F("created_at")),
+        ),
+        subscribers_count=Coalesce(
+            aggregate(
+                Subscription.objects.filter(course=OuterRef("pk")),
+                "course",
+                Count("pk"),
+            ),
+            0,
+            output_field=IntegerField(),
+        ),
+        purchases_count=Coalesce(
+            aggregate(
+                Payment.objects.filter(paid_course=OuterRef("pk"), status="succeeded"),
+                "paid_course",
+                Count("pk"),
+            ),
+            0,
+            output_field=IntegerField(),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("materials", "0007_search_vector"),
+        ("users", "0005_payment_users_payme_payment_683e7e_idx_and_more"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="content_updated_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now,
+                editable=False,
+                verbose_name="Дата изменения материалов",
+            ),
+        ),
+        migrations.AddField(
+            model_name="course",
+            name="lessons_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="Количество уроков"
+            ),
+        ),
+        migrations.AddField(
+            model_name="course",
+            name="lessons_total_price",
+            field=models.DecimalField(
+                decimal_places=2,
+                default=0,
+                editable=False,
+                max_digits=12,
+                verbose_name="Суммарная цена уроков",
+            ),
+        ),
+        migrations.AddField(
+            model_name="course",
+            name="purchases_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="Количество покупок"
+            ),
+        ),
+        migrations.AddField(
+            model_name="course",
+            name="subscribers_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="Количество подписчиков"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="course",
+            index=models.Index(
+                fields=["subscribers_count", "id"],
+                name="materials_c_subscri_099b37_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="course",
+            index=models.Index(
+                fields=["purchases_count", "id"], name="materials_c_purchas_d3508c_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="course",
+            index=models.Index(
+                fields=["lessons_count", "id"], name="materials_c_lessons_3e70b7_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="course",
+            index=models.Index(
+                fields=["content_updated_at", "id"],
+                name="materials_c_content_6a7e92_idx",
+            ),
+        ),
+        migrations.RunPython(backfill_course_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("materials", "0008_course_aggregates"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="preview_variants",
+            field=models.JSONField(
+                blank=True, default=dict, editable=False, verbose_name="Варианты превью"
+            ),
+        ),
+        migrations.AddField(
+            model_name="lesson",
+            name="preview_variants",
+            field=models.JSONField(
+                blank=True, default=dict, editable=False, verbose_name="Варианты превью"
+            ),
+        ),
+    ]
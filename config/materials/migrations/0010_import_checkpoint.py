@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("materials", "0009_preview_variants"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "key",
+                    models.CharField(max_length=255, unique=True, verbose_name="Ключ"),
+                ),
+                (
+                    "position",
+                    models.PositiveBigIntegerField(
+                        default=0, verbose_name="Обработано записей"
+                    ),
+                ),
+                (
+                    "imported",
+                    models.PositiveBigIntegerField(
+                        default=0, verbose_name="Импортировано записей"
+                    ),
+                ),
+                (
+                    "failed",
+                    models.PositiveBigIntegerField(
+                        default=0, verbose_name="Записей с ошибками"
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="Дата обновления"),
+                ),
+            ],
+            options={
+                "verbose_name": "Позиция импорта",
+                "verbose_name_plural": "Позиции импорта",
+            },
+        ),
+    ]
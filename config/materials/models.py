@@ -1,4 +1,6 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.utils import timezone
 
 from config.settings import AUTH_USER_MODEL
 
@@ -8,6 +10,10 @@ class Course(models.Model):
     preview = models.ImageField(
         upload_to="courses/previews/", blank=True, null=True, verbose_name="Превью"
     )
+    # Уменьшенные варианты превью (materials.thumbnails), строятся в фоне
+    preview_variants = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Варианты превью"
+    )
     description = models.TextField(blank=True, null=True, verbose_name="Описание")
     price = models.DecimalField(
         max_digits=10, decimal_places=2, default=0, verbose_name="Цена"
@@ -22,13 +28,87 @@ class Course(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+    # Заполняется триггером PostgreSQL по name и description (см. миграцию 0007),
+    # GIN-индекс по полю также создается только в PostgreSQL
+    search_vector = SearchVectorField(
+        null=True, editable=False, verbose_name="Поисковый вектор"
+    )
+
+    # Денормализованные агрегаты: поддерживаются сигналами (materials.signals)
+    # в той же транзакции, что и изменение уроков, подписок и платежей,
+    # пересчитываются командой rebuild_course_aggregates
+    lessons_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Количество уроков"
+    )
+    lessons_total_price = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=0,
+        editable=False,
+        verbose_name="Суммарная цена уроков",
+    )
+    content_updated_at = models.DateTimeField(
+        default=timezone.now,
+        editable=False,
+        verbose_name="Дата изменения материалов",
+    )
+    subscribers_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Количество подписчиков"
+    )
+    purchases_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Количество покупок"
+    )
+
+    AGGREGATE_FIELDS = frozenset(
+        {
+            "lessons_count",
+            "lessons_total_price",
+            "content_updated_at",
+            "subscribers_count",
+            "purchases_count",
+        }
+    )
 
     def __str__(self):
         return self.name
 
+    def save(
+        self, *, force_insert=False, force_update=False, using=None, update_fields=None
+    ):
+        """
+        Сохранение существующего курса не записывает агрегаты: значения в
+        экземпляре могут устареть, пока сигналы меняют их через F() в
+        других транзакциях. Агрегаты записываются, только если явно названы
+        в update_fields
+        """
+        if update_fields is None and not force_insert and not self._state.adding:
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.attname not in deferred
+                and field.name not in self.AGGREGATE_FIELDS
+            ]
+        super().save(
+            force_insert=force_insert,
+            force_update=force_update,
+            using=using,
+            update_fields=update_fields,
+        )
+
     class Meta:
         verbose_name = "Курс"
         verbose_name_plural = "Курсы"
+        indexes = [
+            # Курсорная пагинация по (created_at, id)
+            models.Index(fields=["created_at", "id"]),
+            # Каталог по популярности, размеру и свежести материалов
+            models.Index(fields=["subscribers_count", "id"]),
+            models.Index(fields=["purchases_count", "id"]),
+            models.Index(fields=["lessons_count", "id"]),
+            models.Index(fields=["content_updated_at", "id"]),
+        ]
 
 
 class Lesson(models.Model):
@@ -37,6 +117,10 @@ class Lesson(models.Model):
     preview = models.ImageField(
         upload_to="lessons/previews/", blank=True, null=True, verbose_name="Превью"
     )
+    # Уменьшенные варианты превью (materials.thumbnails), строятся в фоне
+    preview_variants = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Варианты превью"
+    )
     video_link = models.URLField(blank=True, null=True, verbose_name="Ссылка на видео")
     course = models.ForeignKey(
         Course, on_delete=models.CASCADE, related_name="lessons", verbose_name="Курс"
@@ -54,10 +138,51 @@ class Lesson(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+    # Заполняется триггером PostgreSQL по name и description (см. миграцию 0007),
+    # GIN-индекс по полю также создается только в PostgreSQL
+    search_vector = SearchVectorField(
+        null=True, editable=False, verbose_name="Поисковый вектор"
+    )
 
     def __str__(self):
         return self.name
 
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        # Состояние, запомненное при загрузке (materials.signals), устарело
+        self._loaded_state = None
+
     class Meta:
         verbose_name = "Урок"
         verbose_name_plural = "Уроки"
+        indexes = [
+            # Курсорная пагинация по (created_at, id)
+            models.Index(fields=["created_at", "id"]),
+        ]
+
+
+class ImportCheckpoint(models.Model):
+    """
+    Позиция импорта import_materials: сколько записей входного потока
+    вошло в зафиксированные пакеты. Обновляется в транзакции пакета,
+    поэтому возобновление начинается ровно после последнего пакета в БД
+    """
+
+    key = models.CharField(max_length=255, unique=True, verbose_name="Ключ")
+    position = models.PositiveBigIntegerField(
+        default=0, verbose_name="Обработано записей"
+    )
+    imported = models.PositiveBigIntegerField(
+        default=0, verbose_name="Импортировано записей"
+    )
+    failed = models.PositiveBigIntegerField(
+        default=0, verbose_name="Записей с ошибками"
+    )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    def __str__(self):
+        return self.key
+
+    class Meta:
+        verbose_name = "Позиция импорта"
+        verbose_name_plural = "Позиции импорта"
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from materials.tasks import send_course_update_notification
+
+NOTIFICATION_KEY_PREFIX = "materials:notification:course"
+
+
+def get_notification_key(course_id):
+    return f"{NOTIFICATION_KEY_PREFIX}:{course_id}"
+
+
+def schedule_course_update_notification(course_id):
+    """
+    Планирует одно отложенное уведомление об обновлении курса.
+
+    Первое изменение курса или его уроков ставит задачу с задержкой
+    COURSE_NOTIFICATION_DELAY и занимает ключ курса в кеше (Redis, локально -
+    кеш в памяти) на COURSE_NOTIFICATION_INTERVAL. Пока ключ занят, новые
+    изменения не ставят задач: серия правок сворачивается в одно письмо,
+    а подписчики получают не больше одного уведомления за интервал.
+    Возвращает True, если задача поставлена.
+    """
+    key = get_notification_key(course_id)
+    if not cache.add(key, True, timeout=settings.COURSE_NOTIFICATION_INTERVAL):
+        return False
+    try:
+        send_course_update_notification.apply_async(
+            args=(course_id,), countdown=settings.COURSE_NOTIFICATION_DELAY
+        )
+    except Exception:
+        # Задача не поставлена: освобождаем ключ, чтобы не потерять уведомление
+        cache.delete(key)
+        raise
+    return True
+
+
+def on_course_updated(*course_ids):
+    """Планирование уведомлений после фиксации транзакции изменения"""
+    for course_id in set(course_ids):
+        if course_id is not None:
+            transaction.on_commit(
+                lambda course_id=course_id: schedule_course_update_notification(
+                    course_id
+                )
+            )
@@ -1,7 +1,262 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Курсорная (keyset) пагинация по паре (поле сортировки, id).
+
+    Вместо COUNT(*) и OFFSET страница выбирается условием
+    (field, id) < (последнее значение, последний id), поэтому стоимость
+    запроса не зависит от глубины прокрутки. Поле сортировки берется
+    из OrderingFilter (?ordering=), затем из cursor_ordering представления.
+    """
+
+    page_size = 10
+    page_size_query_param = "page_size"
+    max_page_size = 50
+    cursor_query_param = "cursor"
+    mode_query_param = "pagination"
+    mode_query_value = "cursor"
+    default_ordering = "-created_at"
+    invalid_cursor_message = "Неверный курсор"
+
+    @classmethod
+    def is_requested(cls, request):
+        """Клиент явно запросил курсорный режим или прислал курсор"""
+        return (
+            request.query_params.get(cls.mode_query_param) == cls.mode_query_value
+            or cls.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset с запросом страницы через асинхронный ORM"""
+        queryset = self.get_page_queryset(queryset, request, view)
+        return self.set_page([obj async for obj in queryset])
+
+    def get_page_queryset(self, queryset, request, view):
+        """Запрос страницы: условие курсора, сортировка и LIMIT"""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        field, descending = self.split_ordering(self.ordering)
+
+        position = self.decode_cursor(request, queryset.model, field)
+        if position is not None:
+            value, pk = position
+            if descending:
+                condition = Q(**{f"{field}__lt": value}) | Q(
+                    **{field: value, "pk__lt": pk}
+                )
+            else:
+                condition = Q(**{f"{field}__gt": value}) | Q(
+                    **{field: value, "pk__gt": pk}
+                )
+            queryset = queryset.filter(condition)
+
+        prefix = "-" if descending else ""
+        order_by = [f"{prefix}pk"] if field == "pk" else [f"{prefix}{field}"]
+        if field != "pk":
+            order_by.append(f"{prefix}pk")
+        queryset = queryset.order_by(*order_by)
+
+        # Берем на одну запись больше, чтобы узнать, есть ли следующая страница
+        return queryset[: self.page_size + 1]
+
+    def set_page(self, results):
+        """Записи страницы из результата get_page_queryset и позиция следующей"""
+        field, _ = self.split_ordering(self.ordering)
+        self.has_next = len(results) > self.page_size
+        results = results[: self.page_size]
+
+        self.next_position = None
+        if self.has_next and results:
+            last = results[-1]
+            self.next_position = (getattr(last, field), last.pk)
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Поле сортировки: ?ordering= через OrderingFilter представления,
+        иначе cursor_ordering представления, иначе default_ordering
+        """
+        for backend in getattr(view, "filter_backends", []):
+            if hasattr(backend, "get_ordering"):
+                ordering = backend().get_ordering(request, queryset, view)
+                if ordering:
+                    return ordering[0]
+        return getattr(view, "cursor_ordering", self.default_ordering)
+
+    @staticmethod
+    def split_ordering(ordering):
+        descending = ordering.startswith("-")
+        field = ordering.lstrip("-")
+        if field == "id":
+            field = "pk"
+        return field, descending
+
+    def encode_cursor(self, position):
+        value, pk = position
+        if isinstance(value, (datetime, date)):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = str(value)
+        payload = json.dumps({"o": self.ordering, "v": value, "id": pk})
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    @staticmethod
+    def get_model_field(model, field):
+        """Поле модели для сортировки field или None (аннотации, пути с __)"""
+        if field == "pk":
+            return model._meta.pk
+        try:
+            return model._meta.get_field(field)
+        except FieldDoesNotExist:
+            return None
+
+    def decode_cursor(self, request, model, field):
+        """
+        Позиция (значение, id) из курсора. Значение приводится через
+        to_python поля сортировки, поэтому подделанный курсор дает 404,
+        а не ошибку в filter()
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if payload["o"] != self.ordering:
+                raise ValueError("ordering mismatch")
+            value = payload["v"]
+            if value is None:
+                raise ValueError("empty value")
+            model_field = self.get_model_field(model, field)
+            if model_field is not None:
+                value = model_field.to_python(value)
+            return value, model._meta.pk.to_python(payload["id"])
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.mode_query_param, self.mode_query_value)
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.next_position)
+        )
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.mode_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Режим пагинации: cursor — курсорная (keyset) пагинация",
+                "schema": {"type": "string", "enum": [self.mode_query_value]},
+            },
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Курсор следующей страницы",
+                "schema": {"type": "string"},
+            },
+        ]
 
 
 class LessonCoursePagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = "page_size"
     max_page_size = 50
+    keyset_pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        По умолчанию - постраничная пагинация, по запросу
+        (?pagination=cursor или ?cursor=...) - курсорная
+        """
+        self.keyset = None
+        if self.keyset_pagination_class.is_requested(request):
+            self.keyset = self.keyset_pagination_class()
+            self.keyset.page_size = self.page_size
+            self.keyset.max_page_size = self.max_page_size
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        paginate_queryset для асинхронных представлений: COUNT(*) и
+        запрос страницы выполняются асинхронным ORM
+        """
+        self.keyset = None
+        if self.keyset_pagination_class.is_requested(request):
+            self.keyset = self.keyset_pagination_class()
+            self.keyset.page_size = self.page_size
+            self.keyset.max_page_size = self.max_page_size
+            return await self.keyset.apaginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        # count - cached_property пагинатора Django: подставляем посчитанное
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(
+                self.invalid_page_message.format(
+                    page_number=page_number, message=str(exc)
+                )
+            )
+        self.page.object_list = [obj async for obj in self.page.object_list]
+        return self.page.object_list
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(
+            view
+        ) + self.keyset_pagination_class().get_schema_operation_parameters(view)
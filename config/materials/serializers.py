@@ -1,10 +1,127 @@
 from rest_framework import serializers
 from materials.models import Course, Lesson
 
+from materials.thumbnails import get_variant_urls
 from materials.validators import validate_no_external_links
 
 
-class LessonSerializer(serializers.ModelSerializer):
+class ImageVariantsField(serializers.Field):
+    """
+    URL уменьшенных вариантов изображения image_field:
+    {"thumb": {"webp": url, "jpeg": url}, ...}. Пустой объект, пока
+    варианты не построены
+    """
+
+    def __init__(self, image_field, **kwargs):
+        self.image_field = image_field
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        model = self.parent.Meta.model
+        storage = model._meta.get_field(self.image_field).storage
+        return get_variant_urls(value, storage, self.context.get("request"))
+
+
+class PrefetchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField, который сначала ищет объект среди загруженных
+    заранее в context["related_objects"][имя поля]: массовые операции
+    загружают связанные объекты одним запросом на весь пакет
+    """
+
+    def to_internal_value(self, data):
+        objects = self.context.get("related_objects", {}).get(self.field_name)
+        if objects is not None and isinstance(data, (int, str)):
+            obj = objects.get(str(data))
+            if obj is not None:
+                return obj
+        return super().to_internal_value(data)
+
+
+class DynamicFieldsMixin:
+    """
+    Выборочные поля и раскрытие вложенных коллекций для GET-запросов:
+    ?fields=id,name - только перечисленные поля,
+    ?expand=lessons - включить вложенную коллекцию.
+
+    Вложенные коллекции из expandable_fields в действиях collapsed_actions
+    скрыты, пока их не запросили явно; в остальных действиях раскрыты.
+    """
+
+    fields_query_param = "fields"
+    expand_query_param = "expand"
+    expandable_fields = ()
+    collapsed_actions = ("list",)
+
+    @staticmethod
+    def parse_names(request, param):
+        """Множество имен из параметра запроса или None, если параметра нет"""
+        if request is None or request.method != "GET":
+            return None
+        if param not in request.query_params:
+            return None
+        return {
+            name.strip()
+            for name in request.query_params[param].split(",")
+            if name.strip()
+        }
+
+    @classmethod
+    def get_requested_fields(cls, request):
+        return cls.parse_names(request, cls.fields_query_param)
+
+    @classmethod
+    def get_expand(cls, request, action):
+        expand = cls.parse_names(request, cls.expand_query_param)
+        if expand is None:
+            expand = (
+                set() if action in cls.collapsed_actions else set(cls.expandable_fields)
+            )
+        # Вложенное поле, явно перечисленное в ?fields=, тоже раскрывается
+        expand |= cls.get_requested_fields(request) or set()
+        return expand & set(cls.expandable_fields)
+
+    @classmethod
+    def get_model_columns(cls, request):
+        """Колонки модели для queryset.only() или None, если нужны все поля"""
+        requested = cls.get_requested_fields(request)
+        if requested is None:
+            return None
+        concrete = {field.name for field in cls.Meta.model._meta.concrete_fields}
+        return {"id"} | (requested & concrete)
+
+    def is_top_level(self):
+        return self.parent is None or (
+            isinstance(self.parent, serializers.ListSerializer)
+            and self.parent.parent is None
+        )
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get("request")
+        if request is None or not self.is_top_level():
+            return fields
+
+        view = self.context.get("view")
+        expand = self.get_expand(request, getattr(view, "action", None))
+        for name in self.expandable_fields:
+            if name not in expand:
+                fields.pop(name, None)
+
+        requested = self.get_requested_fields(request)
+        if requested is not None:
+            for name in list(fields):
+                if name not in requested and name not in expand:
+                    fields.pop(name)
+        return fields
+
+
+class LessonSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    preview_variants = ImageVariantsField("preview")
+    course = PrefetchedPrimaryKeyRelatedField(
+        queryset=Course.objects.all(), label="Курс"
+    )
     video_link = serializers.URLField(
         validators=[validate_no_external_links],
         required=False,
@@ -17,13 +134,13 @@ class LessonSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Lesson
-        fields = "__all__"
+        exclude = ["search_vector"]
         read_only_fields = ["owner"]
 
 
-class CourseSerializer(serializers.ModelSerializer):
-    lessons_count = serializers.SerializerMethodField()
+class CourseSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     lessons = LessonSerializer(many=True, read_only=True)
+    preview_variants = ImageVariantsField("preview")
 
     description = serializers.CharField(
         validators=[validate_no_external_links], required=False, allow_blank=True
@@ -35,12 +152,24 @@ class CourseSerializer(serializers.ModelSerializer):
             "id",
             "name",
             "preview",
+            "preview_variants",
             "description",
             "lessons_count",
+            "lessons_total_price",
+            "content_updated_at",
+            "subscribers_count",
+            "purchases_count",
             "lessons",
             "owner",
         ]
-        read_only_fields = ["owner"]
+        # Агрегаты хранятся в курсе и поддерживаются сигналами
+        read_only_fields = [
+            "owner",
+            "lessons_count",
+            "lessons_total_price",
+            "content_updated_at",
+            "subscribers_count",
+            "purchases_count",
+        ]
 
-    def get_lessons_count(self, obj):
-        return obj.lessons.count()
+    expandable_fields = ("lessons",)
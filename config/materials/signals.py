@@ -0,0 +1,256 @@
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from materials.aggregates import PURCHASE_STATUS, adjust_course
+from materials.cache import (
+    invalidate_course,
+    invalidate_lesson,
+    invalidate_subscriptions,
+)
+from materials.models import Course, Lesson
+from materials.thumbnails import schedule_image_variants
+from users.models import Payment, Subscription
+
+# Сохранение построенных вариантов превью урока (generate_image_variants):
+# курс и цена не меняются, агрегаты и дата изменения курса не трогаются
+LESSON_VARIANTS_UPDATE_FIELDS = frozenset({"preview_variants", "updated_at"})
+
+
+def is_lesson_variants_update(update_fields):
+    return update_fields is not None and update_fields <= LESSON_VARIANTS_UPDATE_FIELDS
+
+
+# Поля, изменения которых меняют агрегаты курсов
+LESSON_STATE_FIELDS = ("course", "price")
+PAYMENT_STATE_FIELDS = ("status", "paid_course")
+
+
+def is_saved_field(name, attname, update_fields):
+    return update_fields is None or name in update_fields or attname in update_fields
+
+
+def saves_state_fields(instance, field_names, update_fields):
+    """Сохранение записывает хотя бы одно из полей field_names"""
+    return any(
+        is_saved_field(name, instance._meta.get_field(name).attname, update_fields)
+        for name in field_names
+    )
+
+
+def remember_loaded_state(instance, field_names, update_fields=None):
+    """
+    Значения полей field_names, записанные в БД: после загрузки объекта
+    или после сохранения (только полей update_fields). pre_save сравнивает
+    с ними без повторного SELECT. Если поле отложено (only/defer) или
+    объект новый, состояние неизвестно (None)
+    """
+    loaded = getattr(instance, "_loaded_state", None)
+    if instance.pk is None or (update_fields is not None and loaded is None):
+        instance._loaded_state = None
+        return
+    state = {}
+    for name in field_names:
+        attname = instance._meta.get_field(name).attname
+        if not is_saved_field(name, attname, update_fields):
+            state[attname] = loaded[attname]
+        elif attname in instance.__dict__:
+            state[attname] = instance.__dict__[attname]
+        else:
+            instance._loaded_state = None
+            return
+    instance._loaded_state = state
+
+
+def get_previous_state(instance, field_names):
+    """Значения полей до сохранения: запомненные или одним запросом"""
+    previous = getattr(instance, "_loaded_state", None)
+    if previous is None:
+        previous = (
+            type(instance)
+            ._base_manager.filter(pk=instance.pk)
+            .values(*(instance._meta.get_field(name).attname for name in field_names))
+            .first()
+        )
+    return previous
+
+
+def is_course_cascade(origin):
+    """Удаление каскадом от удаляемого курса: его агрегаты не нужны"""
+    if isinstance(origin, QuerySet):
+        return origin.model is Course
+    return isinstance(origin, Course)
+
+
+def get_course_owner_id(course_id):
+    return (
+        Course.objects.filter(pk=course_id).values_list("owner_id", flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def invalidate_course_cache(sender, instance, **kwargs):
+    invalidate_course(instance.owner_id)
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Lesson)
+def schedule_preview_variants(sender, instance, update_fields=None, **kwargs):
+    """Новое превью: варианты строятся в фоне после фиксации транзакции"""
+    schedule_image_variants(instance, update_fields)
+
+
+@receiver(post_init, sender=Lesson)
+def remember_loaded_lesson(sender, instance, **kwargs):
+    remember_loaded_state(instance, LESSON_STATE_FIELDS)
+
+
+@receiver(pre_save, sender=Lesson)
+def remember_lesson_state(sender, instance, update_fields=None, **kwargs):
+    """
+    Урок могут перенести в другой курс или изменить цену: запоминаем
+    прежние курс и цену из загруженного состояния
+    """
+    instance._previous_state = None
+    if instance.pk and not is_lesson_variants_update(update_fields):
+        instance._previous_state = get_previous_state(instance, LESSON_STATE_FIELDS)
+
+
+@receiver(post_save, sender=Lesson)
+def update_course_aggregates_on_lesson_save(
+    sender, instance, created, update_fields=None, **kwargs
+):
+    if is_lesson_variants_update(update_fields):
+        return
+    previous = getattr(instance, "_previous_state", None)
+    if created or previous is None:
+        adjust_course(
+            instance.course_id,
+            touch=True,
+            lessons_count=1,
+            lessons_total_price=instance.price,
+        )
+    elif previous["course_id"] != instance.course_id:
+        adjust_course(
+            previous["course_id"],
+            touch=True,
+            lessons_count=-1,
+            lessons_total_price=-previous["price"],
+        )
+        adjust_course(
+            instance.course_id,
+            touch=True,
+            lessons_count=1,
+            lessons_total_price=instance.price,
+        )
+    else:
+        adjust_course(
+            instance.course_id,
+            touch=True,
+            lessons_total_price=instance.price - previous["price"],
+        )
+
+
+@receiver(post_delete, sender=Lesson)
+def update_course_aggregates_on_lesson_delete(sender, instance, origin=None, **kwargs):
+    if is_course_cascade(origin):
+        return
+    adjust_course(
+        instance.course_id,
+        touch=True,
+        lessons_count=-1,
+        lessons_total_price=-instance.price,
+    )
+
+
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+def invalidate_lesson_cache(sender, instance, **kwargs):
+    invalidate_lesson(instance.owner_id)
+    invalidate_course(get_course_owner_id(instance.course_id))
+    previous = getattr(instance, "_previous_state", None)
+    if previous and previous["course_id"] != instance.course_id:
+        invalidate_course(get_course_owner_id(previous["course_id"]))
+
+
+@receiver(post_save, sender=Lesson)
+def remember_saved_lesson(sender, instance, update_fields=None, **kwargs):
+    remember_loaded_state(instance, LESSON_STATE_FIELDS, update_fields)
+
+
+@receiver(post_save, sender=Subscription)
+def update_subscribers_count_on_save(sender, instance, created, **kwargs):
+    if created:
+        adjust_course(instance.course_id, subscribers_count=1)
+
+
+@receiver(post_delete, sender=Subscription)
+def update_subscribers_count_on_delete(sender, instance, origin=None, **kwargs):
+    if not is_course_cascade(origin):
+        adjust_course(instance.course_id, subscribers_count=-1)
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_subscription_cache(sender, instance, **kwargs):
+    invalidate_subscriptions(instance.user_id)
+    # Количество подписчиков входит в ответ курса
+    invalidate_course(get_course_owner_id(instance.course_id))
+
+
+def get_purchased_course_id(status, paid_course_id):
+    """Курс, покупкой которого является платеж, или None"""
+    return paid_course_id if status == PURCHASE_STATUS else None
+
+
+def move_purchase(before, after):
+    """Покупка перешла из курса before в курс after (любой может быть None)"""
+    if before == after:
+        return
+    for course_id, delta in ((before, -1), (after, 1)):
+        if course_id is not None:
+            adjust_course(course_id, purchases_count=delta)
+            # Количество покупок входит в ответ курса
+            invalidate_course(get_course_owner_id(course_id))
+
+
+@receiver(post_init, sender=Payment)
+def remember_loaded_payment(sender, instance, **kwargs):
+    remember_loaded_state(instance, PAYMENT_STATE_FIELDS)
+
+
+@receiver(pre_save, sender=Payment)
+def remember_payment_state(sender, instance, update_fields=None, **kwargs):
+    """Запоминаем прежние статус и курс платежа"""
+    instance._previous_state = None
+    if instance.pk and saves_state_fields(
+        instance, PAYMENT_STATE_FIELDS, update_fields
+    ):
+        instance._previous_state = get_previous_state(instance, PAYMENT_STATE_FIELDS)
+
+
+@receiver(post_save, sender=Payment)
+def update_purchases_count_on_save(sender, instance, created, **kwargs):
+    # Сохранение без статуса и курса (например, ссылки оплаты) покупок не меняет
+    if not created and instance._previous_state is None:
+        return
+    previous = instance._previous_state
+    before = previous and get_purchased_course_id(**previous)
+    move_purchase(
+        before, get_purchased_course_id(instance.status, instance.paid_course_id)
+    )
+
+
+@receiver(post_save, sender=Payment)
+def remember_saved_payment(sender, instance, update_fields=None, **kwargs):
+    remember_loaded_state(instance, PAYMENT_STATE_FIELDS, update_fields)
+
+
+@receiver(post_delete, sender=Payment)
+def update_purchases_count_on_delete(sender, instance, origin=None, **kwargs):
+    if is_course_cascade(origin):
+        return
+    move_purchase(
+        get_purchased_course_id(instance.status, instance.paid_course_id), None
+    )
@@ -1,50 +1,152 @@
 from celery import shared_task
-from django.core.mail import send_mail
+from celery.utils.log import get_task_logger
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMessage, get_connection
 from django.conf import settings
 from materials.models import Course
+from materials.thumbnails import generate_image_variants
 from users.models import Subscription
 
+logger = get_task_logger(__name__)
+
+User = get_user_model()
+
+NOTIFICATION_SUBJECT = 'Обновление курса "{course_name}"'
+NOTIFICATION_BODY = """
+Здравствуйте{name}!
+
+Курс "{course_name}" был обновлен. Проверьте новые материалы!
+
+Ссылка на курс: {domain}/courses/{course_id}/
+
+С уважением,
+Команда LMS System
+"""
+
+
+def build_course_update_message(course, user, connection):
+    """Персональное письмо одному подписчику: адрес не виден остальным"""
+    name = f", {user.first_name}" if user.first_name else ""
+    return EmailMessage(
+        subject=NOTIFICATION_SUBJECT.format(course_name=course.name),
+        body=NOTIFICATION_BODY.format(
+            name=name,
+            course_name=course.name,
+            domain=settings.DOMAIN,
+            course_id=course.id,
+        ),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[user.email],
+        connection=connection,
+    )
+
 
 @shared_task
 def send_course_update_notification(course_id):
     """
-    Асинхронная отправка уведомлений об обновлении курса
+    Асинхронная отправка уведомлений об обновлении курса.
+
+    Id подписчиков читаются потоком (.iterator()) и раздаются пачками по
+    NOTIFICATION_CHUNK_SIZE в подзадачи send_course_update_chunk, поэтому
+    ни список адресов, ни письмо не растут вместе с числом подписчиков
     """
-    try:
-        course = Course.objects.get(id=course_id)
-        subscriptions = Subscription.objects.filter(course=course).select_related(
-            "user"
-        )
+    if not Course.objects.filter(id=course_id).exists():
+        return "Курс не найден"
 
-        emails = [sub.user.email for sub in subscriptions if sub.user.email]
+    chunk_size = settings.NOTIFICATION_CHUNK_SIZE
+    user_ids = (
+        Subscription.objects.filter(course_id=course_id)
+        .exclude(user__email="")
+        .order_by("user_id")
+        .values_list("user_id", flat=True)
+        .iterator(chunk_size=chunk_size)
+    )
 
-        if emails:
-            subject = f'Обновление курса "{course.name}"'
-            message = f"""
-            Здравствуйте!
+    chunk, chunks, recipients = [], 0, 0
+    for user_id in user_ids:
+        chunk.append(user_id)
+        if len(chunk) == chunk_size:
+            send_course_update_chunk.delay(course_id, chunk)
+            chunks += 1
+            recipients += len(chunk)
+            chunk = []
+    if chunk:
+        send_course_update_chunk.delay(course_id, chunk)
+        chunks += 1
+        recipients += len(chunk)
 
-            Курс "{course.name}" был обновлен. Проверьте новые материалы!
+    if not recipients:
+        return "Нет подписчиков для уведомления"
+    return (
+        f"Уведомления для {recipients} подписчиков курса {course_id} "
+        f"разбиты на {chunks} подзадач"
+    )
 
-            Ссылка на курс: {settings.DOMAIN}/courses/{course.id}/
 
-            С уважением,
-            Команда LMS System
-            """
+@shared_task(bind=True)
+def send_course_update_chunk(self, course_id, user_ids):
+    """
+    Отправка уведомлений одной пачке подписчиков через одно SMTP-соединение.
 
-            send_mail(
-                subject=subject,
-                message=message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=emails,
-                fail_silently=False,
-            )
+    Ошибка отдельного адреса не прерывает пачку: неотправленные адреса
+    собираются и повторяются с экспоненциальной задержкой (не более
+    NOTIFICATION_MAX_RETRIES раз), уже отправленные письма не дублируются
+    """
+    course = Course.objects.filter(id=course_id).only("id", "name").first()
+    if course is None:
+        return "Курс не найден"
 
-            return (
-                f"Уведомления отправлены {len(emails)} подписчикам курса {course.name}"
-            )
-        return "Нет подписчиков для уведомления"
+    users = User.objects.filter(id__in=user_ids).only("id", "email", "first_name")
+    sent, failed = set(), []
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+        for user in users:
+            if not user.email:
+                continue
+            try:
+                build_course_update_message(course, user, connection).send()
+                sent.add(user.id)
+            except OSError as e:
+                # smtplib.SMTPException и сетевые ошибки - подклассы OSError
+                logger.warning(
+                    "Уведомление курса %s пользователю %s не отправлено: %s",
+                    course_id,
+                    user.id,
+                    e,
+                )
+                failed.append(user.id)
+    except OSError as e:
+        # Не удалось открыть соединение: повторяем всю пачку
+        logger.warning("SMTP-соединение для курса %s не открыто: %s", course_id, e)
+        failed = [user_id for user_id in user_ids if user_id not in sent]
+    finally:
+        connection.close()
 
-    except Course.DoesNotExist:
-        return "Курс не найден"
-    except Exception as e:
-        return f"Ошибка отправки уведомлений: {str(e)}"
+    if failed and self.request.retries < settings.NOTIFICATION_MAX_RETRIES:
+        raise self.retry(
+            args=(course_id, failed),
+            countdown=60 * 2**self.request.retries,
+            max_retries=settings.NOTIFICATION_MAX_RETRIES,
+        )
+
+    result = f"Отправлено {len(sent)} из {len(user_ids)} уведомлений курса {course_id}"
+    if failed:
+        logger.error(
+            "Уведомления курса %s не отправлены после повторов: %s",
+            course_id,
+            failed,
+        )
+        result += f", не отправлено: {len(failed)}"
+    return result
+
+
+@shared_task
+def generate_image_variants_task(model_label, pk, field_name):
+    """
+    Фоновое построение уменьшенных вариантов (WebP/JPEG) изображения
+    объекта; неизмененный исходник повторно не обрабатывается
+    """
+    if generate_image_variants(model_label, pk, field_name):
+        return f"Варианты изображения {model_label}({pk}).{field_name} обновлены"
+    return f"Изображение {model_label}({pk}).{field_name} не изменилось"
@@ -1,68 +1,112 @@
+import base64
+import json
+import os
+import re
+import shutil
+import smtplib
+import tempfile
+from collections import Counter
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import urlencode
+
 from django.contrib.auth import get_user_model
-from rest_framework.test import APITestCase, APIClient
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core import mail
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APITestCase
 from rest_framework import status
-from materials.models import Course, Lesson
+from rest_framework_simplejwt.tokens import AccessToken
+from config.celery import app as celery_app
+from materials.aggregates import rebuild_course_aggregates
+from materials.imports import LessonImporter, format_copy_value
+from materials.management.commands.benchmark_api import (
+    ClientTransport,
+    Command as BenchmarkAPICommand,
+)
+from materials.models import Course, ImportCheckpoint, Lesson
+from materials.tasks import send_course_update_notification
+from materials.thumbnails import generate_image_variants
+from materials.serializers import CourseSerializer
+from materials.timing import timed_serializer_class
+from PIL import Image
+from users.models import Payment, Subscription
+from users.permissions import IsOwnerOrModerator, IsOwnerOrModeratorForList
+from materials.validators import (
+    DEFAULT_ALLOWED_DOMAINS,
+    LinkPolicy,
+    validate_no_external_links,
+)
 
 User = get_user_model()
 
 
-class LessonCRUDTestCase(APITestCase):
+class MaterialsAPITestCase(APITestCase):
     """
-    Тестирование CRUD операций для уроков с разными правами доступа
+    Общие данные тестов API материалов: владелец owner_user, другой
+    пользователь other_user и модератор moderator_user (группа moderators).
+    Клиент аутентифицирован владельцем, если authenticate_owner
     """
 
-    def setUp(self):
-        """Заполнение базы данных тестовыми данными"""
-        # Создаем пользователей с разными ролями
-        self.owner_user = User.objects.create_user(
-            email="owner@example.com",
-            password="testpass123",
-            first_name="Owner",
-            last_name="User",
-        )
+    authenticate_owner = True
 
-        self.other_user = User.objects.create_user(
-            email="other@example.com",
-            password="testpass123",
-            first_name="Other",
-            last_name="User",
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner_user = User.objects.create_user(
+            email="owner@example.com", password="testpass123"
         )
-
-        self.moderator_user = User.objects.create_user(
-            email="moderator@example.com",
-            password="testpass123",
-            first_name="Moderator",
-            last_name="User",
+        cls.other_user = User.objects.create_user(
+            email="other@example.com", password="testpass123"
+        )
+        cls.moderator_user = User.objects.create_user(
+            email="moderator@example.com", password="testpass123"
         )
+        moderators_group, _ = Group.objects.get_or_create(name="moderators")
+        cls.moderator_user.groups.add(moderators_group)
 
-        # Создаем группу модераторов и добавляем пользователя
-        from django.contrib.auth.models import Group
+    def setUp(self):
+        if self.authenticate_owner:
+            self.client.force_authenticate(user=self.owner_user)
+
+
+class LessonCRUDTestCase(MaterialsAPITestCase):
+    """
+    Тестирование CRUD операций для уроков с разными правами доступа
+    """
 
-        moderators_group, created = Group.objects.get_or_create(name="moderators")
-        self.moderator_user.groups.add(moderators_group)
+    authenticate_owner = False
 
+    @classmethod
+    def setUpTestData(cls):
+        """Заполнение базы данных тестовыми данными"""
+        super().setUpTestData()
         # Создаем курс
-        self.course = Course.objects.create(
+        cls.course = Course.objects.create(
             name="Test Course",
             description="Test Course Description",
-            owner=self.owner_user,
+            owner=cls.owner_user,
         )
 
         # Создаем урок
-        self.lesson = Lesson.objects.create(
+        cls.lesson = Lesson.objects.create(
             name="Test Lesson",
             description="Test Lesson Description",
-            course=self.course,
-            owner=self.owner_user,
+            course=cls.course,
+            owner=cls.owner_user,
             video_link="https://youtube.com/watch?v=test123",
         )
 
         # URL для тестирования
-        self.lessons_list_url = "/api/materials/lessons/"
-        self.lesson_detail_url = f"/api/materials/lessons/{self.lesson.id}/"
-
-        # Клиент для запросов
-        self.client = APIClient()
+        cls.lessons_list_url = "/api/materials/lessons/"
+        cls.lesson_detail_url = f"/api/materials/lessons/{cls.lesson.id}/"
 
     def test_lesson_list_authenticated(self):
         """Тест получения списка уроков аутентифицированным пользователем"""
@@ -231,3 +275,1742 @@ class LessonCRUDTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn("description", response.data)
         self.assertEqual(Lesson.objects.count(), 1)
+
+
+@override_settings(PRINCIPAL_ROLES_CACHE_TIMEOUT=0, RESPONSE_CACHE_TIMEOUT=0)
+class CourseQueryCountTestCase(MaterialsAPITestCase):
+    """
+    Количество SQL-запросов на список и детали курсов не зависит от числа курсов
+    """
+
+    def seed_courses(self, count, lessons_per_course=3):
+        """Создание курсов с уроками"""
+        courses = Course.objects.bulk_create(
+            Course(name=f"Course {i}", owner=self.owner_user) for i in range(count)
+        )
+        Lesson.objects.bulk_create(
+            Lesson(name=f"Lesson {i}", course=course, owner=self.owner_user)
+            for course in courses
+            for i in range(lessons_per_course)
+        )
+        # bulk_create не отправляет сигналы, агрегаты пересчитываем явно
+        rebuild_course_aggregates([course.pk for course in courses])
+        return courses
+
+    def test_course_list_query_count_is_fixed(self):
+        """Тест: страница из 50 курсов стоит столько же запросов, сколько из 5"""
+        # роли, валидаторы ETag, COUNT страницы, курсы (+ уроки при ?expand=)
+        for url, expected in [
+            ("/api/materials/courses/?page_size=50", 4),
+            ("/api/materials/courses/?page_size=50&expand=lessons", 5),
+        ]:
+            self.seed_courses(5)
+            with self.assertNumQueries(expected):
+                small_page = self.client.get(url)
+            self.seed_courses(45)
+            with self.assertNumQueries(expected):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(small_page.data["results"]), 5)
+            self.assertEqual(len(response.data["results"]), 50)
+            self.assertTrue(
+                all(course["lessons_count"] == 3 for course in response.data["results"])
+            )
+            Course.objects.all().delete()
+
+    def test_course_retrieve_uses_stored_lessons_count(self):
+        """Тест: количество уроков в деталях курса хранится в курсе"""
+        course = self.seed_courses(1, lessons_per_course=4)[0]
+        # роли, валидаторы ETag, курс, уроки, подписка
+        with self.assertNumQueries(5):
+            response = self.client.get(f"/api/materials/courses/{course.id}/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["lessons_count"], 4)
+
+
+class KeysetPaginationTestCase(MaterialsAPITestCase):
+    """
+    Тестирование курсорной (keyset) пагинации уроков
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.course = Course.objects.create(name="Course", owner=cls.owner_user)
+        Lesson.objects.bulk_create(
+            Lesson(name=f"Lesson {i:02d}", course=cls.course, owner=cls.owner_user)
+            for i in range(25)
+        )
+
+    def collect_pages(self, url):
+        """Проход по всем страницам по ссылкам next"""
+        names = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn("count", response.data)
+            names.extend(lesson["name"] for lesson in response.data["results"])
+            url = response.data["next"]
+        return names
+
+    def test_cursor_mode_walks_all_rows_once(self):
+        """Тест: курсорный режим отдает все уроки ровно один раз"""
+        names = self.collect_pages(
+            "/api/materials/lessons/?pagination=cursor&page_size=10"
+        )
+        self.assertEqual(len(names), 25)
+        self.assertEqual(len(set(names)), 25)
+
+    def test_cursor_mode_honours_ordering_filter(self):
+        """Тест: курсорный режим сортирует по полю из ?ordering="""
+        names = self.collect_pages(
+            "/api/materials/lessons/?pagination=cursor&ordering=name&page_size=7"
+        )
+        self.assertEqual(names, sorted(names))
+        self.assertEqual(len(names), 25)
+
+    def test_cursor_mode_skips_count_query(self):
+        """Тест: курсорный режим не выполняет COUNT(*)"""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/api/materials/lessons/?pagination=cursor")
+        self.assertFalse(
+            any("COUNT(" in query["sql"].upper() for query in queries.captured_queries)
+        )
+
+    def test_invalid_cursor(self):
+        """Тест: поврежденный курсор возвращает 404"""
+        response = self.client.get("/api/materials/lessons/?cursor=broken")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_tampered_cursor_value(self):
+        """Тест: курсор с подмененным значением поля возвращает 404, а не 500"""
+        for ordering, value, pk in [
+            ("-created_at", "not-a-date", 1),
+            ("-created_at", None, 1),
+            ("id", "abc", 1),
+            ("name", "Lesson 05", "abc"),
+        ]:
+            payload = json.dumps({"o": ordering, "v": value, "id": pk})
+            cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+            with self.subTest(ordering=ordering, value=value, pk=pk):
+                response = self.client.get(
+                    f"/api/materials/lessons/?cursor={cursor}&ordering={ordering}"
+                )
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_page_number_mode_is_default(self):
+        """Тест: без параметров используется постраничная пагинация"""
+        response = self.client.get("/api/materials/lessons/")
+        self.assertEqual(response.data["count"], 25)
+
+
+class SearchFilterTestCase(MaterialsAPITestCase):
+    """
+    Тестирование поиска курсов и уроков по ?search=
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.course = Course.objects.create(
+            name="Python для начинающих",
+            description="Основы программирования",
+            owner=cls.owner_user,
+        )
+        Course.objects.create(
+            name="Базы данных", description="SQL запросы", owner=cls.owner_user
+        )
+
+    def test_search_by_name_and_description(self):
+        """Тест поиска по названию и описанию курса"""
+        response = self.client.get("/api/materials/courses/?search=python")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [course["id"] for course in response.data["results"]], [self.course.id]
+        )
+
+        response = self.client.get("/api/materials/courses/?search=SQL")
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0]["name"], "Базы данных")
+
+    def test_search_vector_not_exposed(self):
+        """Тест: служебное поле search_vector не попадает в ответ"""
+        Lesson.objects.create(name="Урок", course=self.course, owner=self.owner_user)
+        response = self.client.get("/api/materials/lessons/")
+        self.assertNotIn("search_vector", response.data["results"][0])
+
+
+class LinkPolicyTestCase(SimpleTestCase):
+    """
+    Тестирование проверки ссылок по разрешенным доменам
+    """
+
+    def test_allowed_hosts(self):
+        """Тест: ссылки на разрешенные домены и их поддомены проходят"""
+        for text in [
+            "Видео: https://youtube.com/watch?v=test123",
+            "Видео: https://www.youtube.com/watch?v=test123.",
+            "(https://youtu.be/test123)",
+            "Обычный текст без ссылок. Версия 1.5",
+        ]:
+            self.assertEqual(validate_no_external_links(text), text)
+
+    def test_forbidden_hosts(self):
+        """Тест: домены, лишь содержащие разрешенный, отклоняются"""
+        for text in [
+            "https://vimeo.com/external",
+            "youtube.com.evil.io/watch",
+            "https://youtube.com@evil.io/watch",
+            "https://notyoutube.com/watch",
+        ]:
+            with self.assertRaises(ValidationError):
+                validate_no_external_links(text)
+
+    def test_ip_literal_links(self):
+        """Тест: ссылки на IP-адреса и хосты без TLD отклоняются"""
+        for text in [
+            "http://192.168.0.1/x",
+            "Ссылка: https://10.0.0.1:8080/admin",
+            "http://[::1]/x",
+            "[2001:db8::1]:80/a",
+            "http://localhost/x",
+            "www.intranet/login",
+        ]:
+            with self.subTest(text=text), self.assertRaises(ValidationError):
+                validate_no_external_links(text)
+
+    def test_custom_allowed_domains(self):
+        """Тест: набор разрешенных доменов передается параметром"""
+        text = "https://vimeo.com/external"
+        self.assertEqual(
+            validate_no_external_links(text, allowed_domains=("vimeo.com",)), text
+        )
+
+    def test_too_long_text(self):
+        """Тест: слишком длинный текст отклоняется без сканирования"""
+        policy = LinkPolicy(DEFAULT_ALLOWED_DOMAINS, max_length=100)
+        with self.assertRaises(ValidationError):
+            policy.validate("youtube.com " * 10)
+
+
+# Роли из кеша, как в развертывании с общим кешем (CACHE_URL)
+@override_settings(PRINCIPAL_ROLES_CACHE_TIMEOUT=300)
+class ResponseCacheTestCase(MaterialsAPITestCase):
+    """
+    Тестирование кеша ответов курсов и уроков
+    """
+
+    authenticate_owner = False
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.course = Course.objects.create(name="Course", owner=cls.owner_user)
+        cls.lesson = Lesson.objects.create(
+            name="Lesson", course=cls.course, owner=cls.owner_user
+        )
+        cls.course_detail_url = f"/api/materials/courses/{cls.course.id}/"
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_second_request_is_served_from_cache(self):
+        """Тест: повторный запрос отдается из кеша без обращения к БД за курсами"""
+        self.client.force_authenticate(user=self.owner_user)
+        response = self.client.get("/api/materials/courses/")
+        self.assertEqual(response["X-Cache"], "MISS")
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/materials/courses/")
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertEqual(response.data["results"][0]["name"], "Course")
+
+    def test_lesson_update_invalidates_course_responses(self):
+        """Тест: изменение урока сбрасывает кеш курсов владельца и модераторов"""
+        for user in (self.owner_user, self.moderator_user):
+            self.client.force_authenticate(user=user)
+            self.client.get(self.course_detail_url)
+
+        self.client.force_authenticate(user=self.moderator_user)
+        self.client.patch(
+            f"/api/materials/lessons/{self.lesson.id}/", {"name": "Renamed"}
+        )
+
+        for user in (self.owner_user, self.moderator_user):
+            self.client.force_authenticate(user=user)
+            response = self.client.get(self.course_detail_url)
+            self.assertEqual(response["X-Cache"], "MISS")
+            self.assertEqual(response.data["lessons"][0]["name"], "Renamed")
+
+    def test_scopes_are_isolated(self):
+        """Тест: ответ модератора не отдается владельцу и наоборот"""
+        Course.objects.create(name="Other course", owner=self.moderator_user)
+        self.client.force_authenticate(user=self.moderator_user)
+        self.assertEqual(self.client.get("/api/materials/courses/").data["count"], 2)
+        self.client.force_authenticate(user=self.owner_user)
+        response = self.client.get("/api/materials/courses/")
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["count"], 1)
+
+    def test_subscription_invalidates_course_detail(self):
+        """Тест: подписка меняет is_subscribed в закешированных деталях курса"""
+        self.client.force_authenticate(user=self.owner_user)
+        self.assertFalse(self.client.get(self.course_detail_url).data["is_subscribed"])
+        self.client.post("/api/users/subscriptions/", {"course_id": self.course.id})
+        self.assertTrue(self.client.get(self.course_detail_url).data["is_subscribed"])
+
+    def test_stats(self):
+        """Тест: счетчики попаданий и промахов доступны администратору"""
+        self.client.force_authenticate(user=self.owner_user)
+        self.client.get("/api/materials/lessons/")
+        self.client.get("/api/materials/lessons/")
+        self.assertEqual(
+            self.client.get("/api/materials/cache/stats/").status_code,
+            status.HTTP_403_FORBIDDEN,
+        )
+
+        admin = User.objects.create_superuser(email="admin@example.com", password="x")
+        self.client.force_authenticate(user=admin)
+        response = self.client.get("/api/materials/cache/stats/")
+        self.assertEqual(response.data["hits"], 1)
+        self.assertEqual(response.data["misses"], 1)
+
+
+@override_settings(PRINCIPAL_ROLES_CACHE_TIMEOUT=300)
+class ConditionalGetTestCase(MaterialsAPITestCase):
+    """
+    Тестирование ETag / Last-Modified для курсов и уроков
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.course = Course.objects.create(name="Course", owner=cls.owner_user)
+        cls.lesson = Lesson.objects.create(
+            name="Lesson", course=cls.course, owner=cls.owner_user
+        )
+        cls.course_detail_url = f"/api/materials/courses/{cls.course.id}/"
+        cls.lesson_detail_url = f"/api/materials/lessons/{cls.lesson.id}/"
+
+    def test_if_none_match_returns_304(self):
+        """Тест: совпавший ETag дает 304 без тела ответа"""
+        for url in [
+            "/api/materials/courses/",
+            self.course_detail_url,
+            "/api/materials/lessons/?page_size=5",
+            self.lesson_detail_url,
+        ]:
+            etag = self.client.get(url)["ETag"]
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response["ETag"], etag)
+            self.assertEqual(response.content, b"")
+
+    def test_nested_lesson_change_changes_course_etag(self):
+        """Тест: изменение или удаление урока меняет ETag курса и списка"""
+        detail_etag = self.client.get(self.course_detail_url)["ETag"]
+        list_etag = self.client.get("/api/materials/courses/")["ETag"]
+
+        self.client.delete(self.lesson_detail_url)
+
+        response = self.client.get(
+            self.course_detail_url, HTTP_IF_NONE_MATCH=detail_etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], detail_etag)
+        response = self.client.get(
+            "/api/materials/courses/", HTTP_IF_NONE_MATCH=list_etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_query_params_change_etag(self):
+        """Тест: разные параметры запроса дают разные ETag"""
+        first = self.client.get("/api/materials/lessons/?page_size=5")["ETag"]
+        second = self.client.get("/api/materials/lessons/?page_size=10")["ETag"]
+        self.assertNotEqual(first, second)
+
+    def test_if_modified_since_on_lesson(self):
+        """Тест: If-Modified-Since для деталей урока"""
+        last_modified = self.client.get(self.lesson_detail_url)["Last-Modified"]
+        response = self.client.get(
+            self.lesson_detail_url, HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(RESPONSE_CACHE_TIMEOUT=0)
+    def test_not_modified_skips_serialization(self):
+        """Тест: 304 стоит одного агрегирующего запроса"""
+        etag = self.client.get(self.course_detail_url)["ETag"]
+        with self.assertNumQueries(1):
+            response = self.client.get(self.course_detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_not_modified_from_response_cache(self):
+        """Тест: при попадании в кеш ответов 304 отдается без запросов к БД"""
+        etag = self.client.get(self.course_detail_url)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(self.course_detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["X-Cache"], "HIT")
+
+
+class SparseFieldsTestCase(MaterialsAPITestCase):
+    """
+    Тестирование ?fields= и ?expand= для курсов и уроков
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.course = Course.objects.create(
+            name="Course", description="Long description", owner=cls.owner_user
+        )
+        Lesson.objects.create(name="Lesson", course=cls.course, owner=cls.owner_user)
+
+    def test_list_collapses_lessons_by_default(self):
+        """Тест: список курсов без ?expand= не содержит уроков"""
+        course = self.client.get("/api/materials/courses/").data["results"][0]
+        self.assertNotIn("lessons", course)
+        self.assertEqual(course["lessons_count"], 1)
+
+        course = self.client.get("/api/materials/courses/?expand=lessons").data[
+            "results"
+        ][0]
+        self.assertEqual(course["lessons"][0]["name"], "Lesson")
+
+    def test_retrieve_expands_lessons_by_default(self):
+        """Тест: детали курса по-прежнему содержат уроки"""
+        response = self.client.get(f"/api/materials/courses/{self.course.id}/")
+        self.assertEqual(len(response.data["lessons"]), 1)
+
+    def test_fields_narrow_response_and_query(self):
+        """Тест: ?fields= сужает ответ и список колонок в запросе"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/materials/courses/?fields=id,name")
+        self.assertEqual(set(response.data["results"][0]), {"id", "name"})
+        select = queries.captured_queries[-1]["sql"]
+        self.assertNotIn("description", select)
+        self.assertNotIn("materials_lesson", select)
+
+        response = self.client.get("/api/materials/lessons/?fields=name,course")
+        self.assertEqual(set(response.data["results"][0]), {"name", "course"})
+
+    def test_fields_with_lessons(self):
+        """Тест: вложенное поле в ?fields= раскрывается"""
+        response = self.client.get("/api/materials/courses/?fields=id,lessons")
+        course = response.data["results"][0]
+        self.assertEqual(set(course), {"id", "lessons"})
+        self.assertEqual(len(course["lessons"]), 1)
+
+
+class LessonBulkTestCase(MaterialsAPITestCase):
+    """
+    Тестирование массовых операций с уроками (/api/materials/lessons/bulk/)
+    """
+
+    url = "/api/materials/lessons/bulk/"
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.course = Course.objects.create(name="Course", owner=cls.owner_user)
+        cls.lesson = Lesson.objects.create(
+            name="Lesson", course=cls.course, owner=cls.owner_user
+        )
+        cls.other_lesson = Lesson.objects.create(
+            name="Other", course=cls.course, owner=cls.other_user
+        )
+
+    def test_bulk_create(self):
+        """Тест: пакет уроков создается одним INSERT, владелец - автор запроса"""
+        items = [
+            {"name": f"Bulk {i}", "course": self.course.id, "price": "10.00"}
+            for i in range(20)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, items, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 20)
+        self.assertTrue(all(item["id"] for item in response.data))
+        self.assertEqual(
+            Lesson.objects.filter(
+                name__startswith="Bulk", owner=self.owner_user
+            ).count(),
+            20,
+        )
+        inserts = [q for q in queries.captured_queries if q["sql"].startswith("INSERT")]
+        self.assertEqual(len(inserts), 1)
+        # Курсы всех элементов загружаются одним запросом
+        course_selects = [
+            q
+            for q in queries.captured_queries
+            if q["sql"].startswith("SELECT") and '"materials_course"' in q["sql"]
+        ]
+        self.assertLessEqual(len(course_selects), 2)
+
+    def test_bulk_create_reports_errors_per_item(self):
+        """Тест: ошибки возвращаются по элементам, ничего не создается"""
+        items = [
+            {"name": "Ok", "course": self.course.id},
+            {"name": "Bad link", "course": self.course.id, "description": "evil.com"},
+            {"name": "No course", "course": 999999},
+        ]
+        response = self.client.post(self.url, items, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.data["errors"]
+        self.assertEqual([error["index"] for error in errors], [1, 2])
+        self.assertIn("description", errors[0]["errors"])
+        self.assertIn("course", errors[1]["errors"])
+        self.assertFalse(Lesson.objects.filter(name="Ok").exists())
+
+    def test_bulk_create_forbidden_for_moderator(self):
+        """Тест: модератор не может создавать уроки и массово"""
+        self.client.force_authenticate(user=self.moderator_user)
+        response = self.client.post(
+            self.url, [{"name": "M", "course": self.course.id}], format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_bulk_create_limits(self):
+        """Тест: пустой список и превышение лимита отклоняются"""
+        response = self.client.post(self.url, [], format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.url, {"name": "x"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_update(self):
+        """Тест: частичное обновление пакета, updated_at выставляется"""
+        old_updated_at = self.lesson.updated_at
+        response = self.client.patch(
+            self.url, [{"id": self.lesson.id, "name": "Renamed"}], format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.lesson.refresh_from_db()
+        self.assertEqual(self.lesson.name, "Renamed")
+        self.assertGreater(self.lesson.updated_at, old_updated_at)
+
+    def test_bulk_update_applies_ownership(self):
+        """Тест: чужой урок не найден для владельца, модератор может обновить"""
+        items = [
+            {"id": self.lesson.id, "name": "Mine"},
+            {"id": self.other_lesson.id, "name": "Not mine"},
+            {"name": "Without id"},
+        ]
+        response = self.client.patch(self.url, items, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            [(error["index"], error["id"]) for error in response.data["errors"]],
+            [(1, self.other_lesson.id), (2, None)],
+        )
+        self.lesson.refresh_from_db()
+        self.assertEqual(self.lesson.name, "Lesson")
+
+        self.client.force_authenticate(user=self.moderator_user)
+        response = self.client.patch(self.url, items[:2], format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.other_lesson.refresh_from_db()
+        self.assertEqual(self.other_lesson.name, "Not mine")
+
+    def test_bulk_destroy(self):
+        """Тест: удалять может только владелец"""
+        response = self.client.delete(
+            self.url, [self.lesson.id, self.other_lesson.id], format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Lesson.objects.count(), 2)
+
+        self.client.force_authenticate(user=self.moderator_user)
+        response = self.client.delete(self.url, [self.lesson.id], format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.force_authenticate(user=self.owner_user)
+        response = self.client.delete(self.url, [self.lesson.id], format="json")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Lesson.objects.filter(pk=self.lesson.pk).exists())
+
+    def test_bulk_write_invalidates_response_cache(self):
+        """Тест: bulk_update без сигналов все равно сбрасывает кеш ответов"""
+        self.client.get("/api/materials/lessons/")
+        self.client.patch(
+            self.url, [{"id": self.lesson.id, "name": "Fresh"}], format="json"
+        )
+        response = self.client.get("/api/materials/lessons/")
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["results"][0]["name"], "Fresh")
+
+
+class FlakyEmailBackend(EmailBackend):
+    """Почтовый backend для тестов: адреса из failing отклоняются"""
+
+    failing = set()
+    opened = 0
+
+    def open(self):
+        FlakyEmailBackend.opened += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        for message in messages:
+            if set(message.to) & self.failing:
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (550, b"")})
+        return super().send_messages(messages)
+
+
+@override_settings(
+    EMAIL_BACKEND="materials.tests.FlakyEmailBackend",
+    NOTIFICATION_CHUNK_SIZE=2,
+    NOTIFICATION_MAX_RETRIES=1,
+)
+class CourseUpdateNotificationTestCase(APITestCase):
+    """
+    Тестирование рассылки уведомлений об обновлении курса пачками
+    """
+
+    def setUp(self):
+        always_eager = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, "task_always_eager", always_eager)
+        FlakyEmailBackend.failing = set()
+        FlakyEmailBackend.opened = 0
+
+        owner = User.objects.create_user(email="owner@example.com", password="x")
+        self.course = Course.objects.create(name="Course", owner=owner)
+        for i in range(5):
+            user = User.objects.create_user(
+                email=f"user{i}@example.com", password="x", first_name=f"Name{i}"
+            )
+            Subscription.objects.create(user=user, course=self.course)
+
+    def test_personal_message_per_subscriber(self):
+        """Тест: каждому подписчику отдельное письмо, одно соединение на пачку"""
+        result = send_course_update_notification(self.course.id)
+        self.assertIn("3 подзадач", result)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertTrue(all(len(message.to) == 1 for message in mail.outbox))
+        message = next(m for m in mail.outbox if m.to == ["user0@example.com"])
+        self.assertIn("Name0", message.body)
+        self.assertEqual(FlakyEmailBackend.opened, 3)
+
+    def test_failed_recipients_are_retried_alone(self):
+        """Тест: ошибка адреса не прерывает пачку, повтор только для него"""
+        FlakyEmailBackend.failing = {"user1@example.com"}
+        send_course_update_notification(self.course.id)
+        recipients = [message.to[0] for message in mail.outbox]
+        self.assertEqual(len(recipients), 4)
+        self.assertEqual(len(set(recipients)), 4)
+        self.assertNotIn("user1@example.com", recipients)
+        # Пачка с ошибкой открыла соединение еще раз при повторе
+        self.assertEqual(FlakyEmailBackend.opened, 4)
+
+    def test_no_subscribers(self):
+        """Тест: без подписчиков подзадачи не создаются"""
+        Subscription.objects.all().delete()
+        result = send_course_update_notification(self.course.id)
+        self.assertEqual(result, "Нет подписчиков для уведомления")
+        self.assertEqual(FlakyEmailBackend.opened, 0)
+
+
+@override_settings(COURSE_NOTIFICATION_DELAY=600, COURSE_NOTIFICATION_INTERVAL=3600)
+class CourseNotificationSchedulingTestCase(MaterialsAPITestCase):
+    """
+    Тестирование отложенного планирования уведомлений с объединением правок
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.course = Course.objects.create(name="Course", owner=cls.owner_user)
+        cls.other_course = Course.objects.create(name="Other", owner=cls.owner_user)
+        cls.lessons = [
+            Lesson.objects.create(
+                name=f"Lesson {i}", course=cls.course, owner=cls.owner_user
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        patcher = mock.patch(
+            "materials.notifications.send_course_update_notification.apply_async"
+        )
+        self.apply_async = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def patch(self, url, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_burst_of_edits_schedules_one_notification(self):
+        """Тест: серия правок уроков и курса - одна отложенная задача"""
+        for lesson in self.lessons:
+            self.patch(f"/api/materials/lessons/{lesson.id}/", {"name": "New"})
+        self.patch(f"/api/materials/courses/{self.course.id}/", {"name": "New"})
+        self.patch(
+            "/api/materials/lessons/bulk/",
+            [{"id": lesson.id, "price": "5.00"} for lesson in self.lessons],
+        )
+        self.apply_async.assert_called_once_with(args=(self.course.id,), countdown=600)
+
+    def test_courses_are_scheduled_independently(self):
+        """Тест: у каждого курса свой ключ"""
+        self.patch(f"/api/materials/courses/{self.course.id}/", {"name": "A"})
+        self.patch(f"/api/materials/courses/{self.other_course.id}/", {"name": "B"})
+        self.assertEqual(self.apply_async.call_count, 2)
+
+    def test_lesson_update_does_not_reload_instance(self):
+        """Тест: обновление урока не загружает урок второй раз"""
+        url = f"/api/materials/lessons/{self.lessons[0].id}/"
+        with CaptureQueriesContext(connection) as queries:
+            self.patch(url, {"name": "Once"})
+        lesson_selects = [
+            q
+            for q in queries.captured_queries
+            if q["sql"].startswith("SELECT")
+            and 'FROM "materials_lesson"' in q["sql"]
+            and "MAX(" not in q["sql"]
+        ]
+        # Только get_object: pre_save сравнивает с состоянием из post_init
+        self.assertEqual(len(lesson_selects), 1)
+
+
+class CourseAggregatesTestCase(MaterialsAPITestCase):
+    """
+    Тестирование денормализованных агрегатов курса
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.student = User.objects.create_user(
+            email="student@example.com", password="testpass123"
+        )
+        cls.course = Course.objects.create(name="Course", owner=cls.owner_user)
+        cls.other_course = Course.objects.create(name="Other", owner=cls.owner_user)
+
+    def assertAggregates(self, course, **expected):
+        course.refresh_from_db()
+        actual = {field: getattr(course, field) for field in expected}
+        self.assertEqual(actual, expected)
+
+    def test_lesson_changes(self):
+        """Тест: создание, смена цены, перенос и удаление урока"""
+        before = self.course.content_updated_at
+        lesson = Lesson.objects.create(
+            name="Lesson", course=self.course, owner=self.owner_user, price=100
+        )
+        Lesson.objects.create(
+            name="Second", course=self.course, owner=self.owner_user, price=50
+        )
+        self.assertAggregates(self.course, lessons_count=2, lessons_total_price=150)
+        self.assertGreater(self.course.content_updated_at, before)
+
+        lesson.price = 70
+        lesson.save()
+        self.assertAggregates(self.course, lessons_count=2, lessons_total_price=120)
+
+        lesson.course = self.other_course
+        lesson.save()
+        self.assertAggregates(self.course, lessons_count=1, lessons_total_price=50)
+        self.assertAggregates(
+            self.other_course, lessons_count=1, lessons_total_price=70
+        )
+
+        lesson.delete()
+        self.assertAggregates(self.other_course, lessons_count=0, lessons_total_price=0)
+
+    def test_subscriptions_and_purchases(self):
+        """Тест: подписчики и успешные платежи за курс"""
+        subscription = Subscription.objects.create(
+            user=self.student, course=self.course
+        )
+        payment = Payment.objects.create(
+            user=self.student,
+            paid_course=self.course,
+            amount=100,
+            payment_method="stripe",
+            status="pending",
+        )
+        self.assertAggregates(self.course, subscribers_count=1, purchases_count=0)
+
+        payment.status = "succeeded"
+        payment.save()
+        self.assertAggregates(self.course, purchases_count=1)
+        payment.save()
+        self.assertAggregates(self.course, purchases_count=1)
+
+        payment.delete()
+        subscription.delete()
+        self.assertAggregates(self.course, subscribers_count=0, purchases_count=0)
+
+    def test_course_save_keeps_concurrent_aggregates(self):
+        """Тест: правка курса не затирает агрегаты, измененные после чтения"""
+        stale = Course.objects.get(pk=self.course.pk)
+        Lesson.objects.create(
+            name="Lesson", course=self.course, owner=self.owner_user, price=100
+        )
+        Subscription.objects.create(user=self.student, course=self.course)
+
+        stale.name = "Renamed"
+        stale.save()
+        self.client.force_authenticate(user=self.owner_user)
+        response = self.client.patch(
+            f"/api/materials/courses/{self.course.pk}/", {"description": "Новое"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertAggregates(
+            self.course,
+            name="Renamed",
+            description="Новое",
+            lessons_count=1,
+            lessons_total_price=100,
+            subscribers_count=1,
+        )
+
+        # Явно названные в update_fields агрегаты записываются
+        stale.lessons_count = 5
+        stale.save(update_fields=["lessons_count"])
+        self.assertAggregates(self.course, lessons_count=5)
+
+    def test_saves_compare_with_loaded_state(self):
+        """Тест: прежние курс, цена и статус берутся без повторного SELECT"""
+        lesson = Lesson.objects.create(
+            name="Lesson", course=self.course, owner=self.owner_user, price=50
+        )
+        payment = Payment.objects.create(
+            user=self.student,
+            paid_course=self.course,
+            amount=100,
+            payment_method="stripe",
+            status="pending",
+        )
+        lesson = Lesson.objects.get(pk=lesson.pk)
+        payment = Payment.objects.get(pk=payment.pk)
+        with CaptureQueriesContext(connection) as queries:
+            lesson.price = 80
+            lesson.save()
+            lesson.course = self.other_course
+            lesson.save()
+            payment.status = "succeeded"
+            payment.save()
+            payment.checkout_url = "https://checkout.stripe.com/c/pay/cs_1"
+            payment.save(update_fields=["checkout_url"])
+        selects = [
+            query["sql"]
+            for query in queries.captured_queries
+            if query["sql"].startswith("SELECT")
+        ]
+        self.assertFalse(
+            [sql for sql in selects if 'FROM "materials_lesson"' in sql],
+        )
+        self.assertFalse([sql for sql in selects if 'FROM "users_payment"' in sql])
+        self.assertAggregates(self.course, lessons_count=0, purchases_count=1)
+        self.assertAggregates(
+            self.other_course, lessons_count=1, lessons_total_price=80
+        )
+
+        # После refresh_from_db прежнее состояние снова читается из БД
+        Lesson.objects.filter(pk=lesson.pk).update(price=10)
+        Course.objects.filter(pk=self.other_course.pk).update(lessons_total_price=10)
+        lesson.refresh_from_db()
+        lesson.price = 30
+        lesson.save()
+        self.assertAggregates(self.other_course, lessons_total_price=30)
+
+    def test_course_delete_skips_cascaded_aggregates(self):
+        """Тест: уроки и подписки удаляемого курса не меняют его агрегаты"""
+        for number in range(3):
+            Lesson.objects.create(
+                name=f"L{number}", course=self.course, owner=self.owner_user
+            )
+        Subscription.objects.create(user=self.student, course=self.course)
+        with CaptureQueriesContext(connection) as queries:
+            self.course.delete()
+        self.assertFalse(
+            any(
+                query["sql"].startswith('UPDATE "materials_course"')
+                for query in queries.captured_queries
+            )
+        )
+        self.assertFalse(Lesson.objects.filter(course_id=self.course.pk).exists())
+
+    def test_rebuild(self):
+        """Тест: команда пересчитывает агрегаты после массовой вставки"""
+        Lesson.objects.bulk_create(
+            Lesson(name=f"L{i}", course=self.course, owner=self.owner_user, price=10)
+            for i in range(3)
+        )
+        Subscription.objects.bulk_create(
+            [Subscription(user=self.student, course=self.course)]
+        )
+        self.assertAggregates(self.course, lessons_count=0)
+
+        call_command("rebuild_course_aggregates", batch_size=1, stdout=StringIO())
+        self.assertAggregates(
+            self.course,
+            lessons_count=3,
+            lessons_total_price=30,
+            subscribers_count=1,
+            purchases_count=0,
+        )
+        self.assertAggregates(self.other_course, lessons_count=0)
+
+    def test_ordering_by_popularity(self):
+        """Тест: сортировка каталога по числу подписчиков"""
+        Subscription.objects.create(user=self.student, course=self.other_course)
+        self.client.force_authenticate(user=self.owner_user)
+        response = self.client.get(
+            "/api/materials/courses/?ordering=-subscribers_count"
+        )
+        self.assertEqual(
+            [course["id"] for course in response.data["results"]],
+            [self.other_course.id, self.course.id],
+        )
+        self.assertEqual(response.data["results"][0]["subscribers_count"], 1)
+
+
+class AsyncReadViewsTestCase(MaterialsAPITestCase):
+    """
+    Тестирование асинхронных эндпоинтов чтения курсов и уроков
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.course = Course.objects.create(name="Course", owner=cls.owner_user)
+        cls.lesson = Lesson.objects.create(
+            name="Lesson", course=cls.course, owner=cls.owner_user
+        )
+        cls.foreign_course = Course.objects.create(name="Foreign", owner=cls.other_user)
+
+    def test_same_payload_as_sync_endpoints(self):
+        """Тест: ответы совпадают с синхронными эндпоинтами"""
+        for path in [
+            "courses/",
+            f"courses/{self.course.id}/",
+            "courses/?fields=id,name&ordering=-name",
+            "lessons/",
+            f"lessons/{self.lesson.id}/",
+            "lessons/?pagination=cursor",
+        ]:
+            sync = self.client.get(f"/api/materials/{path}")
+            response = self.client.get(f"/api/materials/async/{path}")
+            self.assertEqual(response.status_code, status.HTTP_200_OK, path)
+            self.assertEqual(response.json(), sync.json(), path)
+
+    def test_scoping_and_authentication(self):
+        """Тест: чужой курс не найден, аноним получает 401"""
+        response = self.client.get(
+            f"/api/materials/async/courses/{self.foreign_course.id}/"
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.client.force_authenticate(user=None)
+        response = self.client.get("/api/materials/async/courses/")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn("WWW-Authenticate", response)
+
+    def test_permissions_checked_for_list_and_detail(self):
+        """Тест: права ViewSet проверяются и в списке, и в деталях"""
+        with mock.patch.object(
+            IsOwnerOrModeratorForList, "has_permission", return_value=False
+        ):
+            response = self.client.get("/api/materials/async/courses/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        with mock.patch.object(
+            IsOwnerOrModerator, "has_permission", return_value=False
+        ):
+            response = self.client.get(
+                f"/api/materials/async/courses/{self.course.id}/"
+            )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_page_number_and_cursor_pages(self):
+        """Тест: страницы асинхронного списка совпадают с синхронными"""
+        Course.objects.bulk_create(
+            Course(name=f"Course {number}", owner=self.owner_user)
+            for number in range(5)
+        )
+        for path in [
+            "courses/?page_size=2&page=2",
+            "courses/?page_size=2&page=last",
+            "courses/?page_size=2&pagination=cursor",
+        ]:
+            sync = self.client.get(f"/api/materials/{path}").json()
+            response = self.client.get(f"/api/materials/async/{path}")
+            self.assertEqual(response.status_code, status.HTTP_200_OK, path)
+            # Ссылки на страницы ведут на свой эндпоинт
+            self.assertEqual(
+                json.loads(response.content.decode().replace("/async/", "/")),
+                sync,
+                path,
+            )
+            if sync.get("next"):
+                cursor = sync["next"].split("/api/materials/", 1)[1]
+                sync = self.client.get(f"/api/materials/{cursor}").json()
+                response = self.client.get(f"/api/materials/async/{cursor}")
+                self.assertEqual(response.json()["results"], sync["results"], path)
+
+        response = self.client.get("/api/materials/async/courses/?page=99")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+def make_image(size=(1600, 900), image_format="PNG", color="red", name="image.png"):
+    """Загружаемое изображение для тестов"""
+    buffer = BytesIO()
+    Image.new("RGBA" if image_format == "PNG" else "RGB", size, color).save(
+        buffer, format=image_format
+    )
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class MaterialsExportTestCase(MaterialsAPITestCase):
+    """
+    Тестирование потоковой выгрузки курсов и уроков
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.course = Course.objects.create(
+            name="Курс, часть 1", owner=cls.owner_user, price=100
+        )
+        cls.other_course = Course.objects.create(
+            name="Чужой курс", owner=cls.other_user
+        )
+        for i in range(3):
+            Lesson.objects.create(
+                name=f"Lesson {i}", course=cls.course, owner=cls.owner_user
+            )
+        Lesson.objects.create(
+            name="Other", course=cls.other_course, owner=cls.other_user
+        )
+
+    def read(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_course_csv_export_is_scoped(self):
+        """Тест: CSV курсов - только свои курсы с агрегатами, без уроков"""
+        response = self.client.get("/api/materials/courses/export/csv/")
+        self.assertIn('filename="courses.csv"', response["Content-Disposition"])
+        lines = self.read(response).splitlines()
+        self.assertEqual(lines[0].split(",")[:3], ["id", "name", "description"])
+        self.assertIn("lessons_count", lines[0])
+        self.assertNotIn("lessons,", lines[0])
+        self.assertEqual(len(lines), 2)
+        self.assertIn('"Курс, часть 1"', lines[1])
+        self.assertIn(",100.00,", lines[1])
+
+    def test_lesson_ndjson_export_filtered(self):
+        """Тест: NDJSON уроков с фильтрами и сортировкой API"""
+        response = self.client.get(
+            "/api/materials/lessons/export/ndjson/"
+            f"?course={self.course.id}&ordering=-name"
+        )
+        rows = [json.loads(line) for line in self.read(response).splitlines()]
+        self.assertEqual(
+            [row["name"] for row in rows], ["Lesson 2", "Lesson 1", "Lesson 0"]
+        )
+        self.assertEqual(rows[0]["course_name"], "Курс, часть 1")
+
+        self.client.force_authenticate(user=self.moderator_user)
+        response = self.client.get("/api/materials/lessons/export/ndjson/")
+        self.assertEqual(len(self.read(response).splitlines()), 4)
+
+    def test_anonymous(self):
+        """Тест: аноним не может выгрузить курсы"""
+        self.client.force_authenticate(user=None)
+        response = self.client.get("/api/materials/courses/export/csv/")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_management_command(self):
+        """Тест: команда выгружает курсы и уроки с областью видимости"""
+        stdout, stderr = StringIO(), StringIO()
+        call_command(
+            "export_materials",
+            "lessons",
+            "--format=ndjson",
+            "--user=other@example.com",
+            stdout=stdout,
+            stderr=stderr,
+        )
+        rows = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual([row["name"] for row in rows], ["Other"])
+
+        stdout = StringIO()
+        call_command(
+            "export_materials",
+            "courses",
+            "--filter=ordering=name",
+            stdout=stdout,
+            stderr=stderr,
+        )
+        self.assertEqual(len(stdout.getvalue().splitlines()), 3)
+
+
+class ImageVariantsTestCase(MaterialsAPITestCase):
+    """
+    Тестирование фоновой обработки превью курсов и уроков
+    """
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.course = Course.objects.create(
+            name="Course", owner=self.owner_user, preview=make_image()
+        )
+
+    def open_variant(self, variant, image_format):
+        self.course.refresh_from_db()
+        name = self.course.preview_variants["files"][variant][image_format]
+        return Image.open(self.course.preview.storage.open(name))
+
+    def test_variants_are_resized_and_reencoded(self):
+        """Тест: варианты нужных размеров в WebP и JPEG"""
+        self.assertTrue(
+            generate_image_variants("materials.Course", self.course.pk, "preview")
+        )
+
+        thumb = self.open_variant("thumb", "webp")
+        self.assertEqual((thumb.format, thumb.size), ("WEBP", (160, 160)))
+        card = self.open_variant("card", "jpeg")
+        self.assertEqual((card.format, card.size), ("JPEG", (480, 270)))
+        large = self.open_variant("large", "webp")
+        self.assertEqual(large.size, (1280, 720))
+
+    def test_processing_is_idempotent(self):
+        """Тест: неизмененный исходник повторно не обрабатывается"""
+        generate_image_variants("materials.Course", self.course.pk, "preview")
+        self.course.refresh_from_db()
+        variants = self.course.preview_variants
+        self.assertFalse(
+            generate_image_variants("materials.Course", self.course.pk, "preview")
+        )
+
+        # Тот же файл под другим именем: варианты переиспользуются
+        self.course.preview = make_image(name="copy.png")
+        self.course.save()
+        generate_image_variants("materials.Course", self.course.pk, "preview")
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.preview_variants["files"], variants["files"])
+        self.assertEqual(self.course.preview_variants["name"], self.course.preview.name)
+
+    def test_new_source_replaces_variants(self):
+        """Тест: новый исходник дает новые файлы, старые удаляются"""
+        generate_image_variants("materials.Course", self.course.pk, "preview")
+        self.course.refresh_from_db()
+        old_name = self.course.preview_variants["files"]["thumb"]["webp"]
+
+        self.course.preview = make_image(color="blue", name="blue.png")
+        self.course.save()
+        generate_image_variants("materials.Course", self.course.pk, "preview")
+        self.course.refresh_from_db()
+        self.assertNotEqual(
+            self.course.preview_variants["files"]["thumb"]["webp"], old_name
+        )
+        self.assertFalse(self.course.preview.storage.exists(old_name))
+
+    def test_upload_schedules_task_once(self):
+        """Тест: задача ставится при загрузке, но не при сохранении вариантов"""
+        with mock.patch("materials.tasks.generate_image_variants_task.delay") as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                lesson = Lesson.objects.create(
+                    name="Lesson",
+                    course=self.course,
+                    owner=self.owner_user,
+                    preview=make_image(),
+                )
+            delay.assert_called_once_with("materials.Lesson", lesson.pk, "preview")
+
+            with self.captureOnCommitCallbacks(execute=True):
+                generate_image_variants("materials.Lesson", lesson.pk, "preview")
+                lesson.refresh_from_db()
+                lesson.name = "Renamed"
+                lesson.save()
+            self.assertEqual(delay.call_count, 1)
+
+    def test_lesson_variants_do_not_touch_course(self):
+        """Тест: сохранение вариантов превью урока не меняет курс"""
+        lesson = Lesson.objects.create(
+            name="Lesson",
+            course=self.course,
+            owner=self.owner_user,
+            price=100,
+            preview=make_image(),
+        )
+        self.course.refresh_from_db()
+        course_state = (
+            self.course.lessons_count,
+            self.course.lessons_total_price,
+            self.course.content_updated_at,
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(
+                generate_image_variants("materials.Lesson", lesson.pk, "preview")
+            )
+        self.assertFalse(
+            any(
+                query["sql"].startswith('UPDATE "materials_course"')
+                for query in queries.captured_queries
+            )
+        )
+        self.course.refresh_from_db()
+        self.assertEqual(
+            (
+                self.course.lessons_count,
+                self.course.lessons_total_price,
+                self.course.content_updated_at,
+            ),
+            course_state,
+        )
+        lesson.refresh_from_db()
+        self.assertIn("thumb", lesson.preview_variants["files"])
+
+    def test_serializer_exposes_variant_urls(self):
+        """Тест: в ответе API - абсолютные URL вариантов"""
+        self.client.force_authenticate(user=self.owner_user)
+        response = self.client.get("/api/materials/courses/")
+        self.assertEqual(response.data["results"][0]["preview_variants"], {})
+
+        generate_image_variants("materials.Course", self.course.pk, "preview")
+        response = self.client.get("/api/materials/courses/")
+        urls = response.data["results"][0]["preview_variants"]
+        self.assertEqual(set(urls), {"thumb", "card", "large"})
+        self.assertTrue(urls["thumb"]["webp"].startswith("http://testserver/media/"))
+        self.assertTrue(urls["thumb"]["webp"].endswith("-thumb.webp"))
+
+
+class ImportMaterialsTestCase(MaterialsAPITestCase):
+    """
+    Тестирование массового импорта курсов и уроков
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.course = Course.objects.create(name="Course", owner=cls.owner_user)
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(content)
+        return path
+
+    def import_materials(self, *args):
+        stdout, stderr = StringIO(), StringIO()
+        call_command("import_materials", *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_csv_courses_validated_like_api(self):
+        """Тест: курсы из CSV, ошибки записей не мешают остальным"""
+        path = self.write_file(
+            "courses.csv",
+            "name,description,price,owner\n"
+            "Python,Основы,1500,owner@example.com\n"
+            "Spam,Смотри https://evil.com,10,owner@example.com\n"
+            ",Без названия,10,\n"
+            "Ghost,,10,ghost@example.com\n"
+            "Django,,,\n",
+        )
+        errors_path = os.path.join(self.directory, "errors.ndjson")
+        stdout, _ = self.import_materials(
+            "courses", path, "--errors", errors_path, "--owner", "owner@example.com"
+        )
+        self.assertIn("Импортировано 2 из 5", stdout)
+
+        python = Course.objects.get(name="Python")
+        self.assertEqual((python.price, python.owner), (1500, self.owner_user))
+        self.assertEqual(Course.objects.get(name="Django").owner, self.owner_user)
+
+        with open(errors_path, encoding="utf-8") as file:
+            errors = {
+                error["record"]: error["errors"] for error in map(json.loads, file)
+            }
+        self.assertEqual(set(errors), {2, 3, 4})
+        self.assertIn("description", errors[2])
+        self.assertIn("name", errors[3])
+        self.assertEqual(errors[4], {"owner": ["Пользователь не найден."]})
+
+    def test_ndjson_lessons_update_course_aggregates(self):
+        """Тест: уроки из NDJSON, владелец - владелец курса, агрегаты курса"""
+        lines = [
+            {"name": "Урок 1", "course": self.course.id, "price": "100.00"},
+            {"name": "Урок 2", "course": self.course.id, "price": "50.00"},
+            {"name": "Урок 3", "course": 999999},
+        ]
+        path = self.write_file(
+            "lessons.ndjson",
+            "\n".join(json.dumps(line) for line in lines) + "\nне JSON\n",
+        )
+        _, stderr = self.import_materials("lessons", path, "--batch-size", "2")
+
+        self.assertEqual(
+            list(Lesson.objects.values_list("owner_id", flat=True).distinct()),
+            [self.owner_user.id],
+        )
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.lessons_count, 2)
+        self.assertEqual(self.course.lessons_total_price, 150)
+        errors = [json.loads(line) for line in stderr.splitlines()]
+        self.assertEqual([error["record"] for error in errors], [3, 4])
+
+    def test_resume_from_last_committed_batch(self):
+        """Тест: после сбоя импорт продолжается без дублей"""
+        path = self.write_file(
+            "lessons.csv",
+            "name,course\n"
+            + "".join(f"Урок {number},{self.course.id}\n" for number in range(5)),
+        )
+        write = LessonImporter.write
+        calls = []
+
+        def failing_write(importer, objects):
+            calls.append(len(objects))
+            if len(calls) == 2:
+                raise RuntimeError("сбой")
+            write(importer, objects)
+
+        with mock.patch.object(LessonImporter, "write", failing_write):
+            with self.assertRaises(RuntimeError):
+                self.import_materials("lessons", path, "--batch-size", "2")
+        self.assertEqual(Lesson.objects.count(), 2)
+        self.assertEqual(ImportCheckpoint.objects.get().position, 2)
+
+        stdout, _ = self.import_materials(
+            "lessons", path, "--batch-size", "2", "--resume"
+        )
+        self.assertIn("Продолжение с записи 3", stdout)
+        self.assertEqual(
+            sorted(Lesson.objects.values_list("name", flat=True)),
+            [f"Урок {number}" for number in range(5)],
+        )
+        self.assertEqual(ImportCheckpoint.objects.get().position, 5)
+
+    def test_copy_value_format(self):
+        """Тест: значения для COPY - NULL без кавычек, остальное в кавычках"""
+        fields = {field.name: field for field in Course._meta.concrete_fields}
+        self.assertEqual(format_copy_value(fields["description"], None), r"\N")
+        self.assertEqual(
+            format_copy_value(fields["name"], 'Курс "1", часть'),
+            '"Курс ""1"", часть"',
+        )
+        self.assertEqual(format_copy_value(fields["preview_variants"], {}), '"{}"')
+
+
+@override_settings(
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+    RESPONSE_CACHE_TIMEOUT=0,
+)
+class BenchmarkAPITestCase(APITestCase):
+    """
+    Тестирование прогона benchmark_api на маленьком наборе данных
+    """
+
+    def setUp(self):
+        call_command(
+            "fill_test_data",
+            users=40,
+            subscriptions=60,
+            payments=80,
+            stdout=StringIO(),
+        )
+
+    def test_run_collects_metrics(self):
+        """Тест: для каждого эндпоинта есть перцентили, SQL и размер ответа"""
+        command = BenchmarkAPICommand(stdout=StringIO())
+        options = {
+            "iterations": 3,
+            "warmup": 1,
+            "password": "password123",
+            "base_url": None,
+            "response_cache": False,
+            "seed": 42,
+        }
+        results = command.run(ClientTransport(), options)
+
+        self.assertEqual(results["meta"]["rows"]["Payment"], Payment.objects.count())
+        self.assertIn("subscription_toggle", results["endpoints"])
+        for name, result in results["endpoints"].items():
+            self.assertEqual(result["statuses"], [200], name)
+            self.assertLessEqual(result["p50_ms"], result["p95_ms"], name)
+            self.assertLessEqual(result["p95_ms"], result["p99_ms"], name)
+            self.assertGreater(result["queries"], 0, name)
+            self.assertGreater(result["response_bytes"], 0, name)
+
+        command.report(results, None)
+        self.assertIn("payment_list_filtered", command.stdout.getvalue())
+
+
+# Литералы и списки параметров, которые отличаются между одинаковыми запросами
+SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+SQL_IN_LISTS = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+SQL_SPACES = re.compile(r"\s+")
+
+
+def sql_fingerprint(sql):
+    """SQL без литералов: одинаковые запросы с разными параметрами совпадают"""
+    sql = SQL_LITERALS.sub("?", sql)
+    sql = SQL_IN_LISTS.sub("(...)", sql)
+    return SQL_SPACES.sub(" ", sql).strip()
+
+
+def format_fingerprints(queries):
+    """Отпечатки запросов с числом повторов, повторяющиеся - первыми"""
+    counts = Counter(sql_fingerprint(sql) for sql in queries)
+    return "\n".join(
+        f"  {count}x {fingerprint}" for fingerprint, count in counts.most_common()
+    )
+
+
+def format_budget_data(data, context):
+    """Подстановка context в строки данных запроса (словари и списки)"""
+    if isinstance(data, str):
+        return data.format(**context)
+    if isinstance(data, dict):
+        return {key: format_budget_data(value, context) for key, value in data.items()}
+    if isinstance(data, list):
+        return [format_budget_data(value, context) for value in data]
+    return data
+
+
+class QueryBudget:
+    """
+    Бюджет SQL-запросов действия API: не больше max_queries на запрос.
+    В path и строковых значениях data подставляются значения
+    get_budget_context() теста ({course}, {lesson}, ...), user - имя
+    атрибута теста с пользователем. Списки (paginated) проверяются на
+    нескольких размерах страницы
+    """
+
+    def __init__(
+        self,
+        name,
+        path,
+        max_queries,
+        method="get",
+        user="moderator",
+        data=None,
+        paginated=False,
+    ):
+        self.name = name
+        self.path = path
+        self.max_queries = max_queries
+        self.method = method
+        self.user = user
+        self.data = data
+        self.paginated = paginated
+
+
+class QueryBudgetMixin:
+    """
+    Проверка бюджетов SQL-запросов действий API для APITestCase.
+
+    Каждый бюджет из query_budgets проверяется запросом с JWT (как в
+    работе, с запросом пользователя при аутентификации). Для списков
+    бюджет проверяется на каждом размере из budget_page_sizes, и число
+    запросов не должно зависеть от размера страницы. При нарушении тест
+    падает со списком отпечатков SQL и числом их повторов.
+    """
+
+    query_budgets = []
+    budget_page_sizes = (1, 10, 50)
+
+    def get_budget_context(self):
+        """Значения для подстановки в путь и данные; вызывается перед запросом"""
+        return {}
+
+    def capture_budget_queries(self, budget, page_size=None):
+        context = self.get_budget_context()
+        path = budget.path.format(**context)
+        if page_size:
+            separator = "&" if "?" in path else "?"
+            path += separator + urlencode({"page_size": page_size})
+        data = format_budget_data(budget.data, context)
+
+        user = getattr(self, budget.user)
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}"
+        )
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, budget.method)(path, data, format="json")
+        self.client.credentials()
+        self.assertLess(
+            response.status_code,
+            400,
+            f"{budget.name}: ответ {response.status_code} "
+            f"{getattr(response, 'data', '')}",
+        )
+        return [query["sql"] for query in queries.captured_queries]
+
+    def assertQueryBudget(self, budget):
+        page_sizes = self.budget_page_sizes if budget.paginated else [None]
+        captured = {}
+        for page_size in page_sizes:
+            queries = self.capture_budget_queries(budget, page_size)
+            label = (
+                budget.name
+                if page_size is None
+                else f"{budget.name}?page_size={page_size}"
+            )
+            if len(queries) > budget.max_queries:
+                self.fail(
+                    f"{label}: {len(queries)} SQL-запросов при бюджете "
+                    f"{budget.max_queries}\n{format_fingerprints(queries)}"
+                )
+            captured[page_size] = queries
+
+        if len({len(queries) for queries in captured.values()}) > 1:
+            counts = ", ".join(
+                f"{page_size}: {len(queries)}"
+                for page_size, queries in captured.items()
+            )
+            self.fail(
+                f"{budget.name}: число SQL-запросов зависит от размера страницы "
+                f"({counts})\n{format_fingerprints(captured[page_sizes[-1]])}"
+            )
+
+    def test_query_budgets(self):
+        """Тест: действия API укладываются в бюджеты SQL-запросов"""
+        for budget in self.query_budgets:
+            with self.subTest(budget.name):
+                self.assertQueryBudget(budget)
+
+
+@override_settings(PRINCIPAL_ROLES_CACHE_TIMEOUT=0, RESPONSE_CACHE_TIMEOUT=0)
+class MaterialsQueryBudgetTestCase(QueryBudgetMixin, APITestCase):
+    """
+    Бюджеты SQL-запросов действий курсов и уроков на данных fill_test_data.
+    Кеши ролей и ответов выключены: измеряется полный путь запроса
+    """
+
+    # В каждом бюджете два запроса - пользователь JWT и его группы
+    query_budgets = [
+        QueryBudget("course-list", "/api/materials/courses/", 5, paginated=True),
+        QueryBudget(
+            "course-list-expand",
+            "/api/materials/courses/?expand=lessons",
+            6,
+            paginated=True,
+        ),
+        QueryBudget(
+            "course-list-owner",
+            "/api/materials/courses/",
+            5,
+            user="owner",
+            paginated=True,
+        ),
+        QueryBudget("course-retrieve", "/api/materials/courses/{course}/", 6),
+        QueryBudget(
+            "course-retrieve-owner", "/api/materials/courses/{course}/", 6, user="owner"
+        ),
+        QueryBudget(
+            "course-create",
+            "/api/materials/courses/",
+            4,
+            method="post",
+            user="owner",
+            data={"name": "Новый курс"},
+        ),
+        QueryBudget(
+            "course-update",
+            "/api/materials/courses/{course}/",
+            6,
+            method="patch",
+            user="owner",
+            data={"description": "Обновлено"},
+        ),
+        QueryBudget(
+            "course-destroy",
+            "/api/materials/courses/{empty_course}/",
+            9,
+            method="delete",
+            user="owner",
+        ),
+        QueryBudget(
+            "course-async-list", "/api/materials/async/courses/", 4, paginated=True
+        ),
+        QueryBudget("lesson-list", "/api/materials/lessons/", 5, paginated=True),
+        QueryBudget(
+            "lesson-list-owner",
+            "/api/materials/lessons/",
+            5,
+            user="owner",
+            paginated=True,
+        ),
+        QueryBudget("lesson-retrieve", "/api/materials/lessons/{lesson}/", 4),
+        QueryBudget(
+            "lesson-create",
+            "/api/materials/lessons/",
+            6,
+            method="post",
+            user="owner",
+            data={"name": "Новый урок", "course": "{course}"},
+        ),
+        QueryBudget(
+            "lesson-update",
+            "/api/materials/lessons/{lesson}/",
+            7,
+            method="patch",
+            user="owner",
+            data={"description": "Обновлено"},
+        ),
+        QueryBudget(
+            "lesson-destroy",
+            "/api/materials/lessons/{new_lesson}/",
+            8,
+            method="delete",
+            user="owner",
+        ),
+        QueryBudget(
+            "lesson-bulk-create",
+            "/api/materials/lessons/bulk/",
+            8,
+            method="post",
+            user="owner",
+            data=[
+                {"name": f"Урок {number}", "course": "{course}"} for number in range(20)
+            ],
+        ),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            "fill_test_data",
+            users=400,
+            courses_per_owner=4,
+            subscriptions=300,
+            payments=0,
+            stdout=StringIO(),
+        )
+        cls.moderator = User.objects.get(email="moderator@example.com")
+        # Автор с наибольшим числом курсов: его списки занимают несколько страниц
+        cls.owner = (
+            User.objects.filter(email__endswith="@lms.test")
+            .annotate(courses_total=Count("courses"))
+            .order_by("-courses_total", "pk")
+            .first()
+        )
+
+    def get_budget_context(self):
+        course = Course.objects.filter(owner=self.owner).order_by("pk").first()
+        return {
+            "course": course.pk,
+            "lesson": Lesson.objects.filter(course=course).order_by("pk")[0].pk,
+            "empty_course": Course.objects.create(name="Пустой", owner=self.owner).pk,
+            "new_lesson": Lesson.objects.create(
+                name="Удаляемый", course=course, owner=self.owner
+            ).pk,
+        }
+
+    def test_fingerprint_ignores_literals(self):
+        """Тест: запросы с разными параметрами дают один отпечаток"""
+        self.assertEqual(
+            sql_fingerprint(
+                "SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'a''b' LIMIT 10"
+            ),
+            "SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?",
+        )
+
+    def test_budget_violation_lists_fingerprints(self):
+        """Тест: превышение бюджета показывает повторяющиеся запросы"""
+        budget = QueryBudget(
+            "lesson-list", "/api/materials/lessons/", 1, paginated=True
+        )
+        with self.assertRaises(AssertionError) as error:
+            self.assertQueryBudget(budget)
+        self.assertIn("SQL-запросов при бюджете 1", str(error.exception))
+        self.assertIn('FROM "materials_lesson"', str(error.exception))
+
+
+@override_settings(
+    SERVER_TIMING_SAMPLE_RATE=1,
+    RESPONSE_CACHE_TIMEOUT=0,
+    PRINCIPAL_ROLES_CACHE_TIMEOUT=0,
+)
+class ServerTimingTestCase(MaterialsAPITestCase):
+    """
+    Тестирование замера фаз запроса (Server-Timing и лог lms.timing)
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.course = Course.objects.create(name="Курс", owner=cls.owner_user)
+        cls.lesson = Lesson.objects.create(
+            name="Урок", course=cls.course, owner=cls.owner_user
+        )
+
+    def get_metrics(self, response):
+        return {
+            item.split(";")[0]: item for item in response["Server-Timing"].split(", ")
+        }
+
+    def test_phases_in_header_and_log(self):
+        """Тест: фазы DRF, SQL и общее время - в заголовке и в логе"""
+        with self.assertLogs("lms.timing", "INFO") as logs:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get("/api/materials/courses/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        metrics = self.get_metrics(response)
+        for phase in ["auth", "permissions", "serialize", "render", "db", "total"]:
+            self.assertIn(phase, metrics)
+        self.assertIn(f'desc="{len(queries)} queries"', metrics["db"])
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["view"], "course-list")
+        self.assertEqual(record["status"], 200)
+        self.assertEqual(record["queries"], len(queries))
+        self.assertGreaterEqual(record["total_ms"], record["serialize_ms"])
+
+    def test_async_view_phases(self):
+        """Тест: асинхронные эндпоинты тоже замеряются"""
+        with self.assertLogs("lms.timing", "INFO"):
+            response = self.client.get(
+                f"/api/materials/async/courses/{self.course.id}/"
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        metrics = self.get_metrics(response)
+        for phase in ["permissions", "serialize", "render", "db", "total"]:
+            self.assertIn(phase, metrics)
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=0)
+    def test_disabled_by_sample_rate(self):
+        """Тест: без выборки нет ни заголовка, ни записи в логе"""
+        with self.assertNoLogs("lms.timing"):
+            response = self.client.get("/api/materials/courses/")
+        self.assertNotIn("Server-Timing", response)
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_log_without_header(self):
+        """Тест: заголовок можно отключить, лог остается"""
+        with self.assertLogs("lms.timing", "INFO"):
+            response = self.client.get(f"/api/materials/lessons/{self.lesson.id}/")
+        self.assertNotIn("Server-Timing", response)
+
+    def test_timed_serializer_keeps_output(self):
+        """Тест: замеряемый подкласс сериализатора отдает те же данные"""
+        timed_class = timed_serializer_class(CourseSerializer)
+        self.assertIs(timed_class, timed_serializer_class(CourseSerializer))
+        self.assertEqual(timed_class.__name__, "CourseSerializer")
+        self.assertEqual(
+            timed_class(self.course).data, CourseSerializer(self.course).data
+        )
@@ -0,0 +1,208 @@
+import hashlib
+import posixpath
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image, ImageOps
+
+# Поля изображений, для которых строятся варианты: (модель, поле) ->
+# (поле с описанием вариантов, имена вариантов из IMAGE_VARIANTS)
+IMAGE_FIELDS = {
+    ("materials.Course", "preview"): ("preview_variants", ("thumb", "card", "large")),
+    ("materials.Lesson", "preview"): ("preview_variants", ("thumb", "card", "large")),
+    ("users.User", "avatar"): ("avatar_variants", ("thumb",)),
+}
+
+SAVE_OPTIONS = {
+    "webp": {"format": "WEBP", "quality": 80, "method": 4},
+    "jpeg": {"format": "JPEG", "quality": 82, "optimize": True, "progressive": True},
+}
+
+
+def get_source_hash(field_file):
+    """sha1 содержимого исходного файла, читается блоками"""
+    digest = hashlib.sha1(usedforsecurity=False)
+    field_file.open("rb")
+    try:
+        for chunk in field_file.chunks():
+            digest.update(chunk)
+    finally:
+        field_file.close()
+    return digest.hexdigest()
+
+
+def render_variant(image, spec, image_format):
+    """Уменьшенная и перекодированная копия изображения"""
+    size = tuple(spec["size"])
+    if spec.get("crop"):
+        variant = ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+    else:
+        variant = image.copy()
+        variant.thumbnail(size, Image.Resampling.LANCZOS)
+
+    if image_format == "jpeg" and variant.mode == "RGBA":
+        # В JPEG нет прозрачности: кладем изображение на белый фон
+        background = Image.new("RGB", variant.size, "white")
+        background.paste(variant, mask=variant.getchannel("A"))
+        variant = background
+    buffer = BytesIO()
+    variant.save(buffer, **SAVE_OPTIONS[image_format])
+    return buffer.getvalue()
+
+
+def get_variant_name(source_name, source_hash, variant, image_format):
+    """
+    Имя файла варианта содержит хеш исходника: повторная обработка того же
+    файла дает те же имена, а новый исходник - новые URL без устаревания
+    в кешах клиентов
+    """
+    directory, filename = posixpath.split(source_name)
+    stem = posixpath.splitext(filename)[0]
+    extension = "jpg" if image_format == "jpeg" else image_format
+    return posixpath.join(
+        directory, "variants", f"{stem}-{source_hash[:12]}-{variant}.{extension}"
+    )
+
+
+def delete_variant_files(storage, variants):
+    for formats in variants.get("files", {}).values():
+        for name in formats.values():
+            storage.delete(name)
+
+
+def load_image(file, variant_names):
+    """Исходное изображение с учетом EXIF-ориентации, в режиме RGB или RGBA"""
+    with Image.open(file) as original:
+        # JPEG декодируем сразу в уменьшенном масштабе, но не меньше
+        # самого большого варианта
+        largest = max(
+            (settings.IMAGE_VARIANTS[name]["size"] for name in variant_names),
+            key=lambda size: size[0] * size[1],
+        )
+        original.draft("RGB", tuple(largest))
+        image = ImageOps.exif_transpose(original)
+    # Масштабирование палитровых и серых изображений - в RGB(A)
+    if image.mode not in ("RGB", "RGBA"):
+        has_alpha = "A" in image.getbands() or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+    return image
+
+
+def build_image_variants(field_file, variant_names, previous):
+    """
+    Описание вариантов изображения:
+    {"source": хеш исходника, "name": имя исходника,
+     "files": {вариант: {формат: имя файла}}}.
+    Если исходник не изменился (тот же хеш), файлы не пересоздаются
+    """
+    if not field_file:
+        delete_variant_files(field_file.storage, previous)
+        return {}
+
+    source_hash = get_source_hash(field_file)
+    if previous.get("source") == source_hash and previous.get("files"):
+        return {**previous, "name": field_file.name}
+
+    storage = field_file.storage
+    field_file.open("rb")
+    try:
+        image = load_image(field_file, variant_names)
+    except (OSError, Image.DecompressionBombError):
+        # Файл не является изображением или слишком велик: не повторяем
+        # обработку, пока исходник не заменят
+        delete_variant_files(storage, previous)
+        return {"source": source_hash, "name": field_file.name, "files": {}}
+    finally:
+        field_file.close()
+
+    files = {}
+    for name in variant_names:
+        spec = settings.IMAGE_VARIANTS[name]
+        files[name] = {}
+        for image_format in settings.IMAGE_VARIANT_FORMATS:
+            variant_name = get_variant_name(
+                field_file.name, source_hash, name, image_format
+            )
+            if not storage.exists(variant_name):
+                storage.save(
+                    variant_name,
+                    ContentFile(render_variant(image, spec, image_format)),
+                )
+            files[name][image_format] = variant_name
+
+    stale = {
+        name
+        for formats in previous.get("files", {}).values()
+        for name in formats.values()
+    } - {name for formats in files.values() for name in formats.values()}
+    for name in stale:
+        storage.delete(name)
+    return {"source": source_hash, "name": field_file.name, "files": files}
+
+
+def generate_image_variants(model_label, pk, field_name):
+    """
+    Строит варианты изображения объекта и сохраняет их описание.
+    Возвращает True, если описание изменилось
+    """
+    model = apps.get_model(model_label)
+    variants_field, variant_names = IMAGE_FIELDS[(model_label, field_name)]
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None:
+        return False
+
+    previous = getattr(instance, variants_field) or {}
+    variants = build_image_variants(
+        getattr(instance, field_name), variant_names, previous
+    )
+    if variants == previous:
+        return False
+
+    setattr(instance, variants_field, variants)
+    update_fields = [variants_field]
+    # updated_at входит в ETag и Last-Modified ответов
+    if any(field.name == "updated_at" for field in model._meta.concrete_fields):
+        update_fields.append("updated_at")
+    instance.save(update_fields=update_fields)
+    return True
+
+
+def schedule_image_variants(instance, update_fields=None):
+    """
+    Ставит обработку изображений объекта после фиксации транзакции,
+    если исходный файл отличается от уже обработанного
+    """
+    from materials.tasks import generate_image_variants_task
+
+    model_label = instance._meta.label
+    for (label, field_name), (variants_field, _) in IMAGE_FIELDS.items():
+        if label != model_label:
+            continue
+        # Сохранение самих вариантов не должно запускать обработку снова
+        if update_fields is not None and field_name not in update_fields:
+            continue
+        field_file = getattr(instance, field_name)
+        variants = getattr(instance, variants_field) or {}
+        if (field_file.name or "") == variants.get("name", ""):
+            continue
+        transaction.on_commit(
+            lambda field_name=field_name: generate_image_variants_task.delay(
+                model_label, instance.pk, field_name
+            )
+        )
+
+
+def get_variant_urls(variants, storage, request=None):
+    """URL вариантов для ответа API: {вариант: {формат: url}}"""
+    urls = {}
+    for name, formats in (variants or {}).get("files", {}).items():
+        urls[name] = {}
+        for image_format, file_name in formats.items():
+            url = storage.url(file_name)
+            urls[name][image_format] = (
+                request.build_absolute_uri(url) if request is not None else url
+            )
+    return urls
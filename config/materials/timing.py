@@ -0,0 +1,225 @@
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger("lms.timing")
+
+# Замеры текущего запроса; None - запрос не попал в выборку
+current_timings = ContextVar("current_timings", default=None)
+
+
+class RequestTimings:
+    """Длительности фаз обработки запроса, число SQL-запросов и время в БД"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.queries = 0
+        self.db_time = 0.0
+
+    def add(self, phase, duration):
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration
+
+    def record_query(self, execute, sql, params, many, context):
+        """execute_wrapper соединения: время и число SQL-запросов"""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+    def get_metrics(self):
+        """{фаза: мс}: фазы в порядке выполнения, затем db и total"""
+        metrics = {phase: duration * 1000 for phase, duration in self.phases.items()}
+        metrics["db"] = self.db_time * 1000
+        metrics["total"] = (time.perf_counter() - self.started) * 1000
+        return metrics
+
+    def get_header(self, metrics):
+        return ", ".join(
+            (
+                f'db;dur={duration:.2f};desc="{self.queries} queries"'
+                if phase == "db"
+                else f"{phase};dur={duration:.2f}"
+            )
+            for phase, duration in metrics.items()
+        )
+
+
+@contextmanager
+def timed_phase(phase):
+    """Время блока добавляется к фазе phase, если запрос замеряется"""
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - started)
+
+
+@lru_cache(maxsize=None)
+def timed_serializer_class(serializer_class):
+    """
+    Подкласс сериализатора, который относит to_representation к фазе
+    serialize. Для many=True замеряется каждый объект списка, вложенные
+    сериализаторы входят во время своего объекта
+    """
+
+    def to_representation(self, instance):
+        with timed_phase("serialize"):
+            return super(timed_class, self).to_representation(instance)
+
+    timed_class = type(
+        serializer_class.__name__,
+        (serializer_class,),
+        {
+            "__module__": serializer_class.__module__,
+            "__qualname__": serializer_class.__qualname__,
+            "to_representation": to_representation,
+        },
+    )
+    return timed_class
+
+
+class ServerTimingMiddleware:
+    """
+    Замер фаз обработки запроса для доли SERVER_TIMING_SAMPLE_RATE
+    запросов (0 - выключено): число и время SQL-запросов, фазы DRF
+    (ServerTimingMixin: auth, permissions, serialize, render) и общее
+    время. Результат - заголовок Server-Timing (если SERVER_TIMING_HEADER)
+    и строка JSON в логе lms.timing.
+
+    SQL-запросы потоковых ответов, выполненные при отдаче тела, не
+    учитываются: заголовок отправляется раньше.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.is_sampled():
+            return self.get_response(request)
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            with self.record_queries(timings):
+                response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        self.report(request, response, timings)
+        return response
+
+    async def __acall__(self, request):
+        if not self.is_sampled():
+            return await self.get_response(request)
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            # Соединения не привязаны к потоку внутри запроса
+            # (thread_critical=False), поэтому обертка действует и в
+            # sync_to_async
+            with self.record_queries(timings):
+                response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        self.report(request, response, timings)
+        return response
+
+    @staticmethod
+    def is_sampled():
+        rate = settings.SERVER_TIMING_SAMPLE_RATE
+        return rate >= 1 or (rate > 0 and random.random() < rate)
+
+    @staticmethod
+    def record_queries(timings):
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(
+                connections[alias].execute_wrapper(timings.record_query)
+            )
+        return stack
+
+    def report(self, request, response, timings):
+        metrics = timings.get_metrics()
+        if settings.SERVER_TIMING_HEADER:
+            response["Server-Timing"] = timings.get_header(metrics)
+
+        match = request.resolver_match
+        logger.info(
+            json.dumps(
+                {
+                    "method": request.method,
+                    "path": request.path,
+                    "view": match.view_name if match else None,
+                    "status": response.status_code,
+                    "queries": timings.queries,
+                    **{
+                        f"{phase}_ms": round(duration, 2)
+                        for phase, duration in metrics.items()
+                    },
+                }
+            )
+        )
+
+
+class ServerTimingMixin:
+    """
+    Фазы DRF для ServerTimingMiddleware: аутентификация, проверки прав,
+    сериализация (to_representation сериализаторов get_serializer) и
+    рендеринг ответа. Без замера текущего запроса методы работают как
+    обычно
+    """
+
+    def perform_authentication(self, request):
+        with timed_phase("auth"):
+            super().perform_authentication(request)
+
+    def check_permissions(self, request):
+        with timed_phase("permissions"):
+            super().check_permissions(request)
+
+    def check_object_permissions(self, request, obj):
+        with timed_phase("permissions"):
+            super().check_object_permissions(request, obj)
+
+    def get_serializer(self, *args, **kwargs):
+        # Как GenericAPIView.get_serializer, но с замеряемым подклассом:
+        # get_serializer_class переопределяют сами представления
+        if current_timings.get() is None:
+            return super().get_serializer(*args, **kwargs)
+        serializer_class = timed_serializer_class(self.get_serializer_class())
+        kwargs.setdefault("context", self.get_serializer_context())
+        return serializer_class(*args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        timings = current_timings.get()
+        # Django рендерит ответ после представления, до middleware
+        if timings is not None and not getattr(response, "is_rendered", True):
+            started = time.perf_counter()
+            response.add_post_render_callback(
+                lambda response: timings.add("render", time.perf_counter() - started)
+            )
+        return response
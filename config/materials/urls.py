@@ -1,6 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from materials.views import CourseViewSet, LessonViewSet
+from materials.views import (
+    CourseAsyncReadView,
+    CourseViewSet,
+    LessonAsyncReadView,
+    LessonViewSet,
+    ResponseCacheStatsView,
+)
 
 router = DefaultRouter()
 router.register(r"courses", CourseViewSet, basename="course")
@@ -8,4 +14,18 @@ router.register(r"lessons", LessonViewSet, basename="lesson")
 
 urlpatterns = [
     path("", include(router.urls)),
+    path("cache/stats/", ResponseCacheStatsView.as_view(), name="response-cache-stats"),
+    # Асинхронные варианты чтения для ASGI
+    path("async/courses/", CourseAsyncReadView.as_view(), name="course-async-list"),
+    path(
+        "async/courses/<int:pk>/",
+        CourseAsyncReadView.as_view(),
+        name="course-async-detail",
+    ),
+    path("async/lessons/", LessonAsyncReadView.as_view(), name="lesson-async-list"),
+    path(
+        "async/lessons/<int:pk>/",
+        LessonAsyncReadView.as_view(),
+        name="lesson-async-detail",
+    ),
 ]
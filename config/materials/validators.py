@@ -1,22 +1,125 @@
+import re
+from functools import lru_cache
+from urllib.parse import urlsplit
+
 from django.core.exceptions import ValidationError
 from urlextract import URLExtract
 
+DEFAULT_ALLOWED_DOMAINS = ("youtube.com", "youtu.be")
 
-def validate_no_external_links(value, allowed_domains=("youtube.com", "youtu.be")):
-    """Проверка на сторонние ссылки любого текста value"""
-    if not value:
+# Тексты длиннее отклоняем без сканирования, чтобы ограничить время проверки
+MAX_LINK_SCAN_LENGTH = 100_000
+
+# Кандидат в ссылку: точка между символом и буквенным TLD (конец предложения
+# ". " и числа "1.5" не подходят), схема "://", "www." или IP-адрес хоста.
+# Ссылки не содержат пробелов, поэтому URLExtract запускаем только на словах
+# текста, где есть такой кандидат.
+DOMAIN_CANDIDATE_RE = re.compile(r"[^\s.]\.[^\W\d_]{2,}")
+LINK_CANDIDATE_RE = re.compile(
+    r"://|www\.|\d{1,3}(?:\.\d{1,3}){3}|\[[0-9a-f]*:[0-9a-f:.]*\]", re.IGNORECASE
+)
+
+# Явные ссылки, которые URLExtract не находит: IPv6 в скобках, хосты без
+# известного TLD (http://localhost, www.intranet)
+EXPLICIT_LINK_RE = re.compile(
+    r"(?:[a-z][a-z0-9+.-]*://|www\.|\[[0-9a-f]*:[0-9a-f:.]*\])\S*", re.IGNORECASE
+)
+
+
+@lru_cache(maxsize=1)
+def get_url_extractor():
+    """
+    Общий на процесс экземпляр URLExtract: при создании он загружает
+    список TLD, поэтому создаем его один раз
+    """
+    return URLExtract()
+
+
+class LinkPolicy:
+    """
+    Политика ссылок: в тексте разрешены только ссылки, хост которых
+    совпадает с разрешенным доменом или является его поддоменом.
+
+    Сравнение идет по разобранному hostname, поэтому youtube.com.evil.io
+    и youtube.com@evil.io не считаются ссылками на youtube.com.
+    """
+
+    message = "Запрещены ссылки на сторонние ресурсы."
+    too_long_message = "Текст слишком длинный для проверки ссылок."
+
+    def __init__(self, allowed_domains, max_length=MAX_LINK_SCAN_LENGTH):
+        self.allowed_domains = frozenset(
+            domain.lower().strip(".") for domain in allowed_domains
+        )
+        self.max_length = max_length
+        self.is_allowed_host = lru_cache(maxsize=4096)(self._is_allowed_host)
+        self.find_forbidden_url_in_word = lru_cache(maxsize=4096)(
+            self._find_forbidden_url_in_word
+        )
+
+    def _is_allowed_host(self, host):
+        # Проверяем сам хост и все его родительские домены: a.b.youtube.com,
+        # b.youtube.com, youtube.com, com
+        labels = host.split(".")
+        return any(
+            ".".join(labels[i:]) in self.allowed_domains for i in range(len(labels))
+        )
+
+    @staticmethod
+    def get_host(url):
+        if "://" not in url:
+            url = "//" + url
+        try:
+            return (urlsplit(url).hostname or "").rstrip(".")
+        except ValueError:
+            return ""
+
+    def _find_forbidden_url_in_word(self, word):
+        for url in get_url_extractor().gen_urls(word):
+            if not self.is_allowed_host(self.get_host(url)):
+                return url
+        for match in EXPLICIT_LINK_RE.finditer(word):
+            host = self.get_host(match.group())
+            if host and not self.is_allowed_host(host.lower()):
+                return match.group()
+        return None
+
+    @staticmethod
+    def is_link_candidate(word):
+        return (
+            DOMAIN_CANDIDATE_RE.search(word) is not None
+            or LINK_CANDIDATE_RE.search(word) is not None
+        )
+
+    def find_forbidden_url(self, text):
+        """Первая запрещенная ссылка в тексте или None"""
+        for word in text.split():
+            if not self.is_link_candidate(word):
+                continue
+            url = self.find_forbidden_url_in_word(word)
+            if url is not None:
+                return url
+        return None
+
+    def validate(self, value):
+        if not value:
+            return value
+        # Без точки и двоеточия в тексте нет ни домена, ни IP-адреса
+        if "." not in value and ":" not in value:
+            return value
+        if len(value) > self.max_length:
+            raise ValidationError(self.too_long_message)
+        if self.find_forbidden_url(value) is not None:
+            raise ValidationError(self.message)
         return value
-    url_extractor = URLExtract()
-    urls = url_extractor.find_urls(value)
 
-    for url in urls:
-        # Приводим URL к нижнему регистру для сравнения
-        url_lower = url.lower()
 
-        # Проверяем, содержит ли URL разрешенные домены
-        is_allowed = any(domain in url_lower for domain in allowed_domains)
+@lru_cache(maxsize=32)
+def get_link_policy(allowed_domains):
+    """Скомпилированная политика для набора доменов, общая на процесс"""
+    return LinkPolicy(allowed_domains)
 
-        if not is_allowed:
-            raise ValidationError("Запрещены ссылки на сторонние ресурсы.")
 
-    return value
+def validate_no_external_links(value, allowed_domains=DEFAULT_ALLOWED_DOMAINS):
+    """Проверка на сторонние ссылки любого текста value"""
+    return get_link_policy(tuple(allowed_domains)).validate(value)
@@ -1,8 +1,12 @@
+from django.db.models import Count, Max, Prefetch, Q, Sum
 from rest_framework import viewsets, permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend, FilterSet
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from materials.models import Course, Lesson
 from materials.serializers import CourseSerializer, LessonSerializer
+from users.principal import get_principal
 from users.permissions import (
     IsOwner,
     IsOwnerOrModerator,
@@ -10,14 +14,24 @@ from users.permissions import (
     IsOwnerOrModeratorForList,
 )
 
-from django.utils import timezone
-from datetime import timedelta
-
 from users.serializers import CourseWithSubscriptionSerializer
 
-from materials.paginators import LessonCoursePagination
+from materials.aggregates import rebuild_course_aggregates
+from materials.async_views import AsyncViewSetReadView
+from materials.bulk import BulkModelMixin
+from materials.cache import (
+    ResponseCacheMixin,
+    get_response_cache_stats,
+    invalidate_course,
+    invalidate_lesson,
+)
+from materials.conditional import ConditionalGetMixin
+from materials.exports import ExportMixin
+from materials.filters import FullTextSearchFilter
+from materials.paginators import KeysetPagination, LessonCoursePagination
+from materials.timing import ServerTimingMixin
 
-from materials.tasks import send_course_update_notification
+from materials.notifications import on_course_updated
 
 
 class LessonFilter(FilterSet):
@@ -29,13 +43,67 @@ class LessonFilter(FilterSet):
         }
 
 
-class CourseViewSet(viewsets.ModelViewSet):
+class SparseFieldsMixin:
+    """
+    Загрузка из БД только колонок, запрошенных через ?fields=
+    (см. DynamicFieldsMixin), и полей сортировки
+    """
+
+    def restrict_columns(self, queryset, serializer_class):
+        columns = serializer_class.get_model_columns(self.request)
+        if columns is None:
+            return queryset.defer("search_vector")
+        ordering_fields = [field for field in self.ordering_fields if field != "id"] + [
+            KeysetPagination.split_ordering(self.cursor_ordering)[0]
+        ]
+        return queryset.only(*columns, *ordering_fields)
+
+
+class CourseViewSet(
+    ServerTimingMixin,
+    ExportMixin,
+    SparseFieldsMixin,
+    ResponseCacheMixin,
+    ConditionalGetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = Course.objects.all()
     serializer_class = CourseSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OrderingFilter]
     search_fields = ["name", "description"]
-    ordering_fields = ["name", "id", "created_at"]
+    # Популярность и размер курса - денормализованные поля с индексами,
+    # сортировка по ним не требует агрегатов по урокам и подпискам
+    ordering_fields = [
+        "name",
+        "id",
+        "created_at",
+        "content_updated_at",
+        "lessons_count",
+        "lessons_total_price",
+        "subscribers_count",
+        "purchases_count",
+    ]
     pagination_class = LessonCoursePagination
+    cursor_ordering = "-created_at"
+    cache_resource = "course"
+    cache_per_user_actions = ("retrieve",)
+    # Количество подписчиков и покупок меняется без изменения дат курса
+    last_modified_actions = ()
+    # Колонки выгрузки - поля CourseSerializer без превью и вложенных уроков
+    export_fields = {
+        "id": "id",
+        "name": "name",
+        "description": "description",
+        "price": "price",
+        "owner": "owner_id",
+        "created_at": "created_at",
+        "content_updated_at": "content_updated_at",
+        "lessons_count": "lessons_count",
+        "lessons_total_price": "lessons_total_price",
+        "subscribers_count": "subscribers_count",
+        "purchases_count": "purchases_count",
+    }
+    export_filename = "courses"
 
     def get_serializer_class(self):
         # Используем расширенный сериализатор с информацией о подписке
@@ -47,13 +115,13 @@ class CourseViewSet(viewsets.ModelViewSet):
         """
         Настройка прав доступа:
         - Создание: только аутентифицированные пользователи, которые НЕ модераторы
-        - Список: аутентифицированные пользователи (модераторы видят все, обычные - только свои)
+        - Список и выгрузка: аутентифицированные пользователи (модераторы видят все, обычные - только свои)
         - Детали, обновление: владелец или модератор
         - Удаление: только владелец (модераторы не могут удалять)
         """
         if self.action == "create":
             self.permission_classes = [IsOwnerOrModeratorForCreate]
-        elif self.action == "list":
+        elif self.action in ["list", "export"]:
             self.permission_classes = [IsOwnerOrModeratorForList]
         elif self.action in ["retrieve", "update", "partial_update"]:
             self.permission_classes = [IsOwnerOrModerator]
@@ -64,54 +132,124 @@ class CourseViewSet(viewsets.ModelViewSet):
 
         return [permission() for permission in self.permission_classes]
 
+    def get_conditional_aggregates(self):
+        """Ответ курса включает вложенные уроки и подписку пользователя"""
+        # content_updated_at меняется при любом изменении уроков курса,
+        # поэтому соединение с уроками не нужно
+        aggregates = {
+            "updated_at": Max("updated_at"),
+            "content_updated_at": Max("content_updated_at"),
+            "count": Count("pk"),
+            "subscribers_count": Sum("subscribers_count"),
+            "purchases_count": Sum("purchases_count"),
+        }
+        if self.action == "retrieve":
+            aggregates["is_subscribed"] = Count(
+                "subscriptions",
+                filter=Q(subscriptions__user_id=self.request.user.pk),
+                distinct=True,
+            )
+        return aggregates
+
     def get_queryset(self):
         """
         Фильтрация объектов:
         - Модераторы видят все курсы
         - Обычные пользователи видят только свои курсы
         """
-        user = self.request.user
+        principal = get_principal(self.request)
 
-        if not user.is_authenticated:
+        if not principal.is_authenticated:
             return Course.objects.none()
 
+        serializer_class = self.get_serializer_class()
+        queryset = self.restrict_columns(Course.objects.all(), serializer_class)
+
+        # Уроки загружаем, только если они раскрыты в ответе
+        if "lessons" in serializer_class.get_expand(self.request, self.action):
+            queryset = queryset.prefetch_related(
+                Prefetch("lessons", queryset=Lesson.objects.defer("search_vector"))
+            )
+
         # Модераторы видят все
-        if user.groups.filter(name="moderators").exists():
-            return Course.objects.prefetch_related("lessons").all()
+        if principal.is_moderator:
+            return queryset.all()
 
         # Обычные пользователи видят только свои курсы
-        return Course.objects.prefetch_related("lessons").filter(owner=user)
+        return queryset.filter(owner_id=principal.user_id)
 
     def perform_create(self, serializer):
         """Автоматически назначаем владельца при создании курса"""
         serializer.save(owner=self.request.user)
 
+    def perform_update(self, serializer):
+        """Уведомляем подписчиков курса (отложенно, с объединением правок)"""
+        super().perform_update(serializer)
+        on_course_updated(serializer.instance.pk)
+
 
-class LessonViewSet(viewsets.ModelViewSet):
+class LessonViewSet(
+    ServerTimingMixin,
+    ExportMixin,
+    BulkModelMixin,
+    SparseFieldsMixin,
+    ResponseCacheMixin,
+    ConditionalGetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = Lesson.objects.all()
     serializer_class = LessonSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OrderingFilter]
     filterset_class = LessonFilter
     search_fields = ["name", "description"]
     ordering_fields = ["name", "id", "created_at"]
     pagination_class = LessonCoursePagination
+    cursor_ordering = "-created_at"
+    cache_resource = "lesson"
+    # Колонки выгрузки - поля LessonSerializer без превью
+    export_fields = {
+        "id": "id",
+        "name": "name",
+        "description": "description",
+        "video_link": "video_link",
+        "course": "course_id",
+        "course_name": "course__name",
+        "price": "price",
+        "owner": "owner_id",
+        "created_at": "created_at",
+        "updated_at": "updated_at",
+    }
+    export_filename = "lessons"
+    bulk_related_fields = ("course",)
+    # Права массовых операций совпадают с правами одиночных
+    bulk_permission_classes = {
+        "POST": [IsOwnerOrModeratorForCreate],
+        "PATCH": [IsOwnerOrModerator],
+        "DELETE": [permissions.IsAuthenticated, IsOwner],
+    }
 
     def get_permissions(self):
         """
         Настройка прав доступа:
         - Создание: только аутентифицированные пользователи, которые НЕ модераторы
-        - Список: аутентифицированные пользователи (модераторы видят все, обычные - только свои)
+        - Список и выгрузка: аутентифицированные пользователи (модераторы видят все, обычные - только свои)
         - Детали, обновление: владелец или модератор
         - Удаление: только владелец (модераторы не могут удалять)
+        - Массовые операции: те же правила для каждого элемента
         """
         if self.action == "create":
             self.permission_classes = [IsOwnerOrModeratorForCreate]
-        elif self.action == "list":
+        elif self.action in ["list", "export"]:
             self.permission_classes = [IsOwnerOrModeratorForList]
         elif self.action in ["retrieve", "update", "partial_update"]:
             self.permission_classes = [IsOwnerOrModerator]
         elif self.action == "destroy":
             self.permission_classes = [IsOwner]  # Только владелец может удалять
+        elif (
+            self.action == "bulk"
+            and self.request.method in self.bulk_permission_classes
+        ):
+            self.permission_classes = self.bulk_permission_classes[self.request.method]
         else:
             self.permission_classes = [permissions.IsAuthenticated]
 
@@ -123,36 +261,76 @@ class LessonViewSet(viewsets.ModelViewSet):
         - Модераторы видят все уроки
         - Обычные пользователи видят только свои уроки
         """
-        user = self.request.user
+        principal = get_principal(self.request)
 
-        if not user.is_authenticated:
+        if not principal.is_authenticated:
             return Lesson.objects.none()
 
+        queryset = self.restrict_columns(Lesson.objects.all(), LessonSerializer)
+
         # Модераторы видят все
-        if user.groups.filter(name="moderators").exists():
-            return Lesson.objects.select_related("course", "owner").all()
+        if principal.is_moderator:
+            return queryset.all()
 
         # Обычные пользователи видят только свои уроки
-        return Lesson.objects.select_related("course", "owner").filter(owner=user)
+        return queryset.filter(owner_id=principal.user_id)
 
     def perform_create(self, serializer):
         """Автоматически назначаем владельца при создании урока"""
         serializer.save(owner=self.request.user)
 
-    def perform_update(self, serializer):
+    def get_bulk_create_kwargs(self):
+        return {"owner": self.request.user}
+
+    def after_bulk_write(self, instances, previous=()):
         """
-        Переопределяем обновление для отправки уведомлений
+        Сигналы при bulk_create/bulk_update не отправляются: пересчитываем
+        агрегаты затронутых курсов, сбрасываем кеш ответов уроков и курсов
+        (включая прежние курсы перенесенных уроков) и при обновлении
+        планируем уведомления, как perform_update
         """
-        instance = self.get_object()
-        old_updated_at = instance.updated_at
+        lessons = [*instances, *previous]
+        course_ids = {lesson.course_id for lesson in lessons}
+        rebuild_course_aggregates(course_ids)
+        course_owner_ids = set(
+            Course.objects.filter(pk__in=course_ids).values_list("owner_id", flat=True)
+        )
+        for owner_id in {lesson.owner_id for lesson in lessons}:
+            invalidate_lesson(owner_id)
+        for owner_id in course_owner_ids:
+            invalidate_course(owner_id)
+
+        if previous:
+            on_course_updated(*(lesson.course_id for lesson in instances))
 
-        # Сохраняем обновления
+    def perform_update(self, serializer):
+        """Уведомляем подписчиков курса (отложенно, с объединением правок)"""
         super().perform_update(serializer)
+        on_course_updated(serializer.instance.course_id)
+
+
+class CourseAsyncReadView(AsyncViewSetReadView):
+    """
+    Асинхронные (ASGI) список и детали курсов
+    """
+
+    viewset_class = CourseViewSet
+
+
+class LessonAsyncReadView(AsyncViewSetReadView):
+    """
+    Асинхронные (ASGI) список и детали уроков
+    """
+
+    viewset_class = LessonViewSet
+
+
+class ResponseCacheStatsView(APIView):
+    """
+    Счетчики попаданий и промахов кеша ответов курсов и уроков
+    """
 
-        # Проверяем, что курс не обновлялся более 4 часов
-        current_time = timezone.now()
-        time_diff = current_time - old_updated_at
+    permission_classes = [permissions.IsAdminUser]
 
-        if time_diff > timedelta(hours=4):
-            # Отправляем уведомления асинхронно
-            send_course_update_notification.delay(instance.id)
+    def get(self, request):
+        return Response(get_response_cache_stats())
@@ -0,0 +1,170 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from materials.aggregates import rebuild_course_aggregates
+from materials.models import Course, Lesson
+from users.models import Payment, User
+
+BENCHMARK_EMAIL = "benchmark-asgi@example.com"
+
+# Эндпоинт: (синхронный путь, асинхронный путь); {payment}/{course} -
+# id созданных для замера объектов
+ENDPOINTS = {
+    "status": (
+        "/api/users/payments/{payment}/status/",
+        "/api/users/async/payments/{payment}/status/",
+    ),
+    "courses": ("/api/materials/courses/", "/api/materials/async/courses/"),
+    "course": (
+        "/api/materials/courses/{course}/",
+        "/api/materials/async/courses/{course}/",
+    ),
+    "lessons": ("/api/materials/lessons/", "/api/materials/async/lessons/"),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает пропускную способность чтений: синхронные эндпоинты на "
+        "пуле WSGI-потоков и асинхронные на одном ASGI event loop. Статус "
+        "платежа приходит вебхуком Stripe, поэтому все эндпоинты читают "
+        "только БД, без запросов к Stripe"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests", type=int, default=200, help="Количество запросов"
+        )
+        parser.add_argument(
+            "--endpoint",
+            action="append",
+            choices=sorted(ENDPOINTS),
+            help="Эндпоинт для замера, можно несколько (по умолчанию - все)",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=4,
+            help="Количество потоков синхронного WSGI-воркера",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=100,
+            help="Одновременных запросов к ASGI-воркеру",
+        )
+        parser.add_argument(
+            "--lessons", type=int, default=20, help="Уроков в курсе для замера"
+        )
+
+    def handle(self, *args, **options):
+        # testserver в ALLOWED_HOSTS и почта в памяти, как в тестах
+        setup_test_environment()
+        user, ids = self.create_fixtures(options["lessons"])
+        token = str(RefreshToken.for_user(user).access_token)
+        headers = {"Authorization": f"Bearer {token}"}
+        results = []
+        try:
+            for name in options["endpoint"] or ENDPOINTS:
+                sync_path, async_path = (path.format(**ids) for path in ENDPOINTS[name])
+                results.append(
+                    (
+                        f"{name}: WSGI ({options['threads']} потока)",
+                        self.run_wsgi(
+                            sync_path,
+                            headers,
+                            options["requests"],
+                            options["threads"],
+                        ),
+                    )
+                )
+                results.append(
+                    (
+                        f"{name}: ASGI (1 event loop, {options['concurrency']} одновременно)",
+                        asyncio.run(
+                            self.run_asgi(
+                                async_path,
+                                headers,
+                                options["requests"],
+                                options["concurrency"],
+                            )
+                        ),
+                    )
+                )
+        finally:
+            Course.objects.filter(owner=user).delete()
+            user.delete()
+            teardown_test_environment()
+
+        self.stdout.write(f"Запросов на эндпоинт: {options['requests']}")
+        for name, (elapsed, latencies) in results:
+            self.stdout.write(
+                f"{name:<52} {len(latencies) / elapsed:8.1f} запросов/с   "
+                f"p50: {statistics.median(latencies) * 1000:7.1f} мс   "
+                f"p95: {self.percentile(latencies, 95) * 1000:7.1f} мс"
+            )
+
+    def create_fixtures(self, lessons):
+        User.objects.filter(email=BENCHMARK_EMAIL).delete()
+        user = User.objects.create_user(email=BENCHMARK_EMAIL, password=None)
+        course = Course.objects.create(name="Benchmark", owner=user)
+        Lesson.objects.bulk_create(
+            Lesson(name=f"Benchmark {i}", course=course, owner=user)
+            for i in range(lessons)
+        )
+        # bulk_create не отправляет сигналы, агрегаты курса пересчитываем
+        rebuild_course_aggregates([course.id])
+        payment = Payment.objects.create(
+            user=user,
+            paid_course=course,
+            amount=100,
+            payment_method="stripe",
+            status="pending",
+            stripe_session_id="cs_benchmark",
+        )
+        return user, {"payment": payment.id, "course": course.id}
+
+    def run_wsgi(self, path, headers, total, threads):
+        def request(_):
+            started = time.perf_counter()
+            response = Client().get(path, headers=headers)
+            assert response.status_code == 200, response.status_code
+            return time.perf_counter() - started
+
+        def close_connections(_):
+            connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            latencies = list(pool.map(request, range(total)))
+            pool.map(close_connections, range(threads))
+        return time.perf_counter() - started, latencies
+
+    async def run_asgi(self, path, headers, total, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def request():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(path, headers=headers)
+                assert response.status_code == 200, response.status_code
+                return time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(request() for _ in range(total)))
+        return time.perf_counter() - started, list(latencies)
+
+    @staticmethod
+    def percentile(values, percent):
+        values = sorted(values)
+        index = min(len(values) - 1, round(percent / 100 * (len(values) - 1)))
+        return values[index]
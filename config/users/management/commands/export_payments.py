@@ -0,0 +1,10 @@
+from materials.exports import ExportCommand
+from users.views import PaymentViewSet
+
+
+class Command(ExportCommand):
+    help = (
+        "Потоковая выгрузка платежей в CSV или NDJSON с теми же фильтрами "
+        "и областью видимости, что у /api/users/payments/export/"
+    )
+    view_class = PaymentViewSet
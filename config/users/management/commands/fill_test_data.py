@@ -1,16 +1,84 @@
-from django.core.management.base import BaseCommand
+import math
+import random
+import string
+import time
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime, time as dt_time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import Group, Permission
 from django.contrib.contenttypes.models import ContentType
-from django.contrib.auth.hashers import make_password
-from users.models import User, Payment
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+
+from materials.cache import MODERATOR_SCOPE, bump_versions, owner_scope
+from materials.imports import get_table_fields, write_rows
 from materials.models import Course, Lesson
-from decimal import Decimal
-import random
-from datetime import datetime, timedelta
+from users.models import Payment, StripePrice, StripeProduct, Subscription, User
+from users.services import CHECKOUT_SESSION_LIFETIME
+
+GENERATED_EMAIL_DOMAIN = "lms.test"
+SALT_ALPHABET = string.ascii_letters + string.digits
+
+FIRST_NAMES = (
+    "Иван, Мария, Алексей, Анна, Дмитрий, Елена, Сергей, Ольга, Андрей, "
+    "Наталья, Михаил, Татьяна, Никита, Екатерина, Павел"
+).split(", ")
+LAST_NAMES = (
+    "Петров, Сидорова, Иванов, Смирнова, Кузнецов, Попова, Васильев, "
+    "Соколова, Михайлов, Новикова, Федоров, Морозова, Волков"
+).split(", ")
+CITIES = (
+    "Москва, Санкт-Петербург, Казань, Новосибирск, Екатеринбург, "
+    "Нижний Новгород, Самара, Краснодар, Пермь, Воронеж"
+).split(", ")
+TOPICS = (
+    "Python, Django, JavaScript, SQL, Docker, Git, React, Linux, Алгоритмы, "
+    "Go, Kubernetes, Машинное обучение, Тестирование"
+).split(", ")
+LEVELS = ["для начинающих", "на практике", "с нуля", "продвинутый курс", "интенсив"]
+COURSE_PRICES = [Decimal(price) for price in ("4900", "9900", "14900", "24900")]
+LESSON_PRICES = [Decimal(price) for price in ("290", "490", "990", "1490")]
+
+# Доля платных уроков, доля платежей за курс (остальные - за урок)
+PAID_LESSON_SHARE = 0.7
+COURSE_PAYMENT_SHARE = 0.7
+PAYMENT_STATUSES = (
+    ("succeeded", "pending", "canceled", "failed", "processing"),
+    (85, 8, 4, 2, 1),
+)
+PAYMENT_METHODS = (("stripe", "transfer", "cash"), (60, 25, 15))
+
+# Конец истории по умолчанию: фиксированная дата, а не текущий день, чтобы
+# данные зависели только от --seed и параметров
+DEFAULT_END_DATE = date(2026, 1, 1)
+
+
+class WeightedSampler:
+    """Выбор индексов с заданными весами за O(log n)"""
+
+    def __init__(self, rng, weights):
+        self.rng = rng
+        self.cum_weights = list(accumulate(weights))
+        self.total = self.cum_weights[-1] if self.cum_weights else 0
+
+    def __len__(self):
+        return len(self.cum_weights)
+
+    def sample(self):
+        return bisect_left(self.cum_weights, self.rng.random() * self.total)
 
 
 class Command(BaseCommand):
-    help = "Заполняет базу данных тестовыми данными для LMS системы"
+    help = (
+        "Заполняет базу синтетическими данными заданного масштаба: "
+        "детерминированно по --seed, пакетами bulk_create (COPY на PostgreSQL)"
+    )
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -18,408 +86,414 @@ class Command(BaseCommand):
             action="store_true",
             help="Очистить существующие данные перед заполнением",
         )
+        parser.add_argument("--seed", type=int, default=42, help="Зерно генератора")
+        parser.add_argument("--users", type=int, default=200, help="Пользователей")
+        parser.add_argument(
+            "--owners-share",
+            type=float,
+            default=0.05,
+            help="Доля пользователей - авторов курсов",
+        )
+        parser.add_argument(
+            "--courses-per-owner",
+            type=float,
+            default=3,
+            help="Среднее число курсов автора (геометрическое распределение)",
+        )
+        parser.add_argument(
+            "--lessons-per-course",
+            type=float,
+            default=10,
+            help="Среднее число уроков курса (логнормальное распределение)",
+        )
+        parser.add_argument(
+            "--subscriptions", type=int, default=400, help="Подписок (примерно)"
+        )
+        parser.add_argument(
+            "--payments", type=int, default=600, help="Платежей (примерно)"
+        )
+        parser.add_argument(
+            "--password",
+            default="password123",
+            help="Пароль всех сгенерированных пользователей",
+        )
+        parser.add_argument(
+            "--days", type=int, default=365, help="Глубина истории в днях"
+        )
+        parser.add_argument(
+            "--end-date",
+            type=date.fromisoformat,
+            default=DEFAULT_END_DATE,
+            help="Конец истории, ГГГГ-ММ-ДД (по умолчанию %(default)s)",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=5000, help="Строк в одной записи"
+        )
 
     def handle(self, *args, **options):
-        clear_data = options.get("clear", False)
+        if options["users"] < 1:
+            raise CommandError("--users должен быть положительным")
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.use_copy = connection.vendor == "postgresql"
+        self.end = datetime.combine(
+            options["end_date"], dt_time(), tzinfo=dt_timezone.utc
+        )
+        self.start = self.end - timedelta(days=options["days"])
 
-        if clear_data:
+        if options["clear"]:
             self.clear_existing_data()
+        elif User.objects.filter(email__endswith=f"@{GENERATED_EMAIL_DOMAIN}").exists():
+            raise CommandError(
+                "Сгенерированные данные уже есть, запустите команду с --clear"
+            )
 
+        started = time.perf_counter()
         self.create_groups()
-        self.create_users()
-        self.create_courses()
-        self.create_lessons()
-        self.create_payments()
+        self.create_demo_users()
+        self.create_users(options["users"], options["password"])
+        self.create_courses(options["owners_share"], options["courses_per_owner"])
+        self.create_lessons(options["lessons_per_course"])
+        self.create_subscriptions(options["subscriptions"])
+        self.create_payments(options["payments"])
+
+        # bulk_create и COPY не отправляют сигналы: агрегаты курсов и кеш
+        # ответов обновляются здесь
+        call_command("rebuild_course_aggregates", stdout=self.stdout)
+        bump_versions(
+            [("lesson", MODERATOR_SCOPE)]
+            + [("lesson", owner_scope(owner_id)) for owner_id in self.owner_ids]
+        )
 
-        self.stdout.write(self.style.SUCCESS("✅ Тестовые данные успешно созданы!"))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✅ Тестовые данные созданы за {time.perf_counter() - started:.1f} с"
+            )
+        )
 
     def clear_existing_data(self):
-        """Очистка существующих данных"""
+        """
+        Очистка существующих данных. Платежи, подписки, цены и продукты
+        Stripe, уроки и курсы на PostgreSQL очищаются одним TRUNCATE ...
+        CASCADE, на других СУБД - QuerySet.delete() в порядке внешних ключей
+        """
         self.stdout.write("Очистка существующих данных...")
 
-        Payment.objects.all().delete()
-        Lesson.objects.all().delete()
-        Course.objects.all().delete()
+        models = (Payment, Subscription, StripePrice, StripeProduct, Lesson, Course)
+        if connection.vendor == "postgresql":
+            tables = ", ".join(
+                connection.ops.quote_name(model._meta.db_table) for model in models
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(f"TRUNCATE {tables} CASCADE")
+        else:
+            for model in models:
+                model.objects.all().delete()
         User.objects.filter(is_superuser=False).delete()
         Group.objects.filter(name="moderators").delete()
+        bump_versions([("course", MODERATOR_SCOPE), ("lesson", MODERATOR_SCOPE)])
 
         self.stdout.write("✅ Существующие данные очищены")
 
     def create_groups(self):
         """Создание группы модераторов с правами"""
-        self.stdout.write("Создание группы модераторов...")
-
-        moderators_group, created = Group.objects.get_or_create(name="moderators")
-
-        # Получаем разрешения для моделей
-        course_content_type = ContentType.objects.get_for_model(Course)
-        lesson_content_type = ContentType.objects.get_for_model(Lesson)
-        payment_content_type = ContentType.objects.get_for_model(Payment)
-
-        # Разрешения для модераторов (просмотр и изменение, но не создание и удаление)
-        course_permissions = Permission.objects.filter(
-            content_type=course_content_type,
-            codename__in=["view_course", "change_course"],
-        )
-        lesson_permissions = Permission.objects.filter(
-            content_type=lesson_content_type,
-            codename__in=["view_lesson", "change_lesson"],
-        )
-        payment_permissions = Permission.objects.filter(
-            content_type=payment_content_type, codename__in=["view_payment"]
-        )
-
-        # Добавляем разрешения в группу
-        all_permissions = (
-            list(course_permissions)
-            + list(lesson_permissions)
-            + list(payment_permissions)
-        )
-        moderators_group.permissions.set(all_permissions)
-
+        moderators_group, _ = Group.objects.get_or_create(name="moderators")
+
+        # Модераторы просматривают и изменяют, но не создают и не удаляют
+        codenames = {
+            Course: ["view_course", "change_course"],
+            Lesson: ["view_lesson", "change_lesson"],
+            Payment: ["view_payment"],
+        }
+        permissions = []
+        for model, model_codenames in codenames.items():
+            permissions += Permission.objects.filter(
+                content_type=ContentType.objects.get_for_model(model),
+                codename__in=model_codenames,
+            )
+        moderators_group.permissions.set(permissions)
         self.stdout.write("✅ Группа модераторов создана")
 
-    def create_users(self):
-        """Создание тестовых пользователей"""
-        self.stdout.write("Создание тестовых пользователей...")
-
-        users_data = [
-            {
-                "email": "user1@example.com",
-                "password": "password123",
-                "first_name": "Иван",
-                "last_name": "Петров",
-                "phone": "+79161234567",
-                "city": "Москва",
-                "is_superuser": False,
-                "is_staff": False,
-                "is_moderator": False,
-            },
-            {
-                "email": "user2@example.com",
-                "password": "password123",
-                "first_name": "Мария",
-                "last_name": "Сидорова",
-                "phone": "+79167654321",
-                "city": "Санкт-Петербург",
-                "is_superuser": False,
-                "is_staff": False,
-                "is_moderator": False,
-            },
-            {
-                "email": "admin@example.com",
-                "password": "admin123",
-                "first_name": "Админ",
-                "last_name": "Админов",
-                "phone": "+79031112233",
-                "city": "Москва",
+    def create_demo_users(self):
+        """Учетные записи для ручной проверки: администратор и модератор"""
+        admin, _ = User.objects.get_or_create(
+            email="admin@example.com",
+            defaults={
+                "password": make_password("admin123"),
                 "is_superuser": True,
                 "is_staff": True,
-                "is_moderator": False,
             },
-            {
-                "email": "moderator@example.com",
-                "password": "moderator123",
-                "first_name": "Модератор",
-                "last_name": "Модераторов",
-                "phone": "+79032223344",
-                "city": "Казань",
-                "is_superuser": False,
-                "is_staff": False,
-                "is_moderator": True,
-            },
-        ]
-
-        created_users = {}
-
-        for user_data in users_data:
-            user, created = User.objects.get_or_create(
-                email=user_data["email"],
-                defaults={
-                    "password": make_password(user_data["password"]),
-                    "first_name": user_data["first_name"],
-                    "last_name": user_data["last_name"],
-                    "phone": user_data["phone"],
-                    "city": user_data["city"],
-                    "is_superuser": user_data["is_superuser"],
-                    "is_staff": user_data["is_staff"],
-                    "is_active": True,
-                },
-            )
-
-            if user_data["is_moderator"]:
-                moderators_group = Group.objects.get(name="moderators")
-                user.groups.add(moderators_group)
-
-            created_users[user_data["email"]] = user
-
-            if created:
-                self.stdout.write(f"   ✅ Создан пользователь: {user.email}")
-            else:
-                self.stdout.write(f"   ⚠️  Пользователь уже существует: {user.email}")
-
-        self.stdout.write("✅ Тестовые пользователи созданы")
-        return created_users
-
-    def create_courses(self):
-        """Создание тестовых курсов"""
-        self.stdout.write("Создание тестовых курсов...")
-
-        users = User.objects.filter(
-            email__in=["user1@example.com", "user2@example.com"]
         )
-        user1 = users.get(email="user1@example.com")
-        user2 = users.get(email="user2@example.com")
-
-        courses_data = [
-            {
-                "name": "Python для начинающих",
-                "description": "Базовый курс по программированию на Python. Изучите основы языка и создайте свои первые проекты.",
-                "owner": user1,
-            },
-            {
-                "name": "Django Framework",
-                "description": "Полный курс по веб-разработке на Django. Создавайте мощные веб-приложения с ORM, шаблонами и формами.",
-                "owner": user2,
-            },
-            {
-                "name": "JavaScript современный",
-                "description": "Изучение JavaScript и современных фреймворков. От основ до продвинутых тем включая ES6+, React и Node.js.",
-                "owner": user1,
-            },
-            {
-                "name": "Базы данных и SQL",
-                "description": "Полное руководство по работе с базами данных, SQL запросами и оптимизации.",
-                "owner": user2,
-            },
-        ]
-
-        created_courses = []
-
-        for course_data in courses_data:
-            course, created = Course.objects.get_or_create(
-                name=course_data["name"], defaults=course_data
-            )
-            created_courses.append(course)
-
-            if created:
-                self.stdout.write(f"   ✅ Создан курс: {course.name}")
-            else:
-                self.stdout.write(f"   ⚠️  Курс уже существует: {course.name}")
-
-        self.stdout.write("✅ Тестовые курсы созданы")
-        return created_courses
-
-    def create_lessons(self):
-        """Создание тестовых уроков"""
-        self.stdout.write("Создание тестовых уроков...")
-
-        courses = Course.objects.all()
-        users = User.objects.filter(
-            email__in=["user1@example.com", "user2@example.com"]
+        moderator, _ = User.objects.get_or_create(
+            email="moderator@example.com",
+            defaults={"password": make_password("moderator123")},
         )
-        user1 = users.get(email="user1@example.com")
-        user2 = users.get(email="user2@example.com")
-
-        lessons_data = [
-            # Курс 1: Python для начинающих
-            {
-                "name": "Введение в Python",
-                "description": "Основы синтаксиса Python, переменные, типы данных и первые программы.",
-                "video_link": "https://youtube.com/watch?v=python_intro",
-                "course": courses.get(name="Python для начинающих"),
-                "owner": user1,
-            },
-            {
-                "name": "Функции в Python",
-                "description": "Создание и использование функций, параметры, возвращаемые значения и области видимости.",
-                "video_link": "https://youtube.com/watch?v=python_functions",
-                "course": courses.get(name="Python для начинающих"),
-                "owner": user1,
-            },
-            {
-                "name": "Классы и ООП",
-                "description": "Объектно-ориентированное программирование в Python: классы, наследование, полиморфизм.",
-                "video_link": "https://youtube.com/watch?v=python_oop",
-                "course": courses.get(name="Python для начинающих"),
-                "owner": user1,
-            },
-            # Курс 2: Django Framework
-            {
-                "name": "Основы Django",
-                "description": "Знакомство с фреймворком Django, создание первого приложения и настройка проекта.",
-                "video_link": "https://youtube.com/watch?v=django_basics",
-                "course": courses.get(name="Django Framework"),
-                "owner": user2,
-            },
-            {
-                "name": "Модели в Django",
-                "description": "Работа с моделями и базой данных в Django, миграции и ORM.",
-                "video_link": "https://youtube.com/watch?v=django_models",
-                "course": courses.get(name="Django Framework"),
-                "owner": user2,
-            },
-            {
-                "name": "Django REST Framework",
-                "description": "Создание API с помощью Django REST Framework, сериализаторы и ViewSets.",
-                "video_link": "https://youtube.com/watch?v=django_rest",
-                "course": courses.get(name="Django Framework"),
-                "owner": user2,
-            },
-            # Курс 3: JavaScript современный
-            {
-                "name": "JavaScript основы",
-                "description": "Синтаксис и основные конструкции JavaScript: переменные, функции, циклы.",
-                "video_link": "https://youtube.com/watch?v=javascript_basics",
-                "course": courses.get(name="JavaScript современный"),
-                "owner": user1,
-            },
-            {
-                "name": "ES6+ Нововведения",
-                "description": "Современный JavaScript: стрелочные функции, деструктуризация, шаблонные строки.",
-                "video_link": "https://youtube.com/watch?v=javascript_es6",
-                "course": courses.get(name="JavaScript современный"),
-                "owner": user1,
-            },
-            # Курс 4: Базы данных и SQL
-            {
-                "name": "Введение в SQL",
-                "description": "Основы SQL: SELECT, INSERT, UPDATE, DELETE запросы и работа с таблицами.",
-                "video_link": "https://youtube.com/watch?v=sql_intro",
-                "course": courses.get(name="Базы данных и SQL"),
-                "owner": user2,
-            },
-            {
-                "name": "JOIN и агрегатные функции",
-                "description": "Сложные SQL запросы: JOIN, GROUP BY, агрегатные функции и подзапросы.",
-                "video_link": "https://youtube.com/watch?v=sql_advanced",
-                "course": courses.get(name="Базы данных и SQL"),
-                "owner": user2,
-            },
+        moderator.groups.add(Group.objects.get(name="moderators"))
+        self.stdout.write("✅ Учетные записи admin@example.com и moderator@example.com")
+
+    def write(self, model, columns, rows, label):
+        """
+        Запись строк (кортежей значений columns) пакетами по batch_size,
+        каждый пакет в своей транзакции. Остальные столбцы получают значения
+        по умолчанию. Возвращает id созданных строк в порядке генерации
+        """
+        fields = [model._meta.get_field(name) for name in columns]
+        other_fields = [
+            field for field in get_table_fields(model) if field.name not in columns
         ]
+        defaults = tuple(field.get_default() for field in other_fields)
+        fields += other_fields
+
+        last_id = model.objects.aggregate(last_id=Max("pk"))["last_id"] or 0
+        started = time.perf_counter()
+        written = 0
+        rows = iter(rows)
+        while batch := list(islice(rows, self.batch_size)):
+            with transaction.atomic():
+                write_rows(model, fields, [row + defaults for row in batch])
+            written += len(batch)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"✅ {label}: {written} за {elapsed:.1f} с "
+            f"({written / elapsed if elapsed else 0:.0f} строк/с)"
+        )
+        # Строки одной сессии получают возрастающие id в порядке вставки
+        return array(
+            "q",
+            model.objects.filter(pk__gt=last_id)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+            .iterator(chunk_size=self.batch_size),
+        )
 
-        for lesson_data in lessons_data:
-            lesson, created = Lesson.objects.get_or_create(
-                name=lesson_data["name"],
-                course=lesson_data["course"],
-                defaults=lesson_data,
-            )
-
-            if created:
-                self.stdout.write(
-                    f"   ✅ Создан урок: {lesson.name} ({lesson.course.name})"
+    def random_date(self, start=None):
+        start = start or self.start
+        return start + (self.end - start) * self.rng.random()
+
+    def split_total(self, total, weights):
+        """Раскладывает total по весам со случайным округлением"""
+        scale = total / sum(weights)
+        for weight in weights:
+            share = weight * scale
+            count = int(share)
+            if self.rng.random() < share - count:
+                count += 1
+            yield count
+
+    def create_users(self, count, password):
+        # Хеш пароля считается один раз: хешер намеренно медленный
+        rng = self.rng
+        salt = "".join(rng.choice(SALT_ALPHABET) for _ in range(22))
+        password_hash = make_password(password, salt=salt)
+        self.user_joined = []
+
+        def generate():
+            for number in range(count):
+                date_joined = self.random_date()
+                self.user_joined.append(date_joined)
+                yield (
+                    f"user{number}@{GENERATED_EMAIL_DOMAIN}",
+                    password_hash,
+                    rng.choice(FIRST_NAMES),
+                    rng.choice(LAST_NAMES),
+                    f"+79{rng.randrange(10**9):09d}",
+                    rng.choice(CITIES),
+                    date_joined,
                 )
-            else:
-                self.stdout.write(f"   ⚠️  Урок уже существует: {lesson.name}")
-
-        self.stdout.write("✅ Тестовые уроки созданы")
 
-    def create_payments(self):
-        """Создание тестовых платежей"""
-        self.stdout.write("Создание тестовых платежей...")
-
-        users = User.objects.all()
-        courses = Course.objects.all()
-        lessons = Lesson.objects.all()
-
-        payment_methods = ["cash", "transfer"]
-        amounts = [
-            Decimal("1000.00"),
-            Decimal("2500.00"),
-            Decimal("5000.00"),
-            Decimal("7500.00"),
+        columns = [
+            "email",
+            "password",
+            "first_name",
+            "last_name",
+            "phone",
+            "city",
+            "date_joined",
         ]
-
-        payments_data = [
-            # Платежи user1
-            {
-                "user": users.get(email="user1@example.com"),
-                "paid_course": courses.get(name="Python для начинающих"),
-                "paid_lesson": None,
-                "amount": Decimal("5000.00"),
-                "payment_method": "transfer",
-            },
-            {
-                "user": users.get(email="user1@example.com"),
-                "paid_course": None,
-                "paid_lesson": lessons.get(name="Основы Django"),
-                "amount": Decimal("1000.00"),
-                "payment_method": "cash",
-            },
-            {
-                "user": users.get(email="user1@example.com"),
-                "paid_course": courses.get(name="JavaScript современный"),
-                "paid_lesson": None,
-                "amount": Decimal("6000.00"),
-                "payment_method": "transfer",
-            },
-            # Платежи user2
-            {
-                "user": users.get(email="user2@example.com"),
-                "paid_course": courses.get(name="Django Framework"),
-                "paid_lesson": None,
-                "amount": Decimal("7500.00"),
-                "payment_method": "transfer",
-            },
-            {
-                "user": users.get(email="user2@example.com"),
-                "paid_course": None,
-                "paid_lesson": lessons.get(name="JavaScript основы"),
-                "amount": Decimal("1500.00"),
-                "payment_method": "cash",
-            },
-            # Платежи moderator
-            {
-                "user": users.get(email="moderator@example.com"),
-                "paid_course": courses.get(name="Python для начинающих"),
-                "paid_lesson": None,
-                "amount": Decimal("5000.00"),
-                "payment_method": "transfer",
-            },
-            # Платежи admin
-            {
-                "user": users.get(email="admin@example.com"),
-                "paid_course": courses.get(name="Базы данных и SQL"),
-                "paid_lesson": None,
-                "amount": Decimal("4500.00"),
-                "payment_method": "transfer",
-            },
+        self.user_ids = self.write(User, columns, generate(), "Пользователи")
+        # Активность пользователей (подписки, платежи) - логнормальная
+        self.user_activity = [rng.lognormvariate(0, 1) for _ in self.user_ids]
+
+    def create_courses(self, owners_share, courses_per_owner):
+        rng = self.rng
+        owners = rng.sample(
+            range(len(self.user_ids)),
+            max(1, round(len(self.user_ids) * owners_share)),
+        )
+        self.owner_ids = {self.user_ids[index] for index in owners}
+        self.course_prices = []
+        self.course_created = []
+        self.course_owner_ids = array("q")
+
+        def generate():
+            number = 0
+            for index in owners:
+                # Геометрическое распределение: большинство авторов ведут
+                # один-два курса, немногие - десятки
+                courses = 1
+                if courses_per_owner > 1:
+                    courses += int(
+                        math.log(1 - rng.random()) / math.log(1 - 1 / courses_per_owner)
+                    )
+                for _ in range(courses):
+                    number += 1
+                    price = rng.choice(COURSE_PRICES)
+                    created_at = self.random_date(self.user_joined[index])
+                    self.course_prices.append(price)
+                    self.course_created.append(created_at)
+                    self.course_owner_ids.append(self.user_ids[index])
+                    topic = rng.choice(TOPICS)
+                    yield (
+                        f"{topic} {rng.choice(LEVELS)} #{number}",
+                        f"Курс по теме {topic}: теория и практика.",
+                        price,
+                        self.user_ids[index],
+                        created_at,
+                        created_at,
+                        created_at,
+                    )
+
+        columns = [
+            "name",
+            "description",
+            "price",
+            "owner",
+            "created_at",
+            "updated_at",
+            "content_updated_at",
         ]
+        self.course_ids = self.write(Course, columns, generate(), "Курсы")
+        # Популярность курсов - закон Ципфа в случайном порядке
+        ranks = list(range(1, len(self.course_ids) + 1))
+        rng.shuffle(ranks)
+        self.course_sampler = WeightedSampler(rng, [rank**-1.1 for rank in ranks])
+
+    def create_lessons(self, lessons_per_course):
+        rng = self.rng
+        # Логнормальное распределение со средним lessons_per_course
+        sigma = 0.6
+        mu = math.log(max(lessons_per_course, 1)) - sigma**2 / 2
+        self.lesson_prices = []
+        paid_positions = array("q")
+        free_price = Decimal(0)
+
+        def generate():
+            position = 0
+            courses = zip(self.course_ids, self.course_owner_ids, self.course_created)
+            for course_id, owner_id, created_at in courses:
+                lessons = max(1, round(rng.lognormvariate(mu, sigma)))
+                for number in range(1, lessons + 1):
+                    price = free_price
+                    if rng.random() < PAID_LESSON_SHARE:
+                        price = rng.choice(LESSON_PRICES)
+                        paid_positions.append(position)
+                        self.lesson_prices.append(price)
+                    position += 1
+                    lesson_created = self.random_date(created_at)
+                    yield (
+                        f"Урок {number}",
+                        "Разбор темы урока с примерами.",
+                        f"https://youtube.com/watch?v=l{position}",
+                        course_id,
+                        owner_id,
+                        price,
+                        lesson_created,
+                        lesson_created,
+                    )
+
+        columns = [
+            "name",
+            "description",
+            "video_link",
+            "course",
+            "owner",
+            "price",
+            "created_at",
+            "updated_at",
+        ]
+        lesson_ids = self.write(Lesson, columns, generate(), "Уроки")
+        self.paid_lesson_ids = array(
+            "q", (lesson_ids[position] for position in paid_positions)
+        )
 
-        # Случайные платежи для разнообразия
-        for i in range(10):
-            user = random.choice(list(users))
-            payment_method = random.choice(payment_methods)
-            amount = random.choice(amounts)
-
-            # Случайно выбираем оплату курса или урока
-            paid_course = None
-            paid_lesson = None
-
-            if random.choice([True, False]):
-                paid_course = random.choice(list(courses))
-            else:
-                paid_lesson = random.choice(list(lessons))
-
-            # Случайная дата в последние 30 дней
-            random_days = random.randint(0, 30)
-            payment_date = datetime.now() - timedelta(days=random_days)
-
-            payments_data.append(
-                {
-                    "user": user,
-                    "paid_course": paid_course,
-                    "paid_lesson": paid_lesson,
-                    "amount": amount,
-                    "payment_method": payment_method,
-                    "payment_date": payment_date
-                }
-            )
-
-        for payment_data in payments_data:
-            payment = Payment.objects.create(**payment_data)
-            self.stdout.write(
-                f"   ✅ Создан платеж: {payment.amount} руб. - {payment.user.email}"
-            )
-
-        self.stdout.write("✅ Тестовые платежи созданы")
+    def create_subscriptions(self, total):
+        courses = len(self.course_sampler)
+
+        def generate():
+            counts = self.split_total(total, self.user_activity)
+            for user_id, joined, count in zip(self.user_ids, self.user_joined, counts):
+                # Повторная подписка на тот же курс не создается
+                for index in {
+                    self.course_sampler.sample() for _ in range(min(count, courses))
+                }:
+                    yield (
+                        user_id,
+                        self.course_ids[index],
+                        self.random_date(max(joined, self.course_created[index])),
+                    )
+
+        columns = ["user", "course", "subscribed_at"]
+        self.write(Subscription, columns, generate(), "Подписки")
+
+    def create_payments(self, total):
+        rng = self.rng
+        statuses, status_weights = PAYMENT_STATUSES
+        methods, method_weights = PAYMENT_METHODS
+        status_cum = list(accumulate(status_weights))
+        method_cum = list(accumulate(method_weights))
+
+        def generate():
+            counts = self.split_total(total, self.user_activity)
+            for user_id, joined, count in zip(self.user_ids, self.user_joined, counts):
+                for _ in range(count):
+                    status = rng.choices(statuses, cum_weights=status_cum)[0]
+                    method = rng.choices(methods, cum_weights=method_cum)[0]
+                    course_id = lesson_id = session_id = intent_id = None
+                    checkout_url = checkout_expires_at = None
+                    if rng.random() < COURSE_PAYMENT_SHARE or not self.paid_lesson_ids:
+                        index = self.course_sampler.sample()
+                        course_id = self.course_ids[index]
+                        amount = self.course_prices[index]
+                        start = max(joined, self.course_created[index])
+                    else:
+                        index = rng.randrange(len(self.paid_lesson_ids))
+                        lesson_id = self.paid_lesson_ids[index]
+                        amount = self.lesson_prices[index]
+                        start = joined
+                    if method == "stripe":
+                        session_id = f"cs_test_{rng.getrandbits(64):016x}"
+                        if status == "succeeded":
+                            intent_id = f"pi_test_{rng.getrandbits(64):016x}"
+                    payment_date = self.random_date(start)
+                    if session_id and status == "pending":
+                        checkout_url = f"https://checkout.stripe.com/c/pay/{session_id}"
+                        checkout_expires_at = payment_date + CHECKOUT_SESSION_LIFETIME
+                    yield (
+                        user_id,
+                        course_id,
+                        lesson_id,
+                        amount,
+                        method,
+                        status,
+                        payment_date,
+                        session_id,
+                        intent_id,
+                        checkout_url,
+                        checkout_expires_at,
+                    )
+
+        columns = [
+            "user",
+            "paid_course",
+            "paid_lesson",
+            "amount",
+            "payment_method",
+            "status",
+            "payment_date",
+            "stripe_session_id",
+            "stripe_payment_intent_id",
+            "checkout_url",
+            "checkout_expires_at",
+        ]
+        self.write(Payment, columns, generate(), "Платежи")
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0006_avatar_variants"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="checkout_expires_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="Ссылка на оплату действует до"
+            ),
+        ),
+        migrations.AddField(
+            model_name="payment",
+            name="checkout_url",
+            field=models.URLField(
+                blank=True,
+                max_length=2048,
+                null=True,
+                verbose_name="Ссылка на оплату в Stripe",
+            ),
+        ),
+    ]
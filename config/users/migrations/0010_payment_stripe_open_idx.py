@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("materials", "0010_import_checkpoint"),
+        ("users", "0009_stripe_event"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(
+                    ("payment_method", "stripe"),
+                    ("status__in", ["pending", "processing"]),
+                ),
+                fields=["id"],
+                name="users_payment_stripe_open_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0010_payment_stripe_open_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="checkout_attempt",
+            field=models.PositiveIntegerField(
+                default=0, verbose_name="Попытка создания сессии Stripe"
+            ),
+        ),
+        migrations.AddField(
+            model_name="payment",
+            name="checkout_started_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="Сессия Stripe создается с"
+            ),
+        ),
+    ]
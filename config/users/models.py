@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.db import models
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 
 
 class UserManager(BaseUserManager):
@@ -29,6 +30,10 @@ class User(AbstractUser):
     avatar = models.ImageField(
         upload_to="users/avatars/", blank=True, null=True, verbose_name="Аватарка"
     )
+    # Уменьшенные варианты аватарки (materials.thumbnails), строятся в фоне
+    avatar_variants = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Варианты аватарки"
+    )
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = []
@@ -41,6 +46,10 @@ class User(AbstractUser):
     class Meta:
         verbose_name = "Пользователь"
         verbose_name_plural = "Пользователи"
+        indexes = [
+            # Курсорная пагинация по (date_joined, id)
+            models.Index(fields=["date_joined", "id"]),
+        ]
 
 
 class Payment(models.Model):
@@ -116,6 +125,26 @@ class Payment(models.Model):
         max_length=255, blank=True, null=True, verbose_name="ID платежа в Stripe"
     )
 
+    # Ссылка на оплату сохраняется при создании сессии Stripe, чтобы ответы
+    # API не запрашивали сессию у Stripe
+    checkout_url = models.URLField(
+        max_length=2048, blank=True, null=True, verbose_name="Ссылка на оплату в Stripe"
+    )
+
+    checkout_expires_at = models.DateTimeField(
+        blank=True, null=True, verbose_name="Ссылка на оплату действует до"
+    )
+
+    # Создание сессии Stripe: номер попытки входит в ключ идемпотентности,
+    # отметка времени не дает параллельному запросу начать вторую попытку
+    checkout_attempt = models.PositiveIntegerField(
+        default=0, verbose_name="Попытка создания сессии Stripe"
+    )
+
+    checkout_started_at = models.DateTimeField(
+        blank=True, null=True, verbose_name="Сессия Stripe создается с"
+    )
+
     def __str__(self):
         if self.paid_course:
             return f"Оплата курса {self.paid_course.name} - {self.user.email}"
@@ -123,6 +152,19 @@ class Payment(models.Model):
             return f"Оплата урока {self.paid_lesson.name} - {self.user.email}"
         return f"Оплата #{self.id} - {self.user.email}"
 
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        # Состояние, запомненное при загрузке (materials.signals), устарело
+        self._loaded_state = None
+
+    def get_active_checkout_url(self):
+        """Сохраненная ссылка на оплату, если платеж ожидает оплаты и она не истекла"""
+        if self.status != "pending" or not self.checkout_url:
+            return None
+        if self.checkout_expires_at and self.checkout_expires_at <= timezone.now():
+            return None
+        return self.checkout_url
+
     def clean(self):
         if not self.paid_course and not self.paid_lesson:
             raise ValidationError("Должен быть указан либо курс, либо урок")
@@ -135,6 +177,18 @@ class Payment(models.Model):
         verbose_name = "Платеж"
         verbose_name_plural = "Платежи"
         ordering = ["-payment_date"]
+        indexes = [
+            # Курсорная пагинация по (payment_date, id)
+            models.Index(fields=["payment_date", "id"]),
+            # Сверка со Stripe: неоплаченные платежи Stripe по id
+            models.Index(
+                fields=["id"],
+                name="users_payment_stripe_open_idx",
+                condition=models.Q(
+                    payment_method="stripe", status__in=["pending", "processing"]
+                ),
+            ),
+        ]
 
 
 class Subscription(models.Model):
@@ -167,3 +221,97 @@ class Subscription(models.Model):
 
     def __str__(self):
         return f"{self.user.email} подписан на {self.course.name}"
+
+
+class StripeProduct(models.Model):
+    """
+    Продукт Stripe курса или урока. Переиспользуется для всех покупок,
+    пока не изменились название и описание
+    """
+
+    course = models.OneToOneField(
+        "materials.Course",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name="Курс",
+        related_name="stripe_product",
+    )
+
+    lesson = models.OneToOneField(
+        "materials.Lesson",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name="Урок",
+        related_name="stripe_product",
+    )
+
+    product_id = models.CharField(max_length=255, verbose_name="ID продукта в Stripe")
+
+    # Название и описание, с которыми создан продукт
+    name = models.CharField(max_length=255, verbose_name="Название")
+    description = models.TextField(blank=True, null=True, verbose_name="Описание")
+
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+
+    class Meta:
+        verbose_name = "Продукт Stripe"
+        verbose_name_plural = "Продукты Stripe"
+
+    def __str__(self):
+        return f"{self.product_id} ({self.name})"
+
+
+class StripePrice(models.Model):
+    """Цена Stripe продукта для одной суммы (цены в Stripe неизменяемы)"""
+
+    product = models.ForeignKey(
+        StripeProduct,
+        on_delete=models.CASCADE,
+        verbose_name="Продукт",
+        related_name="prices",
+    )
+
+    amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Сумма")
+
+    currency = models.CharField(max_length=3, default="rub", verbose_name="Валюта")
+
+    price_id = models.CharField(max_length=255, verbose_name="ID цены в Stripe")
+
+    class Meta:
+        verbose_name = "Цена Stripe"
+        verbose_name_plural = "Цены Stripe"
+        unique_together = ["product", "amount", "currency"]
+
+    def __str__(self):
+        return f"{self.price_id} ({self.amount} {self.currency})"
+
+
+class StripeEvent(models.Model):
+    """
+    Событие вебхука Stripe. Уникальный event_id отсекает повторные
+    доставки одного события; processed_at заполняет задача
+    process_stripe_event после применения события к платежу
+    """
+
+    event_id = models.CharField(
+        max_length=255, unique=True, verbose_name="ID события в Stripe"
+    )
+
+    type = models.CharField(max_length=100, verbose_name="Тип события")
+
+    payload = models.JSONField(verbose_name="Данные события")
+
+    received_at = models.DateTimeField(auto_now_add=True, verbose_name="Получено")
+
+    processed_at = models.DateTimeField(
+        blank=True, null=True, verbose_name="Обработано"
+    )
+
+    class Meta:
+        verbose_name = "Событие Stripe"
+        verbose_name_plural = "События Stripe"
+
+    def __str__(self):
+        return f"{self.event_id} ({self.type})"
@@ -1,5 +1,7 @@
 from rest_framework.permissions import BasePermission
 
+from users.principal import get_principal
+
 
 class IsOwner(BasePermission):
     """
@@ -7,9 +9,9 @@ class IsOwner(BasePermission):
     """
 
     def has_object_permission(self, request, view, obj):
-        # Проверяем владельца через поле owner
-        if hasattr(obj, "owner"):
-            return obj.owner == request.user
+        # Проверяем владельца по owner_id, не загружая пользователя
+        if hasattr(obj, "owner_id"):
+            return get_principal(request).owns(obj)
 
         return False
 
@@ -20,10 +22,8 @@ class IsModerator(BasePermission):
     """
 
     def has_permission(self, request, view):
-        return (
-            request.user.is_authenticated
-            and request.user.groups.filter(name="moderators").exists()
-        )
+        principal = get_principal(request)
+        return principal.is_authenticated and principal.is_moderator
 
 
 class IsOwnerOrModerator(BasePermission):
@@ -36,17 +36,33 @@ class IsOwnerOrModerator(BasePermission):
         return request.user.is_authenticated
 
     def has_object_permission(self, request, view, obj):
+        principal = get_principal(request)
+
         # Модераторы могут читать и редактировать любые объекты
-        if request.user.groups.filter(name="moderators").exists():
+        if principal.is_moderator:
             return True
 
         # Владелец может делать все со своим объектом
-        if hasattr(obj, "owner"):
-            return obj.owner == request.user
+        if hasattr(obj, "owner_id"):
+            return principal.owns(obj)
 
         return False
 
 
+class IsPayerOrModerator(BasePermission):
+    """
+    Разрешает просмотр платежа плательщику или модератору.
+    Плательщик не считается владельцем (owner_id) и не проходит IsOwner
+    """
+
+    def has_permission(self, request, view):
+        return request.user.is_authenticated
+
+    def has_object_permission(self, request, view, obj):
+        principal = get_principal(request)
+        return principal.is_moderator or principal.owns(obj, field="user")
+
+
 class IsOwnerOrModeratorForCreate(BasePermission):
     """
     Разрешает создание объектов только владельцам (не модераторам).
@@ -57,7 +73,7 @@ class IsOwnerOrModeratorForCreate(BasePermission):
             return False
 
         # Модераторы не могут создавать объекты
-        if request.user.groups.filter(name="moderators").exists():
+        if get_principal(request).is_moderator:
             return False
 
         return True
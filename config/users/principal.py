@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.core.cache import cache
+
+MODERATORS_GROUP = "moderators"
+
+ROLES_CACHE_VERSION_KEY = "users:roles:version"
+
+
+class Principal:
+    """
+    Субъект запроса: пользователь и его роли, вычисленные один раз за запрос.
+
+    Роли (имена групп) читаются из БД одним запросом и дополнительно
+    кешируются между запросами на PRINCIPAL_ROLES_CACHE_TIMEOUT секунд.
+    Кеш сбрасывается сигналами при изменении групп (см. users.signals).
+    """
+
+    def __init__(self, user, roles=frozenset()):
+        self.user = user
+        self.user_id = user.pk if user.is_authenticated else None
+        self.is_authenticated = user.is_authenticated
+        self.is_staff = user.is_authenticated and user.is_staff
+        self.roles = frozenset(roles)
+
+    @property
+    def is_moderator(self):
+        return MODERATORS_GROUP in self.roles
+
+    def owns(self, obj, field="owner"):
+        """Проверка владения по id внешнего ключа, без загрузки владельца"""
+        return self.is_authenticated and getattr(obj, f"{field}_id") == self.user_id
+
+    def __repr__(self):
+        return f"<Principal user_id={self.user_id} roles={sorted(self.roles)}>"
+
+
+def get_roles_cache_key(user_id):
+    version = cache.get_or_set(ROLES_CACHE_VERSION_KEY, 1, timeout=None)
+    return f"users:roles:v{version}:{user_id}"
+
+
+def load_roles(user):
+    """Имена групп пользователя: из кеша или одним запросом к БД"""
+    timeout = settings.PRINCIPAL_ROLES_CACHE_TIMEOUT
+    if not timeout:
+        return frozenset(user.groups.values_list("name", flat=True))
+
+    key = get_roles_cache_key(user.pk)
+    roles = cache.get(key)
+    if roles is None:
+        roles = list(user.groups.values_list("name", flat=True))
+        cache.set(key, roles, timeout)
+    return frozenset(roles)
+
+
+def get_principal(request):
+    """
+    Principal текущего запроса. Сохраняется на HttpRequest, поэтому
+    разрешения, get_queryset и сериализаторы получают один и тот же объект.
+    """
+    http_request = getattr(request, "_request", request)
+    user = request.user
+    principal = getattr(http_request, "principal", None)
+    if principal is None or principal.user is not user:
+        roles = load_roles(user) if user.is_authenticated else ()
+        principal = Principal(user, roles)
+        http_request.principal = principal
+    return principal
+
+
+def invalidate_roles(user_ids=None):
+    """
+    Сброс кеша ролей: для указанных пользователей или для всех сразу
+    (сменой версии ключей)
+    """
+    if user_ids is None:
+        try:
+            cache.incr(ROLES_CACHE_VERSION_KEY)
+        except ValueError:
+            cache.set(ROLES_CACHE_VERSION_KEY, 1, timeout=None)
+        return
+    cache.delete_many([get_roles_cache_key(user_id) for user_id in user_ids])
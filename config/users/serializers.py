@@ -4,9 +4,10 @@ from users.models import Payment, User
 
 from users.models import Subscription
 
-from materials.serializers import CourseSerializer
+from materials.serializers import CourseSerializer, ImageVariantsField
 
 from users.services import StripeService
+from users.stripe_gateway import StripeGatewayError
 
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -31,9 +32,19 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
 
 
 class UserSerializer(serializers.ModelSerializer):
+    avatar_variants = ImageVariantsField("avatar")
+
     class Meta:
         model = User
-        fields = ["id", "email", "phone", "city", "avatar", "date_joined"]
+        fields = [
+            "id",
+            "email",
+            "phone",
+            "city",
+            "avatar",
+            "avatar_variants",
+            "date_joined",
+        ]
         read_only_fields = ["id", "date_joined"]
 
 
@@ -46,7 +57,8 @@ class UserDetailSerializer(UserSerializer):
     def get_payments(self, obj):
         from users.serializers import PaymentSerializer
 
-        payments = obj.payments.all()[:5]
+        # Курс, урок и пользователь - в том же запросе, что и платежи
+        payments = obj.payments.select_related("user", "paid_course", "paid_lesson")[:5]
         return PaymentSerializer(payments, many=True).data
 
 
@@ -77,15 +89,11 @@ class PaymentSerializer(serializers.ModelSerializer):
 
     def get_checkout_url(self, obj):
         """
-        Возвращает URL для оплаты через Stripe
+        Возвращает URL для оплаты через Stripe. Ссылка сохраняется при
+        создании сессии, запроса к Stripe нет; истекшую ссылку заменяет
+        действие payments/{id}/checkout/
         """
-        if obj.stripe_session_id and obj.status == "pending":
-            try:
-                session = StripeService.retrieve_session(obj.stripe_session_id)
-                return session.url
-            except Exception:
-                return None
-        return None
+        return obj.get_active_checkout_url()
 
     def create(self, validated_data):
         """
@@ -97,14 +105,12 @@ class PaymentSerializer(serializers.ModelSerializer):
         # Если это оплата через Stripe, создаем сессию
         if payment.payment_method == "stripe":
             try:
-                session = StripeService.create_payment_for_course_or_lesson(payment)
-                payment.stripe_session_id = session.id
-                payment.save()
-                # URL для оплаты будет доступен через get_checkout_url
-            except Exception as e:
+                # Сессия и ссылка на оплату сохраняются в платеже одним UPDATE
+                StripeService.create_payment_for_course_or_lesson(payment)
+            except (StripeGatewayError, ValueError) as e:
                 # Если ошибка при создании сессии, обновляем статус
                 payment.status = "failed"
-                payment.save()
+                payment.save(update_fields=["status"])
                 raise serializers.ValidationError(
                     f"Ошибка создания платежа в Stripe: {str(e)}"
                 )
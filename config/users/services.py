@@ -1,12 +1,269 @@
+import time
+from datetime import datetime, timedelta, timezone
+
 import stripe
 from django.conf import settings
+from django.db import transaction
+
+from users.models import Payment, StripePrice, StripeProduct
+from users.stripe_gateway import (
+    StripeGatewayError,
+    StripeUnavailableError,
+    get_stripe_gateway,
+)
+
+# Поля платежа, которые записывает create_payment_for_course_or_lesson
+CHECKOUT_FIELDS = [
+    "stripe_product_id",
+    "stripe_price_id",
+    "stripe_session_id",
+    "checkout_url",
+    "checkout_expires_at",
+    "checkout_started_at",
+    "payment_method",
+    "status",
+]
+
+# Сколько действует отметка о начатом создании сессии: дольше всех попыток
+# шлюза. Отметку старше этого срока оставил упавший процесс
+CHECKOUT_CLAIM_TIMEOUT = timedelta(minutes=2)
+
+
+class CheckoutInProgressError(Exception):
+    """Сессию оплаты платежа уже создает параллельный запрос"""
+
+
+def store_checkout_session(payment, session):
+    """
+    Переносит ссылку на оплату и срок ее действия из сессии Stripe в платеж
+    (без сохранения); True, если они изменились
+    """
+    expires_at = getattr(session, "expires_at", None)
+    if expires_at is not None:
+        expires_at = datetime.fromtimestamp(expires_at, tz=timezone.utc)
+    if (payment.checkout_url, payment.checkout_expires_at) == (session.url, expires_at):
+        return False
+    payment.checkout_url = session.url
+    payment.checkout_expires_at = expires_at
+    return True
+
+
+# Срок действия сессии Stripe Checkout по умолчанию
+CHECKOUT_SESSION_LIFETIME = timedelta(hours=24)
+
+# Запас окна created при поиске сессий пачки платежей: расхождение часов
+# и время между созданием сессии и сохранением платежа
+RECONCILE_WINDOW_SKEW = timedelta(minutes=5)
+
+# Предел страниц списка сессий на пачку: окно created может оказаться
+# плотным (чужие сессии того же аккаунта), тогда оставшиеся сессии пачки
+# запрашиваются по одной
+RECONCILE_MAX_PAGES = 5
+
+# События вебхука, которые меняют платежи; остальные типы не сохраняются
+STRIPE_WEBHOOK_EVENTS = {
+    "checkout.session.completed",
+    "checkout.session.async_payment_succeeded",
+    "checkout.session.async_payment_failed",
+    "checkout.session.expired",
+}
+
+# Статусы, из которых событие Stripe может перевести платеж: повторные и
+# запоздавшие события не откатывают завершенную оплату
+STRIPE_UPDATABLE_STATUSES = ("pending", "processing")
+
+
+def apply_stripe_event(event_type, session):
+    """
+    Применяет событие сессии оплаты к платежу с этой сессией. Платеж
+    блокируется до конца транзакции; завершенные платежи не меняются.
+    Возвращает платеж или None, если событие его не изменило.
+
+    Платеж, у которого сессию уже заменила новая, находится по
+    metadata.payment_id: оплата по прежней ссылке все равно засчитывается,
+    а истечение прежней сессии новую не отменяет
+    """
+    payments = Payment.objects.select_for_update().filter(
+        status__in=STRIPE_UPDATABLE_STATUSES
+    )
+    payment = payments.filter(stripe_session_id=session.id).first()
+    if payment is None and event_type != "checkout.session.expired":
+        metadata = getattr(session, "metadata", None) or {}
+        payment_id = metadata["payment_id"] if "payment_id" in metadata else None
+        if payment_id and str(payment_id).isdigit():
+            payment = payments.filter(
+                pk=int(payment_id), payment_method="stripe"
+            ).first()
+        if payment is not None:
+            payment.stripe_session_id = session.id
+    if payment is None:
+        return None
+
+    if event_type == "checkout.session.expired":
+        # Истекает и сессия оплачиваемого платежа (processing) - он ждет
+        # async_payment_*
+        if payment.status != "pending":
+            return None
+        payment.status = "canceled"
+        payment.checkout_url = None
+        payment.checkout_expires_at = None
+    elif event_type == "checkout.session.async_payment_failed":
+        payment.status = "failed"
+    elif event_type == "checkout.session.async_payment_succeeded" or (
+        session.payment_status in ("paid", "no_payment_required")
+    ):
+        payment.status = "succeeded"
+        payment.stripe_payment_intent_id = session.payment_intent
+    else:
+        # checkout.session.completed без оплаты: способ оплаты с
+        # подтверждением позже (банковский перевод и т.п.)
+        if payment.status == "processing":
+            return None
+        payment.status = "processing"
+
+    payment.save(
+        update_fields=[
+            "status",
+            "stripe_session_id",
+            "stripe_payment_intent_id",
+            "checkout_url",
+            "checkout_expires_at",
+        ]
+    )
+    return payment
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+
+def get_session_created_at(payment):
+    """Примерное время создания текущей сессии оплаты платежа"""
+    if payment.checkout_expires_at:
+        return payment.checkout_expires_at - CHECKOUT_SESSION_LIFETIME
+    return payment.payment_date
+
+
+def get_reconcile_event(session):
+    """Событие вебхука, которому соответствует состояние сессии, или None"""
+    if session.status == "complete":
+        return "checkout.session.completed"
+    if session.status == "expired":
+        return "checkout.session.expired"
+    return None
+
+
+def reconcile_payment_batch(payments):
+    """
+    Сверка пачки платежей, ожидающих оплаты через Stripe, с их сессиями.
+
+    Сессии Stripe ищутся не по одной, а страницами списка (до 100 за
+    запрос) в окне created, которое покрывает сессии пачки. Платежи
+    пачки идут по id, поэтому окно обычно узкое; страниц читается не
+    больше RECONCILE_MAX_PAGES, не найденные в них сессии запрашиваются
+    по id. Завершенная сессия применяется к платежу как
+    checkout.session.completed, истекшая - как checkout.session.expired
+    (платеж отменяется). Возвращает счетчики {"requests", "found",
+    "retrieved", "changed", статусы измененных платежей}
+    """
+    session_ids = {payment.stripe_session_id for payment in payments}
+    created = [get_session_created_at(payment) for payment in payments]
+    params = {
+        "limit": 100,
+        "created": {
+            "gte": int((min(created) - RECONCILE_WINDOW_SKEW).timestamp()),
+            "lte": int((max(created) + RECONCILE_WINDOW_SKEW).timestamp()),
+        },
+    }
+    stats = {"requests": 0, "found": 0, "retrieved": 0, "changed": 0}
+    sessions = {}
+    for _ in range(RECONCILE_MAX_PAGES):
+        page = StripeService.list_sessions(params)
+        stats["requests"] += 1
+        for session in page.data:
+            if session.id in session_ids:
+                sessions[session.id] = session
+        if not page.has_more or len(sessions) == len(session_ids):
+            break
+        params["starting_after"] = page.data[-1].id
+
+    # Сессии вне прочитанных страниц: окно не покрыло их или страниц
+    # больше предела
+    for session_id in sorted(session_ids - sessions.keys()):
+        stats["requests"] += 1
+        try:
+            session = StripeService.retrieve_session(session_id)
+        except StripeUnavailableError:
+            raise
+        except StripeGatewayError:
+            # Сессии нет в Stripe (другой аккаунт, ключ сменился):
+            # платеж останется ждать вебхука
+            continue
+        sessions[session.id] = session
+        stats["retrieved"] += 1
+
+    stats["found"] = len(sessions)
+    for session in sessions.values():
+        event_type = get_reconcile_event(session)
+        if event_type is None:
+            continue
+        with transaction.atomic():
+            payment = apply_stripe_event(event_type, session)
+        if payment is not None:
+            stats["changed"] += 1
+            stats[payment.status] = stats.get(payment.status, 0) + 1
+    return stats
+
+
+def reconcile_stripe_payments(batch_size, min_age):
+    """
+    Сверка со Stripe всех платежей, которые ждут оплаты (pending или
+    processing) дольше min_age: пачками по batch_size по возрастанию id.
+    Недоступность Stripe прерывает сверку, уже сверенные пачки остаются.
+    Возвращает счетчики по всем пачкам, длительность и пропускную
+    способность (платежей в секунду)
+    """
+    started = time.perf_counter()
+    queryset = Payment.objects.filter(
+        payment_method="stripe",
+        status__in=STRIPE_UPDATABLE_STATUSES,
+        stripe_session_id__isnull=False,
+        payment_date__lt=datetime.now(timezone.utc) - min_age,
+    ).order_by("id")
+    totals = {
+        "payments": 0,
+        "batches": 0,
+        "requests": 0,
+        "found": 0,
+        "retrieved": 0,
+        "changed": 0,
+    }
+    last_id = 0
+    error = None
+    while True:
+        batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        try:
+            stats = reconcile_payment_batch(batch)
+        except StripeGatewayError as e:
+            error = str(e)
+            break
+        totals["payments"] += len(batch)
+        totals["batches"] += 1
+        for key, value in stats.items():
+            totals[key] = totals.get(key, 0) + value
+        last_id = batch[-1].id
+
+    elapsed = time.perf_counter() - started
+    totals["seconds"] = round(elapsed, 3)
+    totals["payments_per_second"] = (
+        round(totals["payments"] / elapsed, 1) if elapsed else 0.0
+    )
+    totals["error"] = error
+    return totals
 
 
 class StripeService:
     """
-    Сервис для работы с Stripe API
+    Сервис для работы с Stripe API через общий шлюз процесса
+    (get_stripe_gateway). Ошибки Stripe - StripeGatewayError
     """
 
     @staticmethod
@@ -14,11 +271,10 @@ class StripeService:
         """
         Создание продукта в Stripe
         """
-        try:
-            product = stripe.Product.create(name=name, description=description)
-            return product
-        except stripe.error.StripeError as e:
-            raise Exception(f"Ошибка создания продукта в Stripe: {str(e)}")
+        params = {"name": name}
+        if description:
+            params["description"] = description
+        return get_stripe_gateway().create_product(params)
 
     @staticmethod
     def create_price(product_id, amount, currency="rub"):
@@ -26,57 +282,166 @@ class StripeService:
         Создание цены в Stripe
         amount: сумма в рублях (будет преобразована в копейки)
         """
+        return get_stripe_gateway().create_price(
+            {
+                "product": product_id,
+                "unit_amount": int(amount * 100),
+                "currency": currency,
+            }
+        )
+
+    @staticmethod
+    def create_checkout_session(
+        price_id, success_url, cancel_url, metadata=None, idempotency_key=None
+    ):
+        """
+        Создание сессии для оплаты
+        """
+        return get_stripe_gateway().create_checkout_session(
+            {
+                "payment_method_types": ["card"],
+                "line_items": [{"price": price_id, "quantity": 1}],
+                "mode": "payment",
+                "success_url": success_url,
+                "cancel_url": cancel_url,
+                "metadata": metadata or {},
+            },
+            idempotency_key=idempotency_key,
+        )
+
+    @staticmethod
+    def retrieve_session(session_id):
+        """
+        Получение информации о сессии
+        """
+        return get_stripe_gateway().retrieve_session(session_id)
+
+    @staticmethod
+    def list_sessions(params):
+        """
+        Страница списка сессий оплаты (limit, created, starting_after)
+        """
+        return get_stripe_gateway().list_sessions(params)
+
+    @staticmethod
+    def construct_webhook_event(payload, signature):
+        """
+        Событие вебхука из тела запроса с проверкой заголовка
+        Stripe-Signature секретом STRIPE_WEBHOOK_SECRET. ValueError, если
+        секрет не задан, подпись не сходится или тело не JSON
+        """
+        if not settings.STRIPE_WEBHOOK_SECRET:
+            raise ValueError("Не задан STRIPE_WEBHOOK_SECRET")
         try:
-            # Преобразуем рубли в копейки
-            amount_in_cents = int(amount * 100)
+            return stripe.Webhook.construct_event(
+                payload, signature, settings.STRIPE_WEBHOOK_SECRET
+            )
+        except stripe.error.SignatureVerificationError as e:
+            raise ValueError(f"Неверная подпись события Stripe: {str(e)}")
+
+    @staticmethod
+    def get_catalog_price(item_type, item, amount, currency="rub"):
+        """
+        ID продукта и цены Stripe для курса или урока item и суммы amount.
+        Продукт создается заново, только если изменились название или
+        описание item, цена - только для новой суммы; иначе запросов к
+        Stripe нет
+        """
+        product = StripeProduct.objects.filter(**{item_type: item}).first()
+        price = None
+        if product is None or (product.name, product.description) != (
+            item.name,
+            item.description,
+        ):
+            stripe_product = StripeService.create_product(
+                name=item.name, description=item.description
+            )
+            if product is None:
+                product, _ = StripeProduct.objects.get_or_create(
+                    **{item_type: item},
+                    defaults={
+                        "product_id": stripe_product.id,
+                        "name": item.name,
+                        "description": item.description,
+                    },
+                )
+            else:
+                # Цены старого продукта к новому не подходят
+                product.prices.all().delete()
+                product.product_id = stripe_product.id
+                product.name = item.name
+                product.description = item.description
+                product.save(update_fields=["product_id", "name", "description"])
+        else:
+            price = product.prices.filter(amount=amount, currency=currency).first()
 
-            price = stripe.Price.create(
-                product=product_id,
-                unit_amount=amount_in_cents,
+        if price is None:
+            stripe_price = StripeService.create_price(
+                product_id=product.product_id, amount=amount, currency=currency
+            )
+            # При параллельной покупке используется уже сохраненная цена
+            price, _ = StripePrice.objects.get_or_create(
+                product=product,
+                amount=amount,
                 currency=currency,
+                defaults={"price_id": stripe_price.id},
             )
-            return price
-        except stripe.error.StripeError as e:
-            raise Exception(f"Ошибка создания цены в Stripe: {str(e)}")
+        return product.product_id, price.price_id
 
     @staticmethod
-    def create_checkout_session(price_id, success_url, cancel_url, metadata=None):
+    def claim_checkout(payment_id):
         """
-        Создание сессии для оплаты
+        Короткая транзакция: платеж блокируется только на время проверки и
+        отметки checkout_started_at с новым номером попытки. Запросы к
+        Stripe выполняются после фиксации, без блокировки строки.
+        Возвращает платеж: с действующей ссылкой (сессия не нужна) или
+        отмеченный для создания сессии. CheckoutInProgressError - сессию
+        уже создает другой запрос; ValueError - платеж не ожидает оплаты
         """
-        try:
-            session = stripe.checkout.Session.create(
-                payment_method_types=["card"],
-                line_items=[
-                    {
-                        "price": price_id,
-                        "quantity": 1,
-                    }
-                ],
-                mode="payment",
-                success_url=success_url,
-                cancel_url=cancel_url,
-                metadata=metadata or {},
+        with transaction.atomic():
+            payment = (
+                Payment.objects.select_for_update(of=("self",))
+                .select_related("paid_course", "paid_lesson")
+                .get(pk=payment_id)
             )
-            return session
-        except stripe.error.StripeError as e:
-            raise Exception(f"Ошибка создания сессии в Stripe: {str(e)}")
+            if payment.payment_method != "stripe" or payment.status not in (
+                "pending",
+                "canceled",
+            ):
+                raise ValueError("Платеж не ожидает оплаты через Stripe")
+            if payment.get_active_checkout_url() is not None:
+                return payment
+            now = datetime.now(timezone.utc)
+            if (
+                payment.checkout_started_at is not None
+                and now - payment.checkout_started_at < CHECKOUT_CLAIM_TIMEOUT
+            ):
+                raise CheckoutInProgressError("Ссылка на оплату уже создается")
+            payment.checkout_attempt += 1
+            payment.checkout_started_at = now
+            payment.save(update_fields=["checkout_attempt", "checkout_started_at"])
+        return payment
 
     @staticmethod
-    def retrieve_session(session_id):
+    def get_checkout_idempotency_key(payment):
         """
-        Получение информации о сессии
+        Ключ идемпотентности сессии: платеж и попытка. Дата платежа отличает
+        платежи с тем же id после пересоздания БД на одном аккаунте Stripe
         """
-        try:
-            session = stripe.checkout.Session.retrieve(session_id)
-            return session
-        except stripe.error.StripeError as e:
-            raise Exception(f"Ошибка получения сессии из Stripe: {str(e)}")
+        return (
+            f"checkout-{payment.pk}-{int(payment.payment_date.timestamp())}"
+            f"-{payment.checkout_attempt}"
+        )
 
     @staticmethod
     def create_payment_for_course_or_lesson(payment_instance):
         """
-        Создание платежа в Stripe для курса или урока
+        Создание сессии оплаты в Stripe для курса или урока. Продукт и цена
+        берутся из каталога (get_catalog_price), поэтому обычно это один
+        запрос к Stripe. Запросы к Stripe выполняются вне транзакции; платеж
+        сохраняется в короткой транзакции, только если за это время его не
+        отметил для новой попытки другой запрос (см. claim_checkout).
+        При ошибке Stripe отметка о создании снимается
         """
         if payment_instance.paid_course:
             item = payment_instance.paid_course
@@ -85,40 +450,54 @@ class StripeService:
             item = payment_instance.paid_lesson
             item_type = "lesson"
         else:
-            raise Exception("Не указан курс или урок для оплаты")
+            raise ValueError("Не указан курс или урок для оплаты")
 
-        # Создаем продукт
-        product = StripeService.create_product(
-            name=item.name, description=item.description
-        )
+        attempt = payment_instance.checkout_attempt
+        try:
+            product_id, price_id = StripeService.get_catalog_price(
+                item_type, item, payment_instance.amount
+            )
 
-        # Создаем цену
-        price = StripeService.create_price(
-            product_id=product.id, amount=payment_instance.amount
-        )
+            # Создаем сессию для оплаты
+            success_url = f"{settings.DOMAIN}/api/users/payments/success/?session_id={{CHECKOUT_SESSION_ID}}"
+            cancel_url = f"{settings.DOMAIN}/api/users/payments/cancel/"
 
-        # Создаем сессию для оплаты
-        success_url = f"{settings.DOMAIN}/api/users/payments/success/?session_id={{CHECKOUT_SESSION_ID}}"
-        cancel_url = f"{settings.DOMAIN}/api/users/payments/cancel/"
-
-        session = StripeService.create_checkout_session(
-            price_id=price.id,
-            success_url=success_url,
-            cancel_url=cancel_url,
-            metadata={
-                "payment_id": str(payment_instance.id),
-                "item_type": item_type,
-                "item_id": str(item.id),
-                "user_id": str(payment_instance.user.id),
-            },
-        )
+            session = StripeService.create_checkout_session(
+                price_id=price_id,
+                success_url=success_url,
+                cancel_url=cancel_url,
+                metadata={
+                    "payment_id": str(payment_instance.id),
+                    "item_type": item_type,
+                    "item_id": str(item.id),
+                    "user_id": str(payment_instance.user_id),
+                },
+                idempotency_key=StripeService.get_checkout_idempotency_key(
+                    payment_instance
+                ),
+            )
+        except StripeGatewayError:
+            Payment.objects.filter(
+                pk=payment_instance.pk, checkout_attempt=attempt
+            ).update(checkout_started_at=None)
+            payment_instance.checkout_started_at = None
+            raise
 
         # Обновляем платеж данными из Stripe
-        payment_instance.stripe_product_id = product.id
-        payment_instance.stripe_price_id = price.id
+        payment_instance.stripe_product_id = product_id
+        payment_instance.stripe_price_id = price_id
         payment_instance.stripe_session_id = session.id
+        store_checkout_session(payment_instance, session)
+        payment_instance.checkout_started_at = None
         payment_instance.payment_method = "stripe"
         payment_instance.status = "pending"
-        payment_instance.save()
+        with transaction.atomic():
+            current = (
+                Payment.objects.select_for_update()
+                .filter(pk=payment_instance.pk, checkout_attempt=attempt)
+                .exists()
+            )
+            if current:
+                payment_instance.save(update_fields=CHECKOUT_FIELDS)
 
         return session
@@ -0,0 +1,39 @@
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from materials.thumbnails import schedule_image_variants
+from users.models import User
+from users.principal import invalidate_roles
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_roles_on_membership_change(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    """Сброс кеша ролей при изменении состава групп пользователя"""
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        # user.groups.add(...) - изменился один пользователь
+        invalidate_roles([instance.pk])
+    elif pk_set:
+        # group.user_set.add(...) - изменились перечисленные пользователи
+        invalidate_roles(pk_set)
+    else:
+        # group.user_set.clear() - список пользователей уже недоступен
+        invalidate_roles()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_roles_on_group_change(sender, created=False, **kwargs):
+    """Переименование или удаление группы затрагивает всех ее участников"""
+    if not created:
+        invalidate_roles()
+
+
+@receiver(post_save, sender=User)
+def schedule_avatar_variants(sender, instance, update_fields=None, **kwargs):
+    """Новая аватарка: варианты строятся в фоне после фиксации транзакции"""
+    schedule_image_variants(instance, update_fields)
@@ -0,0 +1,331 @@
+import json
+import logging
+import random
+import statistics
+import threading
+import time
+import uuid
+from collections import deque
+from functools import lru_cache
+
+import requests
+import stripe
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+
+from materials.timing import timed_phase
+
+logger = logging.getLogger("lms.stripe")
+
+# Ошибки, после которых запрос можно повторить: сеть и таймауты, 429 и 5xx
+RETRYABLE_ERRORS = (
+    stripe.error.APIConnectionError,
+    stripe.error.RateLimitError,
+    stripe.error.APIError,
+)
+
+
+class StripeGatewayError(Exception):
+    """Ошибка запроса к Stripe"""
+
+
+class StripeUnavailableError(StripeGatewayError):
+    """
+    Stripe недоступен: сетевая ошибка, таймаут, 429 или 5xx после всех
+    повторов, либо вызов отклонен открытым автоматом отключения
+    """
+
+
+class CircuitBreaker:
+    """
+    Автомат отключения: после failure_threshold неудачных вызовов подряд
+    вызовы отклоняются сразу в течение reset_timeout секунд, затем
+    пропускается один пробный вызов. Его успех закрывает автомат,
+    ошибка - снова открывает. Состояние общее для потоков процесса
+    """
+
+    def __init__(self, failure_threshold, reset_timeout, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def get_state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    @property
+    def state(self):
+        with self.lock:
+            return self.get_state()
+
+    def allow(self):
+        """Можно ли выполнить вызов; в half-open - только один пробный"""
+        with self.lock:
+            state = self.get_state()
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def release(self):
+        """Вызов завершился без ответа о состоянии Stripe"""
+        with self.lock:
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+
+
+class GatewayMetrics:
+    """
+    Метрики вызовов Stripe в памяти процесса по операциям: число вызовов,
+    ошибок, отклоненных автоматом и повторов, доля ошибок и задержки
+    последних window вызовов
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.lock = threading.Lock()
+        self.operations = {}
+
+    def record(self, operation, outcome, duration, retries):
+        with self.lock:
+            stats = self.operations.setdefault(
+                operation,
+                {
+                    "calls": 0,
+                    "errors": 0,
+                    "rejected": 0,
+                    "retries": 0,
+                    "latencies": deque(maxlen=self.window),
+                },
+            )
+            stats["calls"] += 1
+            stats["retries"] += retries
+            if outcome == "rejected":
+                stats["rejected"] += 1
+            elif outcome == "error":
+                stats["errors"] += 1
+            if outcome != "rejected":
+                stats["latencies"].append(duration)
+
+    def snapshot(self):
+        """{операция: счетчики, error_rate и p50/p95/max задержки в мс}"""
+        with self.lock:
+            operations = {
+                operation: {**stats, "latencies": sorted(stats["latencies"])}
+                for operation, stats in self.operations.items()
+            }
+        result = {}
+        for operation, stats in operations.items():
+            latencies = stats.pop("latencies")
+            failed = stats["errors"] + stats["rejected"]
+            stats["error_rate"] = round(failed / stats["calls"], 4)
+            if len(latencies) > 1:
+                quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+                stats["p50_ms"] = round(quantiles[49] * 1000, 2)
+                stats["p95_ms"] = round(quantiles[94] * 1000, 2)
+            elif latencies:
+                stats["p50_ms"] = stats["p95_ms"] = round(latencies[0] * 1000, 2)
+            if latencies:
+                stats["max_ms"] = round(latencies[-1] * 1000, 2)
+            result[operation] = stats
+        return result
+
+
+class StripeGateway:
+    """
+    Клиент Stripe API: пул keep-alive соединений (requests.Session),
+    таймауты подключения и чтения на каждый запрос, ограниченные повторы
+    с экспоненциальной задержкой и случайным разбросом, автомат
+    отключения и метрики.
+
+    Повторяются только идемпотентные вызовы: чтения и создания с ключом
+    идемпотентности, общим для всех попыток одного вызова, поэтому повтор
+    после таймаута не создает в Stripe второй объект. base_url заменяет
+    адрес Stripe API (локальная заглушка в тестах, stripe-mock)
+    """
+
+    def __init__(
+        self,
+        api_key,
+        *,
+        base_url=None,
+        connect_timeout=3.0,
+        read_timeout=10.0,
+        max_retries=2,
+        retry_backoff=0.5,
+        max_retry_backoff=4.0,
+        pool_size=10,
+        breaker=None,
+        metrics=None,
+        sleep=time.sleep,
+    ):
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.breaker = breaker or CircuitBreaker(5, 30.0)
+        self.metrics = metrics or GatewayMetrics()
+        self.sleep = sleep
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.client = stripe.StripeClient(
+            api_key,
+            base_addresses={"api": base_url} if base_url else None,
+            # Повторы выполняет шлюз: с автоматом и общим ключом идемпотентности
+            max_network_retries=0,
+            http_client=stripe.RequestsClient(
+                timeout=(connect_timeout, read_timeout), session=self.session
+            ),
+        )
+
+    def get_backoff(self, attempt):
+        """Задержка перед повтором attempt (с 0): full jitter"""
+        return random.uniform(
+            0, min(self.max_retry_backoff, self.retry_backoff * 2**attempt)
+        )
+
+    def call(self, operation, method, *args, **kwargs):
+        """
+        Вызов method(*args, **kwargs) клиента Stripe с повторами, автоматом
+        и метриками. StripeUnavailableError - Stripe недоступен,
+        StripeGatewayError - Stripe отклонил запрос
+        """
+        if not self.breaker.allow():
+            self.report(operation, "rejected", 0.0, 0)
+            raise StripeUnavailableError(
+                f"Stripe недоступен ({operation}): вызовы временно отключены"
+            )
+
+        started = time.perf_counter()
+        attempt = 0
+        with timed_phase("stripe"):
+            while True:
+                try:
+                    result = method(*args, **kwargs)
+                except RETRYABLE_ERRORS as e:
+                    if attempt < self.max_retries:
+                        self.sleep(self.get_backoff(attempt))
+                        attempt += 1
+                        continue
+                    self.breaker.record_failure()
+                    self.report(
+                        operation, "error", time.perf_counter() - started, attempt
+                    )
+                    raise StripeUnavailableError(
+                        f"Stripe недоступен ({operation}): {str(e)}"
+                    ) from e
+                except stripe.error.StripeError as e:
+                    # Stripe ответил: запрос некорректен, но сервис работает
+                    self.breaker.record_success()
+                    self.report(
+                        operation, "error", time.perf_counter() - started, attempt
+                    )
+                    raise StripeGatewayError(
+                        f"Stripe отклонил запрос ({operation}): {str(e)}"
+                    ) from e
+                except Exception:
+                    self.breaker.release()
+                    raise
+                break
+
+        self.breaker.record_success()
+        self.report(operation, "ok", time.perf_counter() - started, attempt)
+        return result
+
+    def report(self, operation, outcome, duration, retries):
+        self.metrics.record(operation, outcome, duration, retries)
+        logger.log(
+            logging.INFO if outcome == "ok" else logging.WARNING,
+            json.dumps(
+                {
+                    "operation": operation,
+                    "outcome": outcome,
+                    "retries": retries,
+                    "duration_ms": round(duration * 1000, 2),
+                    "breaker": self.breaker.state,
+                }
+            ),
+        )
+
+    def create(self, operation, service, params, idempotency_key=None):
+        """
+        Создание объекта; idempotency_key по умолчанию случайный, общий для
+        повторов одного вызова. Ключ, выведенный из данных вызывающего,
+        делает идемпотентными и повторы вызова целиком
+        """
+        options = {"idempotency_key": idempotency_key or str(uuid.uuid4())}
+        return self.call(operation, service.create, params=params, options=options)
+
+    def create_product(self, params):
+        return self.create("create_product", self.client.v1.products, params)
+
+    def create_price(self, params):
+        return self.create("create_price", self.client.v1.prices, params)
+
+    def create_checkout_session(self, params, idempotency_key=None):
+        return self.create(
+            "create_checkout_session",
+            self.client.v1.checkout.sessions,
+            params,
+            idempotency_key,
+        )
+
+    def list_sessions(self, params):
+        """Страница списка сессий оплаты (до 100 за запрос)"""
+        return self.call(
+            "list_sessions", self.client.v1.checkout.sessions.list, params=params
+        )
+
+    def retrieve_session(self, session_id):
+        return self.call(
+            "retrieve_session", self.client.v1.checkout.sessions.retrieve, session_id
+        )
+
+
+@lru_cache(maxsize=None)
+def get_stripe_gateway():
+    """Общий для процесса шлюз с настройками STRIPE_*"""
+    return StripeGateway(
+        settings.STRIPE_SECRET_KEY or "",
+        base_url=settings.STRIPE_API_BASE,
+        connect_timeout=settings.STRIPE_CONNECT_TIMEOUT,
+        read_timeout=settings.STRIPE_READ_TIMEOUT,
+        max_retries=settings.STRIPE_MAX_RETRIES,
+        retry_backoff=settings.STRIPE_RETRY_BACKOFF,
+        pool_size=settings.STRIPE_POOL_SIZE,
+        breaker=CircuitBreaker(
+            settings.STRIPE_BREAKER_THRESHOLD, settings.STRIPE_BREAKER_RESET_TIMEOUT
+        ),
+    )
+
+
+@receiver(setting_changed)
+def reset_stripe_gateway(setting, **kwargs):
+    """override_settings в тестах: шлюз пересоздается с новыми настройками"""
+    if setting.startswith("STRIPE_"):
+        get_stripe_gateway.cache_clear()
@@ -1,8 +1,17 @@
+import stripe
 from celery import shared_task
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 from datetime import timedelta
 from django.contrib.auth import get_user_model
 
+from users.models import StripeEvent
+from users.services import apply_stripe_event, reconcile_stripe_payments
+
+logger = get_task_logger(__name__)
+
 User = get_user_model()
 
 
@@ -28,3 +37,53 @@ def block_inactive_users():
 
     except Exception as e:
         return f"Ошибка при блокировке пользователей: {str(e)}"
+
+
+@shared_task
+def process_stripe_event(event_pk):
+    """
+    Применение сохраненного события вебхука Stripe к платежу.
+
+    Событие блокируется и отмечается обработанным в одной транзакции с
+    изменением платежа, поэтому повторный запуск задачи (повторная
+    доставка вебхука, повтор Celery) не применяет его дважды
+    """
+    with transaction.atomic():
+        event = StripeEvent.objects.select_for_update().filter(pk=event_pk).first()
+        if event is None:
+            return "Событие не найдено"
+        if event.processed_at is not None:
+            return f"Событие {event.event_id} уже обработано"
+
+        session = stripe.Event.construct_from(event.payload, None).data.object
+        payment = apply_stripe_event(event.type, session)
+        event.processed_at = timezone.now()
+        event.save(update_fields=["processed_at"])
+
+    if payment is None:
+        return f"Событие {event.event_id} не изменило платежей"
+    return f"Платеж {payment.id}: {payment.status} по событию {event.event_id}"
+
+
+@shared_task
+def reconcile_stripe_payments_task():
+    """
+    Периодическая сверка со Stripe платежей, которые ждут оплаты дольше
+    STRIPE_RECONCILE_MIN_AGE секунд: страхует от потерянных вебхуков и
+    отменяет платежи с истекшими сессиями
+    """
+    stats = reconcile_stripe_payments(
+        batch_size=settings.STRIPE_RECONCILE_BATCH_SIZE,
+        min_age=timedelta(seconds=settings.STRIPE_RECONCILE_MIN_AGE),
+    )
+    result = (
+        f"Сверено {stats['payments']} платежей Stripe ({stats['batches']} пачек, "
+        f"{stats['requests']} запросов к Stripe) за {stats['seconds']} с, "
+        f"{stats['payments_per_second']} платежей/с: изменено {stats['changed']}, "
+        f"оплачено {stats.get('succeeded', 0)}, отменено {stats.get('canceled', 0)}"
+    )
+    if stats["error"]:
+        logger.warning("Сверка платежей Stripe прервана: %s", stats["error"])
+        result += f", прервано: {stats['error']}"
+    logger.info(result)
+    return result
@@ -0,0 +1,1577 @@
+import hashlib
+import hmac
+import json
+import threading
+import time
+import warnings
+from collections import deque
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from itertools import count
+from types import SimpleNamespace
+from unittest import mock
+from urllib.parse import parse_qsl, urlsplit
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import Group
+from django.core.management import call_command
+from django.core.cache import cache
+from django.core.paginator import UnorderedObjectListWarning
+from django.db.models import Count
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from materials.exports import aiter_export, iter_export
+from materials.models import Course, Lesson
+from materials.tests import QueryBudget, QueryBudgetMixin
+from users.models import (
+    Payment,
+    StripeEvent,
+    StripePrice,
+    StripeProduct,
+    Subscription,
+    User,
+)
+from users.principal import get_principal
+from users.stripe_gateway import (
+    CircuitBreaker,
+    StripeGateway,
+    StripeGatewayError,
+    StripeUnavailableError,
+)
+from users.services import (
+    CHECKOUT_CLAIM_TIMEOUT,
+    CHECKOUT_SESSION_LIFETIME,
+    StripeService,
+    reconcile_stripe_payments,
+)
+from users.tasks import process_stripe_event, reconcile_stripe_payments_task
+
+WEBHOOK_PATH = "/api/users/stripe/webhook/"
+
+
+def sign_stripe_payload(payload, secret, timestamp=None):
+    """Заголовок Stripe-Signature для тела payload, как его подписывает Stripe"""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256
+    ).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+class FakeStripeEventSender:
+    """
+    Локальный отправитель событий Stripe: собирает событие сессии оплаты
+    в формате Stripe, подписывает его секретом вебхука и отправляет
+    тестовым клиентом на вебхук. Без сети и Stripe CLI
+    """
+
+    ids = count(1)
+
+    def __init__(self, client, secret):
+        self.client = client
+        self.secret = secret
+
+    def build_event(self, event_type, session, event_id=None):
+        return {
+            "id": event_id or f"evt_test_{next(self.ids)}",
+            "object": "event",
+            "api_version": "2024-06-20",
+            "created": int(time.time()),
+            "livemode": False,
+            "type": event_type,
+            "data": {"object": {"object": "checkout.session", **session}},
+        }
+
+    def post(self, payload, signature):
+        return self.client.generic(
+            "POST",
+            WEBHOOK_PATH,
+            payload,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=signature,
+        )
+
+    def send(self, event_type, session, event_id=None, secret=None):
+        """
+        Отправка события event_type с объектом сессии session (словарь с
+        id, payment_status, ...); secret подменяет секрет подписи
+        """
+        payload = json.dumps(self.build_event(event_type, session, event_id))
+        return self.post(payload, sign_stripe_payload(payload, secret or self.secret))
+
+    def send_completed(self, payment, payment_status="paid", **kwargs):
+        """checkout.session.completed для сессии платежа payment"""
+        session = {
+            "id": payment.stripe_session_id,
+            "payment_status": payment_status,
+            "payment_intent": f"pi_{payment.stripe_session_id}",
+            "url": None,
+            "metadata": {"payment_id": str(payment.id)},
+        }
+        return self.send("checkout.session.completed", session, **kwargs)
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    """Обработчик FakeStripeServer: keep-alive, как у Stripe API"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.stripe.handle(self)
+
+    def do_POST(self):
+        self.server.stripe.handle(self)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeStripeServer:
+    """
+    Локальная заглушка Stripe API для шлюза (STRIPE_API_BASE): продукты,
+    цены и сессии оплаты (создание, получение, список) в памяти. Ответы
+    с одним ключом идемпотентности повторяются, как в Stripe. fail_next и
+    delay_next подмешивают ошибки и задержки в ближайшие запросы;
+    requests - принятые запросы
+    """
+
+    def __init__(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeStripeHandler)
+        self.server.daemon_threads = True
+        self.server.stripe = self
+        # Клиент, не дождавшийся ответа, закрывает соединение
+        self.server.handle_error = lambda request, client_address: None
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.lock = threading.Lock()
+        self.ids = count(1)
+        self.faults = deque()
+        self.requests = []
+        self.objects = {}
+        self.idempotent_responses = {}
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        """Заглушка без объектов, запросов и ошибок - между тестами"""
+        with self.lock:
+            self.faults.clear()
+            self.requests.clear()
+            self.objects.clear()
+            self.idempotent_responses.clear()
+
+    def fail_next(self, times=1, status=500):
+        """Ближайшие times запросов получают ответ с ошибкой status"""
+        self.faults.extend(("status", status) for _ in range(times))
+
+    def delay_next(self, times=1, seconds=1.0):
+        """Ближайшие times запросов отвечают через seconds секунд"""
+        self.faults.extend(("delay", seconds) for _ in range(times))
+
+    def handle(self, handler):
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length).decode()
+        url = urlsplit(handler.path)
+        params = dict(parse_qsl(body or url.query))
+        key = handler.headers.get("Idempotency-Key")
+        with self.lock:
+            self.requests.append(
+                {
+                    "method": handler.command,
+                    "path": url.path,
+                    "params": params,
+                    "idempotency_key": key,
+                    "client_port": handler.client_address[1],
+                }
+            )
+            fault = self.faults.popleft() if self.faults else None
+
+        if fault and fault[0] == "delay":
+            time.sleep(fault[1])
+        if fault and fault[0] == "status":
+            status, data = fault[1], self.error("api_error", "Сбой заглушки")
+        else:
+            with self.lock:
+                if key and key in self.idempotent_responses:
+                    status, data = self.idempotent_responses[key]
+                else:
+                    status, data = self.route(handler.command, url.path, params)
+                    if key:
+                        self.idempotent_responses[key] = (status, data)
+
+        payload = json.dumps(data).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def add_session(self, created=None, **fields):
+        """
+        Сессия оплаты, созданная в момент created (unix-время); fields
+        задают status, payment_status и т.д.
+        """
+        created = int(time.time()) if created is None else created
+        _, session = self.create(
+            "cs_test",
+            {
+                "object": "checkout.session",
+                "created": created,
+                "status": "open",
+                "payment_status": "unpaid",
+                "payment_intent": None,
+                "expires_at": created + 24 * 60 * 60,
+                "metadata": {},
+                **fields,
+            },
+        )
+        session.setdefault("url", f"{self.url}/pay/{session['id']}")
+        return session
+
+    def list_sessions(self, params):
+        """Список сессий, как в Stripe: новые первыми, фильтр created, курсор"""
+        sessions = sorted(
+            (
+                obj
+                for obj in self.objects.values()
+                if obj["object"] == "checkout.session"
+                and obj["created"] >= int(params.get("created[gte]", 0))
+                and obj["created"] <= int(params.get("created[lte]", 2**63))
+            ),
+            key=lambda session: (session["created"], session["id"]),
+            reverse=True,
+        )
+        if "starting_after" in params:
+            ids = [session["id"] for session in sessions]
+            start = ids.index(params["starting_after"]) + 1
+            sessions = sessions[start:]
+        limit = int(params.get("limit", 10))
+        return {
+            "object": "list",
+            "url": "/v1/checkout/sessions",
+            "data": sessions[:limit],
+            "has_more": len(sessions) > limit,
+        }
+
+    @staticmethod
+    def error(error_type, message):
+        return {"error": {"type": error_type, "message": message}}
+
+    def create(self, prefix, obj):
+        obj["id"] = f"{prefix}_{next(self.ids)}"
+        self.objects[obj["id"]] = obj
+        return 200, obj
+
+    def route(self, method, path, params):
+        if method == "POST" and path == "/v1/products":
+            return self.create(
+                "prod",
+                {
+                    "object": "product",
+                    "name": params.get("name"),
+                    "description": params.get("description"),
+                },
+            )
+        if method == "POST" and path == "/v1/prices":
+            return self.create(
+                "price",
+                {
+                    "object": "price",
+                    "product": params.get("product"),
+                    "unit_amount": int(params.get("unit_amount", 0)),
+                    "currency": params.get("currency"),
+                },
+            )
+        if method == "POST" and path == "/v1/checkout/sessions":
+            metadata = {
+                key.removeprefix("metadata[").removesuffix("]"): value
+                for key, value in params.items()
+                if key.startswith("metadata[")
+            }
+            return 200, self.add_session(metadata=metadata)
+        if method == "GET" and path == "/v1/checkout/sessions":
+            return 200, self.list_sessions(params)
+        if method == "GET" and path.startswith("/v1/checkout/sessions/"):
+            session = self.objects.get(path.rsplit("/", 1)[1])
+            if session is not None:
+                return 200, session
+            return 404, self.error("invalid_request_error", "No such checkout.session")
+        return 404, self.error("invalid_request_error", f"Unrecognized {method} {path}")
+
+
+def count_role_queries(queries):
+    """Количество запросов к группам пользователя"""
+    return sum(1 for query in queries.captured_queries if "auth_group" in query["sql"])
+
+
+@override_settings(PRINCIPAL_ROLES_CACHE_TIMEOUT=300)
+class PrincipalTestCase(APITestCase):
+    """
+    Тестирование однократного вычисления ролей пользователя за запрос
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.owner_user = User.objects.create_user(
+            email="owner@example.com", password="testpass123"
+        )
+        self.moderator_user = User.objects.create_user(
+            email="moderator@example.com", password="testpass123"
+        )
+        self.moderators_group = Group.objects.create(name="moderators")
+        self.moderator_user.groups.add(self.moderators_group)
+
+        self.course = Course.objects.create(name="Course", owner=self.owner_user)
+        self.lesson = Lesson.objects.create(
+            name="Lesson", course=self.course, owner=self.owner_user
+        )
+        self.lesson_detail_url = f"/api/materials/lessons/{self.lesson.id}/"
+        self.client = APIClient()
+
+    @override_settings(PRINCIPAL_ROLES_CACHE_TIMEOUT=0)
+    def test_roles_loaded_once_per_request(self):
+        """Тест: при обновлении урока роли читаются из БД один раз"""
+        self.client.force_authenticate(user=self.moderator_user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(self.lesson_detail_url, {"name": "New"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(count_role_queries(queries), 1)
+        self.assertFalse(
+            any('FROM "users_user"' in q["sql"] for q in queries.captured_queries)
+        )
+
+    def test_roles_cached_between_requests(self):
+        """Тест: повторный запрос берет роли из кеша"""
+        self.client.force_authenticate(user=self.owner_user)
+        self.client.get(self.lesson_detail_url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.lesson_detail_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(count_role_queries(queries), 0)
+
+    def test_cache_invalidated_on_membership_change(self):
+        """Тест: после добавления в группу права меняются сразу"""
+        self.client.force_authenticate(user=self.owner_user)
+        response = self.client.post(
+            "/api/materials/lessons/", {"name": "L", "course": self.course.id}
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.moderators_group.user_set.add(self.owner_user)
+        response = self.client.post(
+            "/api/materials/lessons/", {"name": "L", "course": self.course.id}
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.owner_user.groups.clear()
+        response = self.client.post(
+            "/api/materials/lessons/", {"name": "L", "course": self.course.id}
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class PrincipalUnitTestCase(TestCase):
+    """
+    Тестирование объекта Principal
+    """
+
+    def test_principal_is_stored_on_request(self):
+        """Тест: principal вычисляется один раз для запроса"""
+        user = User.objects.create_user(email="user@example.com", password="x")
+        request = RequestFactory().get("/")
+        request.user = user
+        principal = get_principal(request)
+        self.assertIs(get_principal(request), principal)
+        self.assertEqual(principal.user_id, user.id)
+        self.assertFalse(principal.is_moderator)
+
+
+class AsyncPaymentStatusTestCase(APITestCase):
+    """
+    Тестирование асинхронной проверки статуса платежа
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="user@example.com", password="x")
+        self.other_user = User.objects.create_user(
+            email="other@example.com", password="x"
+        )
+        self.course = Course.objects.create(name="Course", owner=self.other_user)
+        self.payment = Payment.objects.create(
+            user=self.user,
+            paid_course=self.course,
+            amount=100,
+            payment_method="stripe",
+            status="pending",
+            stripe_session_id="cs_test",
+        )
+        self.url = f"/api/users/async/payments/{self.payment.id}/status/"
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_status_is_db_read(self):
+        """Тест: статус и ссылка на оплату читаются из БД без запроса к Stripe"""
+        Payment.objects.filter(pk=self.payment.pk).update(
+            checkout_url="https://pay",
+            checkout_expires_at=timezone.now() + timedelta(hours=1),
+        )
+        with mock.patch(
+            "users.services.stripe.checkout.Session.retrieve",
+            side_effect=AssertionError("запрос к Stripe"),
+        ), mock.patch(
+            "users.services.stripe.checkout.Session.retrieve_async",
+            side_effect=AssertionError("запрос к Stripe"),
+        ):
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()["status"], "pending")
+            self.assertEqual(response.json()["checkout_url"], "https://pay")
+
+            Payment.objects.filter(pk=self.payment.pk).update(status="succeeded")
+            response = self.client.get(self.url)
+            self.assertEqual(response.json()["status"], "succeeded")
+            self.assertIsNone(response.json()["checkout_url"])
+
+    def test_access(self):
+        """Тест: чужой платеж - 403, аноним - 401, несуществующий - 404"""
+        self.client.force_authenticate(user=self.other_user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        response = self.client.get("/api/users/async/payments/999999/status/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.client.force_authenticate(user=None)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PaymentExportTestCase(APITestCase):
+    """
+    Тестирование потоковой выгрузки платежей
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="user@example.com", password="x")
+        self.other_user = User.objects.create_user(
+            email="other@example.com", password="x"
+        )
+        self.moderator = User.objects.create_user(
+            email="moderator@example.com", password="x"
+        )
+        self.moderator.groups.add(Group.objects.create(name="moderators"))
+        self.course = Course.objects.create(name="Курс, часть 1", owner=self.other_user)
+        for amount in (100, 200, 300):
+            Payment.objects.create(
+                user=self.user,
+                paid_course=self.course,
+                amount=amount,
+                payment_method="cash",
+            )
+        Payment.objects.create(
+            user=self.other_user,
+            paid_course=self.course,
+            amount=400,
+            payment_method="transfer",
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def read(self, response):
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv_export_is_scoped_and_filtered(self):
+        """Тест: CSV - только свои платежи, с фильтрами и сортировкой API"""
+        response = self.client.get(
+            "/api/users/payments/export/csv/?amount__gte=150&ordering=amount"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        self.assertIn('filename="payments.csv"', response["Content-Disposition"])
+
+        lines = self.read(response).splitlines()
+        self.assertEqual(lines[0].split(",")[:3], ["id", "user", "user_email"])
+        self.assertEqual(len(lines), 3)
+        self.assertIn('"Курс, часть 1",', lines[1])
+        self.assertIn(",200.00,cash,", lines[1])
+        self.assertIn(",300.00,cash,", lines[2])
+
+    def test_ndjson_export_for_moderator(self):
+        """Тест: модератор выгружает все платежи, по объекту JSON на строку"""
+        self.client.force_authenticate(user=self.moderator)
+        response = self.client.get(
+            "/api/users/payments/export/ndjson/", HTTP_ACCEPT="application/x-ndjson"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = [json.loads(line) for line in self.read(response).splitlines()]
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0]["amount"], "400.00")
+        self.assertEqual(rows[0]["user_email"], "other@example.com")
+        self.assertNotIn("checkout_url", rows[0])
+
+    def test_errors(self):
+        """Тест: аноним - 401, неверный фильтр - 400"""
+        response = self.client.get("/api/users/payments/export/csv/?amount__gte=x")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.force_authenticate(user=None)
+        response = self.client.get("/api/users/payments/export/csv/")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(EXPORT_CHUNK_SIZE=1, EXPORT_BUFFER_SIZE=1)
+    def test_streamed_in_chunks(self):
+        """Тест: ответ отдается блоками, синхронный и асинхронный поток совпадают"""
+        fields = {"id": "id", "amount": "amount"}
+        queryset = Payment.objects.order_by("id")
+        chunks = list(iter_export(queryset, fields, "ndjson"))
+        self.assertEqual(len(chunks), 4)
+
+        async def collect():
+            return [chunk async for chunk in aiter_export(queryset, fields, "ndjson")]
+
+        self.assertEqual(async_to_sync(collect)(), chunks)
+
+    def test_management_command(self):
+        """Тест: команда применяет область видимости пользователя и фильтры"""
+        stdout, stderr = StringIO(), StringIO()
+        call_command(
+            "export_payments",
+            "--format=ndjson",
+            "--user=user@example.com",
+            "--filter=amount__lte=200",
+            stdout=stdout,
+            stderr=stderr,
+        )
+        rows = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(sorted(row["amount"] for row in rows), ["100.00", "200.00"])
+
+        stdout = StringIO()
+        call_command("export_payments", stdout=stdout, stderr=stderr)
+        self.assertEqual(len(stdout.getvalue().splitlines()), 5)
+
+
+class FillTestDataTestCase(TestCase):
+    """
+    Тестирование генератора синтетических данных
+    """
+
+    options = {
+        "users": 50,
+        "courses_per_owner": 2,
+        "lessons_per_course": 4,
+        "subscriptions": 80,
+        "payments": 120,
+        "batch_size": 7,
+        "stdout": StringIO(),
+    }
+
+    def snapshot(self):
+        return (
+            list(
+                User.objects.filter(email__endswith="@lms.test")
+                .order_by("email")
+                .values_list("email", "city", "date_joined")
+            ),
+            list(
+                Course.objects.order_by("name").values_list(
+                    "name", "price", "owner__email"
+                )
+            ),
+            list(
+                Payment.objects.order_by("payment_date").values_list(
+                    "user__email", "amount", "status", "payment_date"
+                )
+            ),
+        )
+
+    def test_deterministic_scaled_data(self):
+        """Тест: объемы по параметрам, одинаковые данные при одном seed"""
+        call_command("fill_test_data", seed=7, **self.options)
+        users = User.objects.filter(email__endswith="@lms.test")
+        self.assertEqual(users.count(), 50)
+        self.assertTrue(users.first().check_password("password123"))
+        # Один хеш пароля на всех сгенерированных пользователей
+        self.assertEqual(users.values("password").distinct().count(), 1)
+        self.assertAlmostEqual(Subscription.objects.count(), 80, delta=20)
+        self.assertAlmostEqual(Payment.objects.count(), 120, delta=25)
+        self.assertFalse(
+            Payment.objects.filter(paid_course=None, paid_lesson=None).exists()
+        )
+        self.assertGreater(Payment.objects.dates("payment_date", "month").count(), 1)
+
+        # Агрегаты курсов пересчитаны после записи в обход сигналов
+        course = Course.objects.filter(lessons__isnull=False).first()
+        self.assertEqual(course.lessons_count, course.lessons.count())
+        self.assertEqual(
+            sum(Course.objects.values_list("subscribers_count", flat=True)),
+            Subscription.objects.count(),
+        )
+
+        snapshot = self.snapshot()
+        call_command("fill_test_data", seed=7, clear=True, **self.options)
+        self.assertEqual(self.snapshot(), snapshot)
+
+        call_command("fill_test_data", seed=8, clear=True, **self.options)
+        self.assertNotEqual(self.snapshot(), snapshot)
+
+    def test_dates_anchored_to_end_date(self):
+        """Тест: даты зависят от --end-date и --days, а не от текущего дня"""
+        call_command("fill_test_data", seed=7, **self.options)
+        end = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        payment_dates = Payment.objects.values_list("payment_date", flat=True)
+        self.assertLess(max(payment_dates), end)
+        self.assertGreaterEqual(min(payment_dates), end - timedelta(days=365))
+
+        call_command(
+            "fill_test_data",
+            seed=7,
+            clear=True,
+            end_date=date(2020, 6, 1),
+            days=30,
+            **self.options,
+        )
+        end = datetime(2020, 6, 1, tzinfo=dt_timezone.utc)
+        joined = User.objects.filter(email__endswith="@lms.test").values_list(
+            "date_joined", flat=True
+        )
+        self.assertLess(max(joined), end)
+        self.assertGreaterEqual(min(joined), end - timedelta(days=30))
+
+    def test_clear_removes_stripe_catalog(self):
+        """Тест: --clear удаляет продукты и цены Stripe курсов и уроков"""
+        call_command("fill_test_data", seed=7, **self.options)
+        lesson = Lesson.objects.first()
+        for product in (
+            StripeProduct.objects.create(
+                course=lesson.course, product_id="prod_course", name="Курс"
+            ),
+            StripeProduct.objects.create(
+                lesson=lesson, product_id="prod_lesson", name="Урок"
+            ),
+        ):
+            StripePrice.objects.create(
+                product=product, amount=100, price_id=f"price_{product.pk}"
+            )
+
+        call_command("fill_test_data", seed=7, clear=True, **self.options)
+        connection.check_constraints()
+        self.assertFalse(StripeProduct.objects.exists())
+        self.assertFalse(StripePrice.objects.exists())
+
+
+@override_settings(PRINCIPAL_ROLES_CACHE_TIMEOUT=0, RESPONSE_CACHE_TIMEOUT=0)
+class UsersQueryBudgetTestCase(QueryBudgetMixin, APITestCase):
+    """
+    Бюджеты SQL-запросов действий пользователей, платежей и подписок
+    на данных fill_test_data
+    """
+
+    # В каждом бюджете два запроса - пользователь JWT и его группы
+    query_budgets = [
+        QueryBudget("payment-list", "/api/users/payments/", 4, paginated=True),
+        QueryBudget(
+            "payment-list-filtered",
+            "/api/users/payments/?payment_method=stripe&ordering=-amount",
+            4,
+            paginated=True,
+        ),
+        QueryBudget(
+            "payment-list-own",
+            "/api/users/payments/",
+            4,
+            user="customer",
+            paginated=True,
+        ),
+        QueryBudget("payment-retrieve", "/api/users/payments/{payment}/", 3),
+        QueryBudget(
+            "payment-create",
+            "/api/users/payments/",
+            4,
+            method="post",
+            user="customer",
+            data={
+                "user": "{customer}",
+                "paid_course": "{course}",
+                "amount": "100.00",
+                "payment_method": "cash",
+            },
+        ),
+        QueryBudget(
+            "payment-status",
+            "/api/users/payments/{payment}/status/",
+            2,
+            user="customer",
+        ),
+        QueryBudget(
+            "subscription-toggle",
+            "/api/users/subscriptions/",
+            7,
+            method="post",
+            user="customer",
+            data={"course_id": "{course}"},
+        ),
+        QueryBudget("user-list", "/api/users/users/", 4, user="admin", paginated=True),
+        QueryBudget("user-retrieve", "/api/users/users/{customer}/", 4),
+        QueryBudget("user-profile", "/api/users/users/profile/", 2, user="customer"),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            "fill_test_data",
+            users=120,
+            subscriptions=200,
+            payments=600,
+            stdout=StringIO(),
+        )
+        cls.moderator = User.objects.get(email="moderator@example.com")
+        cls.admin = User.objects.get(email="admin@example.com")
+        # Пользователь с наибольшим числом платежей: его список занимает
+        # несколько страниц
+        cls.customer = (
+            User.objects.filter(email__endswith="@lms.test")
+            .annotate(payments_total=Count("payments"))
+            .order_by("-payments_total", "pk")
+            .first()
+        )
+
+    def test_user_list_is_ordered(self):
+        """Тест: список пользователей упорядочен, без UnorderedObjectListWarning"""
+        self.client.force_authenticate(self.admin)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", UnorderedObjectListWarning)
+            response = self.client.get("/api/users/users/", {"page_size": 50})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = User.objects.order_by("-date_joined", "-id").values_list(
+            "email", flat=True
+        )[:50]
+        self.assertEqual(
+            [user["email"] for user in response.data["results"]], list(expected)
+        )
+
+    def get_budget_context(self):
+        return {
+            "customer": self.customer.pk,
+            "payment": Payment.objects.filter(user=self.customer)
+            .order_by("pk")
+            .first()
+            .pk,
+            "course": Course.objects.order_by("pk").first().pk,
+        }
+
+
+class PaymentCheckoutTestCase(APITestCase):
+    """
+    Тестирование сохраненных ссылок на оплату Stripe
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="user@example.com", password="x")
+        self.course = Course.objects.create(name="Course", owner=self.user)
+        self.payment = Payment.objects.create(
+            user=self.user,
+            paid_course=self.course,
+            amount=100,
+            payment_method="stripe",
+            status="pending",
+            stripe_session_id="cs_test",
+            checkout_url="https://pay/cs_test",
+            checkout_expires_at=timezone.now() + timedelta(hours=1),
+        )
+        self.client.force_authenticate(user=self.user)
+        patcher = mock.patch(
+            "users.services.stripe.checkout.Session.retrieve",
+            side_effect=AssertionError("запрос к Stripe"),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_payloads_do_not_call_stripe(self):
+        """Тест: список, детали и профиль берут ссылку из БД"""
+        Payment.objects.bulk_create(
+            Payment(
+                user=self.user,
+                paid_course=self.course,
+                amount=100,
+                payment_method="stripe",
+                status="pending",
+                stripe_session_id=f"cs_test_{number}",
+                checkout_url=f"https://pay/{number}",
+                checkout_expires_at=timezone.now() + timedelta(hours=1),
+            )
+            for number in range(5)
+        )
+        response = self.client.get("/api/users/payments/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(all(row["checkout_url"] for row in response.data["results"]))
+
+        response = self.client.get(f"/api/users/payments/{self.payment.id}/")
+        self.assertEqual(response.data["checkout_url"], "https://pay/cs_test")
+
+        response = self.client.get("/api/users/users/profile/")
+        self.assertTrue(all(row["checkout_url"] for row in response.data["payments"]))
+
+    def test_expired_or_paid_checkout_url_is_hidden(self):
+        """Тест: истекшая ссылка и ссылка оплаченного платежа не отдаются"""
+        self.payment.checkout_expires_at = timezone.now() - timedelta(minutes=1)
+        self.payment.save()
+        response = self.client.get(f"/api/users/payments/{self.payment.id}/")
+        self.assertIsNone(response.data["checkout_url"])
+
+        Payment.objects.filter(pk=self.payment.pk).update(
+            status="succeeded", checkout_expires_at=None
+        )
+        response = self.client.get(f"/api/users/payments/{self.payment.id}/")
+        self.assertIsNone(response.data["checkout_url"])
+
+    def test_payer_cannot_change_or_delete_payment(self):
+        """Тест: плательщик видит свой платеж, но не меняет и не удаляет его"""
+        url = f"/api/users/payments/{self.payment.id}/"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        other_course = Course.objects.create(name="Other", owner=self.user)
+        for method, data in [
+            ("patch", {"amount": 1}),
+            ("patch", {"paid_course": other_course.id}),
+            ("put", {"amount": 1, "paid_course": other_course.id}),
+            ("delete", None),
+        ]:
+            with self.subTest(method=method, data=data):
+                response = getattr(self.client, method)(url, data)
+                self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.amount, 100)
+        self.assertEqual(self.payment.paid_course, self.course)
+
+    def test_checkout_reuses_active_url(self):
+        """Тест: действующая ссылка отдается без новой сессии"""
+        with mock.patch(
+            "users.views.StripeService.create_payment_for_course_or_lesson"
+        ) as create:
+            response = self.client.post(
+                f"/api/users/payments/{self.payment.id}/checkout/"
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["checkout_url"], "https://pay/cs_test")
+        create.assert_not_called()
+
+    def test_checkout_refreshes_expired_url(self):
+        """Тест: истекшая ссылка заменяется ссылкой новой сессии"""
+        self.payment.checkout_expires_at = timezone.now() - timedelta(minutes=1)
+        self.payment.save()
+        expires_at = int((timezone.now() + timedelta(hours=24)).timestamp())
+        session = SimpleNamespace(
+            id="cs_new", url="https://pay/new", expires_at=expires_at
+        )
+        with mock.patch(
+            "users.services.StripeService.create_product",
+            return_value=SimpleNamespace(id="prod"),
+        ), mock.patch(
+            "users.services.StripeService.create_price",
+            return_value=SimpleNamespace(id="price"),
+        ), mock.patch(
+            "users.services.StripeService.create_checkout_session",
+            return_value=session,
+        ):
+            response = self.client.post(
+                f"/api/users/payments/{self.payment.id}/checkout/"
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["checkout_url"], "https://pay/new")
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.stripe_session_id, "cs_new")
+        self.assertEqual(int(self.payment.checkout_expires_at.timestamp()), expires_at)
+
+    def test_checkout_rereads_payment_under_lock(self):
+        """
+        Тест: параллельный запрос видит сессию, созданную первым, и не
+        создает вторую
+        """
+        stale = Payment.objects.get(pk=self.payment.pk)
+        stale.checkout_expires_at = timezone.now() - timedelta(minutes=1)
+        with mock.patch(
+            "users.views.PaymentViewSet.get_object", return_value=stale
+        ), mock.patch(
+            "users.views.StripeService.create_payment_for_course_or_lesson"
+        ) as create:
+            response = self.client.post(
+                f"/api/users/payments/{self.payment.id}/checkout/"
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["checkout_url"], "https://pay/cs_test")
+        create.assert_not_called()
+
+    def test_checkout_only_for_pending_stripe_payment(self):
+        """Тест: оплаченный платеж не получает новую ссылку"""
+        Payment.objects.filter(pk=self.payment.pk).update(status="succeeded")
+        response = self.client.post(f"/api/users/payments/{self.payment.id}/checkout/")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_checkout_reopens_canceled_payment(self):
+        """Тест: платеж, отмененный по истечении сессии, снова ожидает оплаты"""
+        Payment.objects.filter(pk=self.payment.pk).update(
+            status="canceled", checkout_url=None, checkout_expires_at=None
+        )
+        session = SimpleNamespace(id="cs_new", url="https://pay/new", expires_at=None)
+        with mock.patch(
+            "users.services.StripeService.get_catalog_price",
+            return_value=("prod", "price"),
+        ), mock.patch(
+            "users.services.StripeService.create_checkout_session",
+            return_value=session,
+        ):
+            response = self.client.post(
+                f"/api/users/payments/{self.payment.id}/checkout/"
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["status"], "pending")
+        self.assertEqual(response.data["checkout_url"], "https://pay/new")
+
+
+class StripeCatalogTestCase(APITestCase):
+    """
+    Тестирование переиспользования продуктов и цен Stripe при покупках
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="user@example.com", password="x")
+        self.course = Course.objects.create(
+            name="Course", description="Описание", owner=self.user
+        )
+        self.client.force_authenticate(user=self.user)
+        self.stripe = {}
+        for name, prefix in [
+            ("create_product", "prod"),
+            ("create_price", "price"),
+            ("create_checkout_session", "cs"),
+        ]:
+            patcher = mock.patch(
+                f"users.services.StripeService.{name}",
+                side_effect=self.fake_stripe_object(prefix),
+            )
+            self.stripe[name] = patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def fake_stripe_object(prefix):
+        counter = iter(range(1, 1000))
+
+        def create(*args, **kwargs):
+            number = next(counter)
+            return SimpleNamespace(
+                id=f"{prefix}_{number}",
+                url=f"https://pay/{prefix}_{number}",
+                expires_at=int(timezone.now().timestamp()) + 3600,
+            )
+
+        return create
+
+    def buy(self, amount="100.00"):
+        response = self.client.post(
+            "/api/users/payments/",
+            {
+                "user": self.user.id,
+                "paid_course": self.course.id,
+                "amount": amount,
+                "payment_method": "stripe",
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Payment.objects.get(pk=response.data["id"])
+
+    def test_repeat_purchase_is_one_stripe_call(self):
+        """Тест: повторная покупка - только создание сессии"""
+        first = self.buy()
+        second = self.buy()
+        self.assertEqual(self.stripe["create_product"].call_count, 1)
+        self.assertEqual(self.stripe["create_price"].call_count, 1)
+        self.assertEqual(self.stripe["create_checkout_session"].call_count, 2)
+        self.assertEqual(
+            (first.stripe_product_id, first.stripe_price_id),
+            (second.stripe_product_id, second.stripe_price_id),
+        )
+        self.assertEqual(second.stripe_session_id, "cs_2")
+        self.assertEqual(second.checkout_url, "https://pay/cs_2")
+        self.assertEqual(StripeProduct.objects.count(), 1)
+
+    def test_new_price_point_reuses_product(self):
+        """Тест: новая сумма - новая цена того же продукта"""
+        self.buy("100.00")
+        payment = self.buy("150.00")
+        self.buy("100.00")
+        self.assertEqual(self.stripe["create_product"].call_count, 1)
+        self.assertEqual(self.stripe["create_price"].call_count, 2)
+        self.assertEqual(payment.stripe_price_id, "price_2")
+        self.assertEqual(StripePrice.objects.count(), 2)
+
+    def test_changed_description_recreates_product(self):
+        """Тест: после изменения описания создаются новые продукт и цена"""
+        self.buy()
+        self.course.description = "Новое описание"
+        self.course.save()
+        payment = self.buy()
+        self.assertEqual(self.stripe["create_product"].call_count, 2)
+        self.assertEqual(payment.stripe_product_id, "prod_2")
+        self.assertEqual(payment.stripe_price_id, "price_2")
+        self.assertEqual(
+            list(StripePrice.objects.values_list("price_id", flat=True)), ["price_2"]
+        )
+
+    def test_payment_written_once_after_insert(self):
+        """Тест: после INSERT платеж обновляется одним UPDATE"""
+        self.buy()
+        with CaptureQueriesContext(connection) as queries:
+            self.buy()
+        statements = [
+            query["sql"].split()[0]
+            for query in queries.captured_queries
+            if '"users_payment"' in query["sql"].split(" WHERE ")[0]
+            and not query["sql"].startswith("SELECT")
+        ]
+        self.assertEqual(statements, ["INSERT", "UPDATE"])
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET="whsec_test")
+class StripeWebhookTestCase(APITestCase):
+    """
+    Тестирование вебхука Stripe локальным отправителем событий
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="user@example.com", password="x")
+        self.course = Course.objects.create(name="Course", owner=self.user)
+        self.payment = Payment.objects.create(
+            user=self.user,
+            paid_course=self.course,
+            amount=100,
+            payment_method="stripe",
+            status="pending",
+            stripe_session_id="cs_test",
+            checkout_url="https://pay/cs_test",
+            checkout_expires_at=timezone.now() + timedelta(hours=1),
+        )
+        self.sender = FakeStripeEventSender(APIClient(), "whsec_test")
+        # Задача выполняется сразу, как воркер Celery
+        patcher = mock.patch(
+            "users.views.process_stripe_event.delay", side_effect=process_stripe_event
+        )
+        self.delay = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def send(self, method, *args, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.sender, method)(*args, **kwargs)
+        self.payment.refresh_from_db()
+        return response
+
+    def session(self, **fields):
+        return {"id": "cs_test", "payment_status": "unpaid", **fields}
+
+    def test_completed_event_marks_payment_succeeded(self):
+        """Тест: checkout.session.completed переводит платеж в succeeded"""
+        response = self.send("send_completed", self.payment, event_id="evt_1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["status"], "queued")
+        self.assertEqual(self.payment.status, "succeeded")
+        self.assertEqual(self.payment.stripe_payment_intent_id, "pi_cs_test")
+        self.assertIsNotNone(StripeEvent.objects.get(event_id="evt_1").processed_at)
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.purchases_count, 1)
+
+    def test_duplicate_delivery_processed_once(self):
+        """Тест: повторная доставка события не ставит задачу снова"""
+        self.send("send_completed", self.payment, event_id="evt_1")
+        response = self.send("send_completed", self.payment, event_id="evt_1")
+        self.assertEqual(response.json()["status"], "duplicate")
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        self.assertEqual(self.delay.call_count, 1)
+
+    def test_unprocessed_event_requeued_on_redelivery(self):
+        """Тест: событие, задача которого потеряна, ставится при повторной доставке"""
+        self.delay.side_effect = None
+        self.send("send_completed", self.payment, event_id="evt_1")
+        self.assertEqual(self.payment.status, "pending")
+
+        self.delay.side_effect = process_stripe_event
+        response = self.send("send_completed", self.payment, event_id="evt_1")
+        self.assertEqual(response.json()["status"], "queued")
+        self.assertEqual(self.payment.status, "succeeded")
+        # Повтор уже выполненной задачи ничего не меняет
+        event = StripeEvent.objects.get(event_id="evt_1")
+        self.assertIn("уже обработано", process_stripe_event(event.pk))
+
+    def test_invalid_signature_rejected(self):
+        """Тест: событие с чужой подписью или без подписи не принимается"""
+        response = self.send("send_completed", self.payment, secret="whsec_other")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.sender.post("{}", "")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(StripeEvent.objects.exists())
+        self.assertEqual(self.payment.status, "pending")
+
+    def test_unhandled_event_ignored(self):
+        """Тест: события других типов подтверждаются без сохранения"""
+        response = self.send("send", "customer.created", {"id": "cus_test"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["status"], "ignored")
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_expired_event_cancels_pending_payment(self):
+        """Тест: истекшая сессия отменяет платеж и убирает ссылку на оплату"""
+        self.send("send", "checkout.session.expired", self.session())
+        self.assertEqual(self.payment.status, "canceled")
+        self.assertIsNone(self.payment.checkout_url)
+
+    def test_late_event_does_not_roll_back_payment(self):
+        """Тест: запоздавшие события не меняют оплаченный платеж"""
+        self.send("send_completed", self.payment)
+        self.send("send", "checkout.session.expired", self.session())
+        self.send("send", "checkout.session.async_payment_failed", self.session())
+        self.assertEqual(self.payment.status, "succeeded")
+
+    def test_replaced_session_found_by_metadata(self):
+        """Тест: оплата по прежней ссылке засчитывается, ее истечение - нет"""
+        Payment.objects.filter(pk=self.payment.pk).update(stripe_session_id="cs_new")
+        metadata = {"payment_id": str(self.payment.id)}
+        self.send("send", "checkout.session.expired", self.session(metadata=metadata))
+        self.assertEqual(self.payment.status, "pending")
+
+        self.send(
+            "send",
+            "checkout.session.completed",
+            self.session(
+                payment_status="paid", payment_intent="pi_old", metadata=metadata
+            ),
+        )
+        self.assertEqual(self.payment.status, "succeeded")
+        self.assertEqual(self.payment.stripe_session_id, "cs_test")
+        self.assertEqual(self.payment.stripe_payment_intent_id, "pi_old")
+
+    def test_delayed_payment_method(self):
+        """Тест: оплата с подтверждением позже проходит через processing"""
+        self.send("send_completed", self.payment, payment_status="unpaid")
+        self.assertEqual(self.payment.status, "processing")
+        self.send("send", "checkout.session.expired", self.session())
+        self.assertEqual(self.payment.status, "processing")
+        self.send(
+            "send",
+            "checkout.session.async_payment_succeeded",
+            self.session(payment_status="paid", payment_intent="pi_late"),
+        )
+        self.assertEqual(self.payment.status, "succeeded")
+        self.assertEqual(self.payment.stripe_payment_intent_id, "pi_late")
+
+    def test_success_page_reads_status_from_db(self):
+        """Тест: страница успешной оплаты показывает статус после вебхука"""
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = "/api/users/payments/success/?session_id=cs_test"
+        with mock.patch(
+            "users.services.stripe.checkout.Session.retrieve",
+            side_effect=AssertionError("запрос к Stripe"),
+        ):
+            response = client.get(url)
+            self.assertEqual(response.data["status"], "pending")
+
+            self.send("send_completed", self.payment)
+            response = client.get(url)
+        self.assertEqual(response.data["message"], "Оплата прошла успешно")
+        self.assertEqual(response.data["item"], "Course")
+
+
+class StripeGatewayTestCase(SimpleTestCase):
+    """
+    Тестирование шлюза Stripe на локальной заглушке Stripe API
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeStripeServer().start()
+        cls.addClassCleanup(cls.server.stop)
+
+    def setUp(self):
+        self.server.reset()
+        self.now = 0.0
+        self.sleeps = []
+        self.enterContext(self.assertLogs("lms.stripe", "INFO"))
+
+    def get_gateway(self, **kwargs):
+        options = {
+            "base_url": self.server.url,
+            "read_timeout": 0.2,
+            "max_retries": 2,
+            "breaker": CircuitBreaker(3, 30, clock=lambda: self.now),
+            "sleep": self.sleeps.append,
+            **kwargs,
+        }
+        gateway = StripeGateway("sk_test", **options)
+        self.addCleanup(gateway.session.close)
+        return gateway
+
+    def create_session(self, gateway):
+        return gateway.create_checkout_session(
+            {"mode": "payment", "metadata": {"payment_id": "1"}}
+        )
+
+    def test_connection_reused(self):
+        """Тест: запросы идут по одному keep-alive соединению"""
+        gateway = self.get_gateway()
+        session = self.create_session(gateway)
+        self.assertEqual(gateway.retrieve_session(session.id).id, session.id)
+        gateway.create_product({"name": "Course"})
+        self.assertEqual(len({r["client_port"] for r in self.server.requests}), 1)
+
+    def test_retry_reuses_idempotency_key(self):
+        """Тест: повторы создания с одним ключом не создают второй объект"""
+        gateway = self.get_gateway()
+        self.server.fail_next(2, status=503)
+        product = gateway.create_product({"name": "Course"})
+
+        requests = [r for r in self.server.requests if r["path"] == "/v1/products"]
+        self.assertEqual(len(requests), 3)
+        self.assertEqual(len({r["idempotency_key"] for r in requests}), 1)
+        products = [
+            obj for obj in self.server.objects.values() if obj["object"] == "product"
+        ]
+        self.assertEqual([obj["id"] for obj in products], [product.id])
+        self.assertEqual(len(self.sleeps), 2)
+        for attempt, delay in enumerate(self.sleeps):
+            self.assertLessEqual(delay, gateway.retry_backoff * 2**attempt)
+
+    def test_client_error_not_retried(self):
+        """Тест: отказ Stripe (4xx) не повторяется и не открывает автомат"""
+        gateway = self.get_gateway()
+        with self.assertRaises(StripeGatewayError) as error:
+            gateway.retrieve_session("cs_missing")
+        self.assertNotIsInstance(error.exception, StripeUnavailableError)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(gateway.breaker.failures, 0)
+
+    def test_timeout_retries_are_bounded(self):
+        """Тест: таймаут чтения повторяется max_retries раз, затем ошибка"""
+        gateway = self.get_gateway()
+        session = self.create_session(gateway)
+        self.server.delay_next(3, seconds=0.5)
+        with self.assertRaises(StripeUnavailableError):
+            gateway.retrieve_session(session.id)
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_circuit_breaker_fails_fast_and_recovers(self):
+        """Тест: открытый автомат отклоняет вызовы без запроса к Stripe"""
+        gateway = self.get_gateway(max_retries=0)
+        self.server.fail_next(3)
+        for _ in range(3):
+            with self.assertRaises(StripeUnavailableError):
+                gateway.create_product({"name": "Course"})
+        self.assertEqual(gateway.breaker.state, "open")
+
+        with self.assertRaises(StripeUnavailableError):
+            gateway.create_product({"name": "Course"})
+        self.assertEqual(len(self.server.requests), 3)
+
+        # Через reset_timeout проходит пробный вызов, успех закрывает автомат
+        self.now += 30
+        self.assertEqual(gateway.breaker.state, "half-open")
+        gateway.create_product({"name": "Course"})
+        self.assertEqual(gateway.breaker.state, "closed")
+
+    def test_metrics(self):
+        """Тест: метрики считают вызовы, ошибки, повторы и задержки"""
+        gateway = self.get_gateway()
+        self.server.fail_next(1)
+        gateway.create_product({"name": "Course"})
+        with self.assertRaises(StripeGatewayError):
+            gateway.retrieve_session("cs_missing")
+
+        metrics = gateway.metrics.snapshot()
+        self.assertEqual(metrics["create_product"]["calls"], 1)
+        self.assertEqual(metrics["create_product"]["retries"], 1)
+        self.assertEqual(metrics["create_product"]["error_rate"], 0)
+        self.assertEqual(metrics["retrieve_session"]["error_rate"], 1)
+        self.assertGreater(metrics["create_product"]["p95_ms"], 0)
+
+
+class StripePaymentGatewayTestCase(APITestCase):
+    """
+    Тестирование оплаты через Stripe API на локальной заглушке
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeStripeServer().start()
+        cls.addClassCleanup(cls.server.stop)
+
+    def setUp(self):
+        self.enterContext(
+            override_settings(
+                STRIPE_SECRET_KEY="sk_test",
+                STRIPE_API_BASE=self.server.url,
+                STRIPE_RETRY_BACKOFF=0,
+            )
+        )
+        self.enterContext(self.assertLogs("lms.stripe", "INFO"))
+        self.server.reset()
+        self.user = User.objects.create_user(email="user@example.com", password="x")
+        self.course = Course.objects.create(name="Course", price=100, owner=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def buy(self):
+        return self.client.post(
+            "/api/users/payments/create_stripe_payment/",
+            {"course_id": self.course.id},
+            format="json",
+        )
+
+    def test_purchase_creates_checkout_session(self):
+        """Тест: покупка создает сессию Stripe, повторная - только сессию"""
+        response = self.buy()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        payment = Payment.objects.get(pk=response.data["id"])
+        self.assertEqual(payment.status, "pending")
+        self.assertEqual(
+            payment.checkout_url, f"{self.server.url}/pay/{payment.stripe_session_id}"
+        )
+        self.assertIsNotNone(payment.checkout_expires_at)
+        session = self.server.objects[payment.stripe_session_id]
+        self.assertEqual(session["metadata"]["payment_id"], str(payment.id))
+
+        self.server.requests.clear()
+        self.buy()
+        self.assertEqual(
+            [r["path"] for r in self.server.requests], ["/v1/checkout/sessions"]
+        )
+
+        admin = User.objects.create_user(
+            email="admin@example.com", password="x", is_staff=True
+        )
+        self.client.force_authenticate(user=admin)
+        response = self.client.get("/api/users/stripe/stats/")
+        self.assertEqual(response.data["breaker"], "closed")
+        self.assertEqual(
+            response.data["operations"]["create_checkout_session"]["calls"], 2
+        )
+
+    def test_checkout_claims_payment_before_calling_stripe(self):
+        """
+        Тест: новая сессия - новая попытка с ключом идемпотентности из id
+        платежа и номера попытки; пока сессия создается, параллельный
+        запрос получает 409; ошибка Stripe снимает отметку
+        """
+        payment = Payment.objects.get(pk=self.buy().data["id"])
+        Payment.objects.filter(pk=payment.pk).update(
+            checkout_expires_at=timezone.now() - timedelta(minutes=1)
+        )
+        url = f"/api/users/payments/{payment.id}/checkout/"
+
+        self.server.requests.clear()
+        self.server.fail_next(3)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_502_BAD_GATEWAY)
+        payment.refresh_from_db()
+        self.assertEqual(payment.checkout_attempt, 1)
+        self.assertIsNone(payment.checkout_started_at)
+        failed_keys = {r["idempotency_key"] for r in self.server.requests}
+        self.assertEqual(
+            failed_keys, {StripeService.get_checkout_idempotency_key(payment)}
+        )
+
+        Payment.objects.filter(pk=payment.pk).update(checkout_started_at=timezone.now())
+        self.server.requests.clear()
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.server.requests, [])
+
+        # Отметку упавшего процесса перехватывает следующий запрос
+        Payment.objects.filter(pk=payment.pk).update(
+            checkout_started_at=timezone.now() - CHECKOUT_CLAIM_TIMEOUT
+        )
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        payment.refresh_from_db()
+        self.assertEqual(payment.checkout_attempt, 2)
+        self.assertIsNone(payment.checkout_started_at)
+        self.assertEqual(response.data["checkout_url"], payment.checkout_url)
+        self.assertNotIn(self.server.requests[-1]["idempotency_key"], failed_keys)
+
+    def test_stripe_outage_fails_payment(self):
+        """Тест: недоступный Stripe - ошибка 400 и платеж failed"""
+        self.server.fail_next(3)
+        response = self.buy()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Stripe недоступен", str(response.data))
+        self.assertEqual(Payment.objects.get().status, "failed")
+
+
+class ReconcileStripePaymentsTestCase(TestCase):
+    """
+    Тестирование фоновой сверки ожидающих платежей со Stripe на локальной
+    заглушке
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeStripeServer().start()
+        cls.addClassCleanup(cls.server.stop)
+
+    def setUp(self):
+        self.enterContext(
+            override_settings(
+                STRIPE_SECRET_KEY="sk_test",
+                STRIPE_API_BASE=self.server.url,
+                STRIPE_RETRY_BACKOFF=0,
+            )
+        )
+        self.enterContext(self.assertLogs("lms.stripe", "INFO"))
+        self.server.reset()
+        self.user = User.objects.create_user(email="user@example.com", password="x")
+        self.course = Course.objects.create(name="Course", owner=self.user)
+
+    def create_payments(self, states):
+        """
+        Платежи в ожидании оплаты с сессиями в заглушке, по одной на
+        каждое состояние states; сессии созданы с интервалом в 10 минут
+        """
+        started = int(time.time()) - len(states) * 600 - 3600
+        payments = []
+        for number, (session_status, payment_status) in enumerate(states):
+            session = self.server.add_session(
+                created=started + number * 600,
+                status=session_status,
+                payment_status=payment_status,
+                payment_intent=f"pi_{number}" if payment_status == "paid" else None,
+            )
+            payments.append(
+                Payment(
+                    user=self.user,
+                    paid_course=self.course,
+                    amount=100,
+                    payment_method="stripe",
+                    status="pending",
+                    stripe_session_id=session["id"],
+                    checkout_url=session["url"],
+                    checkout_expires_at=datetime.fromtimestamp(
+                        session["created"], tz=dt_timezone.utc
+                    )
+                    + CHECKOUT_SESSION_LIFETIME,
+                )
+            )
+        return Payment.objects.bulk_create(payments)
+
+    def reconcile(self, batch_size=100):
+        return reconcile_stripe_payments(batch_size, min_age=timedelta(0))
+
+    def test_reconcile_with_list_calls(self):
+        """Тест: сверка пачками - по одному запросу списка на пачку"""
+        states = [
+            ("complete", "paid"),
+            ("expired", "unpaid"),
+            ("open", "unpaid"),
+            ("complete", "unpaid"),
+        ] * 60
+        payments = self.create_payments(states)
+
+        stats = self.reconcile()
+        self.assertEqual(stats["payments"], 240)
+        self.assertEqual(stats["batches"], 3)
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["found"], 240)
+        self.assertEqual(stats["changed"], 180)
+        self.assertEqual(stats["succeeded"], 60)
+        self.assertEqual(stats["canceled"], 60)
+        self.assertEqual(stats["processing"], 60)
+        self.assertIsNone(stats["error"])
+        self.assertGreater(stats["payments_per_second"], 0)
+
+        statuses = dict(Payment.objects.values_list("id", "status"))
+        expected = ["succeeded", "canceled", "pending", "processing"]
+        for payment, status_ in zip(payments, expected * 60):
+            self.assertEqual(statuses[payment.id], status_)
+        self.assertIsNone(Payment.objects.get(pk=payments[1].pk).checkout_url)
+        self.assertEqual(
+            Payment.objects.get(pk=payments[0].pk).stripe_payment_intent_id, "pi_0"
+        )
+
+        # Повторная сверка ничего не меняет
+        stats = self.reconcile()
+        self.assertEqual(stats["payments"], 120)
+        self.assertEqual(stats["changed"], 0)
+
+    def test_paginates_within_batch(self):
+        """Тест: сессии пачки ищутся по страницам списка"""
+        payments = self.create_payments([("complete", "paid")] * 150)
+        # Сессии без платежей в том же окне
+        created = self.server.objects[payments[0].stripe_session_id]["created"]
+        for _ in range(120):
+            self.server.add_session(created=created)
+
+        stats = self.reconcile(batch_size=200)
+        self.assertEqual(stats["batches"], 1)
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["succeeded"], 150)
+
+    def test_page_limit_falls_back_to_retrieve(self):
+        """
+        Тест: в плотном окне читается не больше RECONCILE_MAX_PAGES страниц,
+        остальные сессии пачки запрашиваются по id
+        """
+        payments = self.create_payments([("complete", "paid")] * 3)
+        # Чужие сессии в окне пачки, новее сессий платежей
+        created = self.server.objects[payments[-1].stripe_session_id]["created"]
+        for _ in range(250):
+            self.server.add_session(created=created + 60)
+        # Сессия, которой нет в Stripe
+        Payment.objects.filter(pk=payments[0].pk).update(stripe_session_id="cs_gone")
+
+        with mock.patch("users.services.RECONCILE_MAX_PAGES", 2):
+            stats = self.reconcile()
+        self.assertEqual(stats["requests"], 2 + 3)
+        self.assertEqual(stats["retrieved"], 2)
+        self.assertEqual(stats["found"], 2)
+        self.assertEqual(stats["succeeded"], 2)
+        self.assertEqual(Payment.objects.get(pk=payments[0].pk).status, "pending")
+
+    def test_recent_payments_left_to_webhook(self):
+        """Тест: свежие платежи не сверяются"""
+        self.create_payments([("complete", "paid")])
+        stats = reconcile_stripe_payments(100, min_age=timedelta(minutes=10))
+        self.assertEqual(stats["payments"], 0)
+        self.assertEqual(self.server.requests, [])
+
+        stats = self.reconcile()
+        self.assertEqual(stats["succeeded"], 1)
+
+    def test_stripe_outage_stops_reconciliation(self):
+        """Тест: недоступность Stripe прерывает сверку без изменений"""
+        self.create_payments([("complete", "paid")] * 3)
+        self.server.fail_next(3)
+        stats = self.reconcile()
+        self.assertIn("Stripe недоступен", stats["error"])
+        self.assertEqual(stats["changed"], 0)
+        self.assertFalse(Payment.objects.exclude(status="pending").exists())
+
+    @override_settings(STRIPE_RECONCILE_MIN_AGE=0)
+    def test_task_reports_throughput(self):
+        """Тест: задача сообщает объем, запросы к Stripe и скорость сверки"""
+        self.create_payments([("expired", "unpaid")] * 2)
+        result = reconcile_stripe_payments_task()
+        self.assertIn("Сверено 2 платежей Stripe", result)
+        self.assertIn("платежей/с", result)
+        self.assertIn("отменено 2", result)
@@ -8,7 +8,10 @@ from users.views import (
     PaymentSuccessView,
     PaymentCancelView,
     PaymentStatusView,
+    AsyncPaymentStatusView,
     SubscriptionAPIView,
+    StripeWebhookView,
+    StripeGatewayStatsView,
 )
 
 router = DefaultRouter()
@@ -16,16 +19,24 @@ router.register(r"users", UserViewSet, basename="user")
 router.register(r"payments", PaymentViewSet, basename="payment")
 
 urlpatterns = [
+    # До маршрутов роутера: иначе payments/success/ совпадает с payments/{pk}/
+    path("payments/success/", PaymentSuccessView.as_view(), name="payment-success"),
+    path("payments/cancel/", PaymentCancelView.as_view(), name="payment-cancel"),
     path("", include(router.urls)),
     path("token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
     path("register/", UserRegistrationAPIView.as_view(), name="user-register"),
     path("subscriptions/", SubscriptionAPIView.as_view(), name="subscription"),
-    path("payments/success/", PaymentSuccessView.as_view(), name="payment-success"),
-    path("payments/cancel/", PaymentCancelView.as_view(), name="payment-cancel"),
     path(
         "payments/<int:payment_id>/status/",
         PaymentStatusView.as_view(),
         name="payment-status",
     ),
+    path("stripe/webhook/", StripeWebhookView.as_view(), name="stripe-webhook"),
+    path("stripe/stats/", StripeGatewayStatsView.as_view(), name="stripe-stats"),
+    path(
+        "async/payments/<int:payment_id>/status/",
+        AsyncPaymentStatusView.as_view(),
+        name="payment-async-status",
+    ),
 ]
@@ -1,33 +1,50 @@
+import json
+
+from django.db import transaction
 from rest_framework import viewsets, permissions, status, generics
+from asgiref.sync import sync_to_async
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend, FilterSet
 from rest_framework.filters import OrderingFilter
 from rest_framework.views import APIView
-from users.models import Payment, User, Subscription
+from users.models import Payment, StripeEvent, User, Subscription
 from users.serializers import (
     UserSerializer,
     UserDetailSerializer,
     UserRegistrationSerializer,
     PaymentSerializer,
 )
-from users.permissions import IsOwner, IsOwnerOrModerator
+from users.permissions import IsOwner, IsOwnerOrModerator, IsPayerOrModerator
+from users.principal import get_principal
 
 from materials.models import Course, Lesson
 
+from materials.async_views import AsyncAPIView
+from materials.exports import ExportMixin
 from materials.paginators import LessonCoursePagination
-from users.services import StripeService
+from materials.timing import ServerTimingMixin
+from users.services import (
+    STRIPE_WEBHOOK_EVENTS,
+    CheckoutInProgressError,
+    StripeService,
+)
+from users.stripe_gateway import StripeGatewayError, get_stripe_gateway
+from users.tasks import process_stripe_event
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ServerTimingMixin, viewsets.ModelViewSet):
     """
     ViewSet для управления пользователями.
     """
 
-    queryset = User.objects.all()
+    queryset = User.objects.order_by("-date_joined", "-id")
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = LessonCoursePagination
+    cursor_ordering = "-date_joined"
 
     def get_serializer_class(self):
         if self.action == "retrieve":
@@ -46,21 +63,23 @@ class UserViewSet(viewsets.ModelViewSet):
         elif self.action == "list":
             return [permissions.IsAdminUser()]
         elif self.action in ["retrieve", "update", "partial_update", "destroy"]:
-            return [IsOwnerOrModerator | permissions.IsAdminUser]
+            return [(IsOwnerOrModerator | permissions.IsAdminUser)()]
         else:
-            return [permissions.IsAuthenticated]
+            return [permissions.IsAuthenticated()]
 
     def get_queryset(self):
+        principal = get_principal(self.request)
+
         # Админы видят всех пользователей
-        if self.request.user.is_staff:
-            return User.objects.all()
+        if principal.is_staff:
+            return self.queryset.all()
 
         # Модераторы видят всех пользователей
-        if self.request.user.groups.filter(name="moderators").exists():
-            return User.objects.all()
+        if principal.is_moderator:
+            return self.queryset.all()
 
         # Обычные пользователи видят только себя
-        return User.objects.filter(id=self.request.user.id)
+        return self.queryset.filter(id=principal.user_id)
 
     @action(detail=False, methods=["get"])
     def profile(self, request):
@@ -101,9 +120,10 @@ class PaymentFilter(FilterSet):
         }
 
 
-class PaymentViewSet(viewsets.ModelViewSet):
+class PaymentViewSet(ServerTimingMixin, ExportMixin, viewsets.ModelViewSet):
     """
-    ViewSet для платежей с расширенной фильтрацией.
+    ViewSet для платежей с расширенной фильтрацией и выгрузкой
+    в CSV/NDJSON (export/csv/, export/ndjson/).
     """
 
     serializer_class = PaymentSerializer
@@ -113,18 +133,38 @@ class PaymentViewSet(viewsets.ModelViewSet):
     ordering_fields = ["payment_date", "amount"]
     ordering = ["-payment_date"]
     pagination_class = LessonCoursePagination
+    cursor_ordering = "-payment_date"
+    # Колонки выгрузки - поля PaymentSerializer, кроме checkout_url
+    # (ссылка на оплату нужна только владельцу и быстро истекает)
+    export_fields = {
+        "id": "id",
+        "user": "user_id",
+        "user_email": "user__email",
+        "payment_date": "payment_date",
+        "paid_course": "paid_course_id",
+        "course_name": "paid_course__name",
+        "paid_lesson": "paid_lesson_id",
+        "lesson_name": "paid_lesson__name",
+        "amount": "amount",
+        "payment_method": "payment_method",
+        "status": "status",
+        "stripe_session_id": "stripe_session_id",
+    }
+    export_filename = "payments"
 
     def get_permissions(self):
         """
         Настройка прав доступа для платежей:
         - Создание: только аутентифицированные пользователи
-        - Список, детали: владелец или модератор
-        - Обновление, удаление: только владелец
+        - Список, детали, выгрузка: плательщик или модератор
+        - Обновление, удаление: запрещены. У платежа нет владельца owner,
+          поэтому IsOwner отказывает всем: сумму, покупку и статус меняют
+          только Stripe и сверка, а не плательщик
         """
         if self.action == "create":
             self.permission_classes = [permissions.IsAuthenticated]
-        elif self.action in ["list", "retrieve"]:
-            self.permission_classes = [IsOwnerOrModerator]
+        elif self.action in ["list", "retrieve", "export"]:
+            self.permission_classes = [IsPayerOrModerator]
         elif self.action in ["update", "partial_update", "destroy"]:
             self.permission_classes = [IsOwner]
         else:
@@ -133,19 +173,19 @@ class PaymentViewSet(viewsets.ModelViewSet):
         return [permission() for permission in self.permission_classes]
 
     def get_queryset(self):
-        user = self.request.user
+        principal = get_principal(self.request)
 
-        if not user.is_authenticated:
+        if not principal.is_authenticated:
             return Payment.objects.none()
 
         # Модераторы видят все платежи
-        if user.groups.filter(name="moderators").exists():
+        if principal.is_moderator:
             return Payment.objects.select_related(
                 "user", "paid_course", "paid_lesson"
             ).all()
 
         # Обычные пользователи видят только свои платежи
-        return Payment.objects.filter(user=user).select_related(
+        return Payment.objects.filter(user_id=principal.user_id).select_related(
             "user", "paid_course", "paid_lesson"
         )
 
@@ -199,6 +239,42 @@ class PaymentViewSet(viewsets.ModelViewSet):
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=True, methods=["post"])
+    def checkout(self, request, pk=None):
+        """
+        Ссылка на оплату неоплаченного платежа Stripe. Сохраненная ссылка
+        отдается без запроса к Stripe, истекшая заменяется новой сессией.
+        Платеж, отмененный по истечении сессии, снова ожидает оплаты.
+
+        Сессия создается в две короткие транзакции (claim_checkout и
+        сохранение результата), запросы к Stripe - между ними, без
+        блокировки строки платежа. Параллельный запрос (двойной клик)
+        получает 409, пока первый создает сессию, а не вторую сессию
+        """
+        payment = self.get_object()
+        if payment.user_id != request.user.pk:
+            return Response(
+                {"error": "Доступ запрещен"}, status=status.HTTP_403_FORBIDDEN
+            )
+
+        try:
+            payment = StripeService.claim_checkout(payment.pk)
+        except CheckoutInProgressError as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if payment.get_active_checkout_url() is None:
+            try:
+                StripeService.create_payment_for_course_or_lesson(payment)
+            except StripeGatewayError as e:
+                return Response(
+                    {"error": f"Ошибка создания платежа в Stripe: {str(e)}"},
+                    status=status.HTTP_502_BAD_GATEWAY,
+                )
+
+        return Response(self.get_serializer(payment).data)
+
 
 class PaymentSuccessView(APIView):
     """
@@ -215,53 +291,42 @@ class PaymentSuccessView(APIView):
                 {"error": "Не указан session_id"}, status=status.HTTP_400_BAD_REQUEST
             )
 
-        try:
-            # Получаем информацию о сессии из Stripe
-            session = StripeService.retrieve_session(session_id)
-
-            # Находим соответствующий платеж
-            payment = Payment.objects.get(stripe_session_id=session_id)
-
-            # Проверяем, что платеж принадлежит текущему пользователю
-            if payment.user != request.user:
-                return Response(
-                    {"error": "Доступ запрещен"}, status=status.HTTP_403_FORBIDDEN
-                )
-
-            # Обновляем статус платежа
-            if session.payment_status == "paid":
-                payment.status = "succeeded"
-                payment.stripe_payment_intent_id = session.payment_intent
-                payment.save()
-
-                return Response(
-                    {
-                        "message": "Оплата прошла успешно",
-                        "payment_id": payment.id,
-                        "item": (
-                            payment.paid_course.name
-                            if payment.paid_course
-                            else payment.paid_lesson.name
-                        ),
-                    }
-                )
-            else:
-                return Response(
-                    {
-                        "message": "Статус оплаты неизвестен",
-                        "payment_status": session.payment_status,
-                    }
-                )
-
-        except Payment.DoesNotExist:
+        # Статус приходит вебхуком Stripe; до его обработки платеж в ожидании
+        payment = (
+            Payment.objects.select_related("paid_course", "paid_lesson")
+            .filter(stripe_session_id=session_id)
+            .first()
+        )
+        if payment is None:
             return Response(
                 {"error": "Платеж не найден"}, status=status.HTTP_404_NOT_FOUND
             )
-        except Exception as e:
+
+        # Проверяем, что платеж принадлежит текущему пользователю
+        if payment.user_id != request.user.pk:
+            return Response(
+                {"error": "Доступ запрещен"}, status=status.HTTP_403_FORBIDDEN
+            )
+
+        if payment.status == "succeeded":
             return Response(
-                {"error": f"Ошибка при обработке платежа: {str(e)}"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                {
+                    "message": "Оплата прошла успешно",
+                    "payment_id": payment.id,
+                    "item": (
+                        payment.paid_course.name
+                        if payment.paid_course
+                        else payment.paid_lesson.name
+                    ),
+                }
             )
+        return Response(
+            {
+                "message": "Оплата обрабатывается",
+                "payment_id": payment.id,
+                "status": payment.status,
+            }
+        )
 
 
 class PaymentCancelView(APIView):
@@ -277,39 +342,106 @@ class PaymentCancelView(APIView):
         )
 
 
-class PaymentStatusView(APIView):  # NEW
+class PaymentStatusView(ServerTimingMixin, APIView):
     """
-    Проверка статуса платежа
+    Проверка статуса платежа. Статус читается из БД: платежи Stripe
+    обновляет вебхук (StripeWebhookView)
     """
 
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, payment_id):
-        payment = get_object_or_404(Payment, id=payment_id)
+        # Пользователь, курс и урок нужны сериализатору
+        payment = get_object_or_404(
+            Payment.objects.select_related("user", "paid_course", "paid_lesson"),
+            id=payment_id,
+        )
 
         # Проверяем права доступа
-        if payment.user != request.user and not request.user.is_staff:
+        if payment.user_id != request.user.pk and not request.user.is_staff:
             return Response(
                 {"error": "Доступ запрещен"}, status=status.HTTP_403_FORBIDDEN
             )
 
-        # Если платеж через Stripe, обновляем статус
-        if payment.stripe_session_id and payment.status == "pending":
-            try:
-                session = StripeService.retrieve_session(payment.stripe_session_id)
-                if session.payment_status == "paid" and payment.status != "succeeded":
-                    payment.status = "succeeded"
-                    payment.stripe_payment_intent_id = session.payment_intent
-                    payment.save()
-            except Exception:
-                # Если не удалось получить статус, оставляем текущий
-                pass
-
         serializer = PaymentSerializer(payment)
         return Response(serializer.data)
 
 
-class SubscriptionAPIView(APIView):
+class AsyncPaymentStatusView(AsyncAPIView):
+    """
+    Проверка статуса платежа для ASGI: то же чтение из БД, что и в
+    PaymentStatusView, без занятого потока воркера
+    """
+
+    async def handle(self, request, payment_id):
+        payment = (
+            await Payment.objects.select_related("user", "paid_course", "paid_lesson")
+            .filter(id=payment_id)
+            .afirst()
+        )
+        if payment is None:
+            raise NotFound()
+
+        # Проверяем права доступа
+        if payment.user_id != request.user.pk and not request.user.is_staff:
+            return self.render({"error": "Доступ запрещен"}, status.HTTP_403_FORBIDDEN)
+
+        return await sync_to_async(lambda: PaymentSerializer(payment).data)()
+
+
+class StripeWebhookView(ServerTimingMixin, APIView):
+    """
+    Вебхук Stripe. События оплаты с проверенной подписью сохраняются
+    (одно StripeEvent на event_id) и обрабатываются задачей
+    process_stripe_event. Повторная доставка обработанного события только
+    подтверждается, необработанного - ставит задачу снова
+    """
+
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+
+    def post(self, request):
+        try:
+            event = StripeService.construct_webhook_event(
+                request.body, request.headers.get("Stripe-Signature")
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if event.type not in STRIPE_WEBHOOK_EVENTS:
+            return Response({"status": "ignored"})
+
+        stripe_event, _ = StripeEvent.objects.get_or_create(
+            event_id=event.id,
+            defaults={"type": event.type, "payload": json.loads(request.body)},
+        )
+        if stripe_event.processed_at is not None:
+            return Response({"status": "duplicate"})
+
+        # Воркер должен увидеть сохраненное событие
+        transaction.on_commit(lambda: process_stripe_event.delay(stripe_event.pk))
+        return Response({"status": "queued"})
+
+
+class StripeGatewayStatsView(APIView):
+    """
+    Метрики шлюза Stripe этого процесса: состояние автомата отключения,
+    вызовы, ошибки, повторы и задержки по операциям
+    """
+
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        gateway = get_stripe_gateway()
+        return Response(
+            {
+                "breaker": gateway.breaker.state,
+                "operations": gateway.metrics.snapshot(),
+            }
+        )
+
+
+class SubscriptionAPIView(ServerTimingMixin, APIView):
     """
     APIView для управления подпиской на курс
     """